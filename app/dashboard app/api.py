@@ -1,81 +1,377 @@
 # api.py
-from flask import Flask, request, jsonify
-import joblib
+from flask import Flask, Response, request, jsonify
 from more_itertools import one
 import numpy as np
-from psycopg2 import connect
+from psycopg2 import connect, sql
+from psycopg2.extras import execute_values
 import psycopg2
 import json
 import pandas as pd
 from sklearn.metrics import pairwise_distances
+import threading
+import database_credentials
 from database_credentials import *
+from db_pool import ConnectionPool, PoolTimeout
+from product_query import build_product_query, encode_cursor, parse_fields, QueryError
+from schema import ensure_schema, PRODUCT_STATS_AGGREGATE, CHANGE_CHANNEL, CHANGE_POSITION_QUERY, CHANGE_HORIZON_QUERY, COMPUTED_COLUMNS
+from change_feed import ChangeListener
+from serialization import ARROW_MIMETYPE, arrow_available, arrow_schema, arrow_bytes, iter_arrow_stream
+from artifact_store import ARTIFACT_DIR, ArtifactStore
+from neighbors import BACKENDS, DEFAULT_BACKEND
 
 # Create Flask app
 app = Flask(__name__)
 
-# Connection to database
-def connect_to_database():
+# Connection pool settings (can be overridden in database_credentials.py)
+POOL_MIN_SIZE = getattr(database_credentials, "POOL_MIN_SIZE", 1)
+POOL_MAX_SIZE = getattr(database_credentials, "POOL_MAX_SIZE", 10)
+POOL_TIMEOUT = getattr(database_credentials, "POOL_TIMEOUT", 5.0)
+POOL_HEALTH_CHECK_AFTER = getattr(database_credentials, "POOL_HEALTH_CHECK_AFTER", 30.0)
+
+# Rows fetched per round trip by the server-side cursor of streamed (NDJSON) responses
+STREAM_BATCH_SIZE = 2000
+
+# Longest a /products/changes request may wait for a change, and the most changed rows it
+# returns (beyond that the client is told to reload everything)
+CHANGE_FEED_MAX_WAIT = 30.0
+CHANGE_FEED_MAX_ROWS = 1000
+
+# Number of neighbours returned by /products/similar (default and upper bound of k=)
+SIMILAR_PRODUCTS_K = 10
+SIMILAR_PRODUCTS_MAX_K = 100
+
+# Longest validity (seconds) a client may ask for a job lease
+JOB_LEASE_MAX_TTL = 3600.0
+
+# Clustering artifacts written by the dashboard (can be overridden in database_credentials.py)
+CLUSTERING_ARTIFACT_DIR = getattr(database_credentials, "CLUSTERING_ARTIFACT_DIR", ARTIFACT_DIR)
+
+_pool = None
+_pool_lock = threading.Lock()
+_change_listener = None
+_change_listener_lock = threading.Lock()
+_artifact_store = ArtifactStore(CLUSTERING_ARTIFACT_DIR)
+_clustering_state = (None, None)   # (version, ClusteringState)
+_clustering_state_lock = threading.Lock()
+
+# Connection pool to database (created on first use)
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(minconn=POOL_MIN_SIZE,
+                                      maxconn=POOL_MAX_SIZE,
+                                      timeout=POOL_TIMEOUT,
+                                      health_check_after=POOL_HEALTH_CHECK_AFTER,
+                                      database=DATABASE,
+                                      user=USER,
+                                      host=HOST,
+                                      password=PASSWORD,
+                                      port=PORT)
+                # Make sure the maintained columns/indexes exist before serving requests
+                with pool.connection() as conn:
+                    ensure_schema(conn)
+                _pool = pool
+                print("✅Connection pool ok")
+    return _pool
+
+# LISTEN/NOTIFY follower used by /products/changes (started on first use)
+def get_change_listener():
+    global _change_listener
+    if _change_listener is None:
+        with _change_listener_lock:
+            if _change_listener is None:
+                with get_pool().connection() as conn:
+                    position = current_change_position(conn)
+                listener = ChangeListener(CHANGE_CHANNEL,
+                                          database=DATABASE,
+                                          user=USER,
+                                          host=HOST,
+                                          password=PASSWORD,
+                                          port=PORT)
+                listener.start(position)
+                _change_listener = listener
+    return _change_listener
+
+# Borrow a pooled connection; it is rolled back and returned to the pool when the block exits
+def get_connection():
+    return get_pool().connection()
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({"error": str(e)}), 503
+
+@app.errorhandler(psycopg2.OperationalError)
+def handle_database_unavailable(e):
+    print("❌Connection failed")
+    return jsonify({"error": "Database connection failed"}), 503
+
+@app.errorhandler(QueryError)
+def handle_query_error(e):
+    return jsonify({"error": str(e)}), 400
+
+_product_columns = None
+
+# Column names of the product table (used to validate `fields=` projections)
+def get_product_columns(conn):
+    global _product_columns
+    if _product_columns is None:
+        cur = conn.cursor()
+        cur.execute('SELECT * FROM product LIMIT 0;')
+        _product_columns = [desc[0] for desc in cur.description]
+        cur.close()
+    return _product_columns
+
+# Clients ask for a streamed export with ?stream=1 or `Accept: application/x-ndjson`
+def wants_stream():
+    if request.args.get("stream") == "1":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson"
+
+# Clients that can decode Arrow ask for it with `Accept: application/vnd.apache.arrow.stream`
+def wants_arrow():
+    if not arrow_available():
+        return False
+    return request.accept_mimetypes.best_match(["application/json", ARROW_MIMETYPE]) == ARROW_MIMETYPE
+
+# Stream the rows of a query (one product per NDJSON line, or one Arrow record batch per
+# fetch) through a server-side cursor, so neither the API nor the client ever holds the
+# whole result in memory
+def stream_products(query, params, arrow=False):
+    pool = get_pool()
+    conn = pool.getconn()
     try:
-        conn = psycopg2.connect(database = DATABASE, 
-                                user = USER, 
-                                host= HOST,
-                                password = PASSWORD,
-                                port = PORT)
-        print("✅Connection ok")
-        return conn
-    except:
-        print("❌Connection failed")
-
-# Get all products
+        # Named cursor = server-side cursor: rows stay in PostgreSQL until fetched
+        cur = conn.cursor(name="product_stream")
+        cur.execute(query, params)
+        rows = cur.fetchmany(STREAM_BATCH_SIZE)
+        description = cur.description
+        columns = [desc[0] for desc in description]
+    except Exception:
+        pool.putconn(conn, discard=True)
+        raise
+
+    released = False
+
+    def release():
+        nonlocal released
+        if released:
+            return
+        released = True
+        try:
+            cur.close()
+        except psycopg2.Error:
+            pass
+        pool.putconn(conn)
+
+    def row_batches():
+        batch = rows
+        while batch:
+            yield batch
+            batch = cur.fetchmany(STREAM_BATCH_SIZE)
+
+    def generate():
+        try:
+            if arrow:
+                yield from iter_arrow_stream(arrow_schema(description), row_batches())
+            else:
+                for batch in row_batches():
+                    yield "".join(app.json.dumps(dict(zip(columns, row))) + "\n" for row in batch)
+        finally:
+            release()
+
+    response = Response(generate(), mimetype=ARROW_MIMETYPE if arrow else "application/x-ndjson")
+    # Also return the connection when the client disconnects or the body is never read
+    response.call_on_close(release)
+    return response
+
+# Run a paginated/filtered product listing and return it as JSON (or Arrow, see wants_arrow);
+# the cursor of the next page (if any) is returned in the X-Next-Cursor header. Streamed
+# requests return every matching row (from `cursor` on, `limit` is ignored).
+def query_products(base_conditions=()):
+    arrow = wants_arrow()
+
+    if wants_stream():
+        args = request.args.copy()
+        args.pop("limit", None)
+        with get_connection() as conn:
+            columns = get_product_columns(conn)
+        query, params, _ = build_product_query(args, columns, base_conditions)
+        return stream_products(query, params, arrow=arrow)
+
+    with get_connection() as conn:
+        query, params, limit = build_product_query(request.args, get_product_columns(conn), base_conditions)
+        cur = conn.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        description = cur.description
+        cur.close()
+
+    columns = [desc[0] for desc in description]
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(dict(zip(columns, rows[-1])), request.args)
+
+    if arrow:
+        response = Response(arrow_bytes(arrow_schema(description), rows), mimetype=ARROW_MIMETYPE)
+    else:
+        # map rows to list[dict] using column names so jsonify can serialize it
+        response = jsonify([dict(zip(columns, row)) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+# Pool metrics (in use, idle, wait time) for sizing the pool
+@app.route("/pool/stats", methods=["GET"])
+def get_pool_stats():
+    return jsonify(get_pool().stats())
+
+# Latest stored clustering state, memory-mapped on first use and reloaded when the
+# dashboard saved a newer version. None when nothing was clustered yet.
+def get_clustering_state():
+    global _clustering_state
+    version = _artifact_store.latest_version()
+    with _clustering_state_lock:
+        if version != _clustering_state[0]:
+            _clustering_state = (version, _artifact_store.load(version) if version is not None else None)
+        return _clustering_state[1]
+
+# Metadata of the stored clustering artifacts (version, input hash, sizes) and the version this process loaded
+@app.route("/clustering/artifacts", methods=["GET"])
+def get_clustering_artifacts():
+    state = get_clustering_state()
+    if state is None:
+        return jsonify({"error": "No clustering artifacts stored yet"}), 404
+    meta = _artifact_store.metadata(_clustering_state[0])
+    meta["loaded_products"] = len(state)
+    return jsonify(meta)
+
+# Get all products (supports fields=, filters and keyset pagination, see product_query.py)
 @app.route("/products", methods=["GET"])
 def get_all_products():
-    conn = connect_to_database()
+    return query_products()
+
+# Product counters in one round trip: read from the trigger-maintained product_stats row
+# (see schema.py), falling back to a single FILTER aggregate over the product table
+def read_product_stats(conn):
     cur = conn.cursor()
-    cur.execute('SELECT * FROM product;')
-    rows = cur.fetchall()
-    conn.commit()
-    conn.close()
+    cur.execute('SELECT total_products, verified_products, incomplete_products, newly_added_products, scan_sum FROM product_stats;')
+    row = cur.fetchone()
+    if row is None:
+        cur.execute(PRODUCT_STATS_AGGREGATE.format(table="product"))
+        row = cur.fetchone()
+    cur.close()
 
-    # map rows to list[dict] using column names so jsonify can serialize it
-    columns = [desc[0] for desc in cur.description]
-    results = [dict(zip(columns, row)) for row in rows]
+    return {
+        'total_products': row[0],
+        'verified_products': row[1],
+        'incomplete_products': row[2],
+        'newly_added_products': row[3],
+        'scan_sum': row[4],
+    }
+
+# Conditional GET: the client sends back the ETag of its cached copy in If-None-Match
+def is_not_modified(etag):
+    return request.if_none_match.contains(etag)
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+# Change-feed position: every product change of a transaction below it is committed (see schema.py).
+def current_change_position(conn):
+    cur = conn.cursor()
+    cur.execute(CHANGE_POSITION_QUERY)
+    position = cur.fetchone()[0]
     cur.close()
-    
-    return jsonify(results)
+    return position
+
+# Change feed: products written and ids deleted from change position `since` up to the current
+# position (`last_seq`), i.e. by the transactions that ended in between, whatever their commit order.
+# Without `since` it only returns the current `last_seq` to start following from.
+# With `wait=<seconds>` the request is held (long-poll, no database work) until a change is
+# committed, so idle clients cost close to nothing and see changes as soon as they happen.
+@app.route("/products/changes", methods=["GET"])
+def get_product_changes():
+    since = request.args.get("since", type=int)
+    wait = min(request.args.get("wait", default=0.0, type=float), CHANGE_FEED_MAX_WAIT)
+
+    if since is not None and wait > 0:
+        get_change_listener().wait_for(since, wait)
+
+    with get_connection() as conn:
+        stats = read_product_stats(conn)
+        # Read before the rows: the statements below see every change of the transactions under it
+        last_seq = current_change_position(conn)
+        result = {"last_seq": last_seq, "changed": [], "deleted": [], "truncated": False, "stats": stats}
+        if since is None or last_seq <= since:
+            return jsonify(result)
+
+        fields = parse_fields(request.args.get("fields"), get_product_columns(conn))
+        select = sql.SQL(", ").join(sql.Identifier(f) for f in fields) if fields else sql.SQL("*")
+
+        cur = conn.cursor()
+        cur.execute(sql.SQL('SELECT {} FROM product WHERE change_xid >= %s::xid8 AND change_xid < %s::xid8 '
+                            'ORDER BY change_xid LIMIT %s;').format(select),
+                    (str(since), str(last_seq), CHANGE_FEED_MAX_ROWS + 1))
+        rows = cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
+
+        cur.execute('SELECT DISTINCT id FROM product_deletions WHERE change_xid >= %s::xid8 AND change_xid < %s::xid8;',
+                    (str(since), str(last_seq)))
+        result["deleted"] = [row[0] for row in cur.fetchall()]
+        # Read after the deletions: a prune they missed has raised the horizon already
+        cur.execute(CHANGE_HORIZON_QUERY)
+        horizon = cur.fetchone()
+        cur.close()
+
+    if len(rows) > CHANGE_FEED_MAX_ROWS or (horizon is not None and since < horizon[0]):
+        # Too many changes (e.g. after re-clustering), or deletions since `since` already pruned:
+        # the client should reload instead
+        result["truncated"] = True
+    else:
+        result["changed"] = [dict(zip(columns, row)) for row in rows]
+    return jsonify(result)
 
 @app.route("/products/count", methods=["GET"])
 def get_products_count():
-    conn = connect_to_database()
-    cur = conn.cursor()
-    try:
-        cur.execute('SELECT COUNT(*), SUM(scan_count) FROM product;')
-        row = cur.fetchone()
-        count = row[0]
-        scan_sum = row[1] if row[1] is not None else 0
-        return jsonify({"count": count, "scan_sum": scan_sum})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cur.close()
-        conn.close()
+    with get_connection() as conn:
+        stats = read_product_stats(conn)
+    return jsonify({"count": stats['total_products'], "scan_sum": stats['scan_sum']})
 
 @app.route("/products/<int:product_id>", methods=["GET"])
 def get_product_by_id(product_id):
-    conn = connect_to_database()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM product WHERE id = %s;', (product_id,))
-    row = cur.fetchone()
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # The row's change_seq is its version: if the client already has it, skip the row entirely
+        cur.execute('SELECT change_seq FROM product WHERE id = %s;', (product_id,))
+        version = cur.fetchone()
+        if version is None:
+            cur.close()
+            return jsonify({"error": "Product not found"}), 404
+
+        etag = f"product-{product_id}-{version[0]}"
+        if is_not_modified(etag):
+            cur.close()
+            return not_modified(etag)
+
+        cur.execute('SELECT * FROM product WHERE id = %s;', (product_id,))
+        row = cur.fetchone()
+        columns = [desc[0] for desc in cur.description]
+        cur.close()
 
     if row is None:
         return jsonify({"error": "Product not found"}), 404
     
-    columns = [desc[0] for desc in cur.description]
     result = dict(zip(columns, row))
-    cur.close()
     
-    return jsonify(result)
+    response = jsonify(result)
+    response.set_etag(etag)
+    return response
 
 @app.route("/products/<int:product_id>", methods=["PUT"])
 def update_product(product_id):
@@ -87,7 +383,7 @@ def update_product(product_id):
     set_clauses = []
     values = []
     for key, value in data.items():
-        if key == 'id': continue # Don't update ID
+        if key == 'id' or key in COMPUTED_COLUMNS: continue # Don't update ID or the columns the database maintains
         set_clauses.append(f"{key} = %s")
         values.append(value)
     
@@ -98,138 +394,163 @@ def update_product(product_id):
     
     query = f"UPDATE product SET {', '.join(set_clauses)} WHERE id = %s RETURNING id;"
     
-    conn = None
-    cur = None
-    try:
-        conn = connect_to_database()
+    with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(query, tuple(values))
-        updated_row = cur.fetchone()
-        conn.commit()
-        
-        if updated_row:
-            return jsonify({"success": True, "id": updated_row[0]}), 200
-        else:
-            return jsonify({"error": "Product not found"}), 404
+        try:
+            cur.execute(query, tuple(values))
+            updated_row = cur.fetchone()
+            conn.commit()
             
-    except Exception as e:
-        if conn: conn.rollback()
-        return jsonify({"error": str(e)}), 500
-    finally:
-        if cur: cur.close()
-        if conn: conn.close()
-
-# Get all incompleted products
+            if updated_row:
+                return jsonify({"success": True, "id": updated_row[0]}), 200
+            else:
+                return jsonify({"error": "Product not found"}), 404
+                
+        except psycopg2.Error as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cur.close()
+
+# Get all incompleted products (inactive products with at least one empty field), most scanned first.
+# is_incomplete/missing_field_count are maintained by a trigger (see schema.py) and the listing is
+# served from a partial index, so only qualifying rows are read.
 @app.route("/products/incompleted", methods=["GET"])
 def get_all_incompleted_products():
-    conn = connect_to_database()
-    cur = conn.cursor()
-    # Use a simple SELECT and filter incomplete rows (rows with any NULL) in Python
-    cur.execute('SELECT * FROM product WHERE active = 0 ORDER BY scan_count DESC;')
-    rows = cur.fetchall()
-
-    # map rows to list[dict] using column names so jsonify can serialize it
-    columns = [desc[0] for desc in cur.description]
-    results = [dict(zip(columns, row)) for row in rows]
-
-    # filter for incomplete products (any field is None)
-    incompleted = [r for r in results if any(v is None for v in r.values())]
-
-    cur.close()
-    conn.commit()
-    conn.close()
-    
-    return jsonify(incompleted)
+    return query_products(base_conditions=("active = 0", "is_incomplete"))
 
 # Get all products that are alike product {id}
 @app.route("/products/alike/<int:product_id>/<int:cluster_id>", methods=["GET"])
 def get_alike_products(product_id, cluster_id):
-    conn = connect_to_database()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM product WHERE cluster_id = %s AND id != %s;', (cluster_id, product_id,))
-    rows = cur.fetchall()
-    
-    # map rows to list[dict] using column names so jsonify can serialize it
-    columns = [desc[0] for desc in cur.description] if cur.description else []
+    with get_connection() as conn:
+        # Versioned on the cluster's own rows: a row written into it gets a higher change_seq than
+        # any before, and a row leaving it (or deleted) lowers the count
+        cur = conn.cursor()
+        cur.execute('SELECT COUNT(*), MAX(change_seq) FROM product WHERE cluster_id = %s AND id != %s;',
+                    (cluster_id, product_id))
+        count, last_change = cur.fetchone()
+        etag = f"alike-{product_id}-{cluster_id}-{count}-{last_change}"
+        if is_not_modified(etag):
+            cur.close()
+            return not_modified(etag)
+
+        cur.execute('SELECT * FROM product WHERE cluster_id = %s AND id != %s;', (cluster_id, product_id,))
+        rows = cur.fetchall()
+        
+        # map rows to list[dict] using column names so jsonify can serialize it
+        columns = [desc[0] for desc in cur.description] if cur.description else []
+        cur.close()
+
     results = [dict(zip(columns, row)) for row in rows] if rows else []
     
-    cur.close()
-    conn.close()
-    
+    response = jsonify(results)
+    response.set_etag(etag)
+    return response
+
+# Top-k most similar products (cosine similarity of the product texts) from the neighbour index over the
+# stored clustering state; supports k=, backend= (see neighbors.BACKENDS; "graph" needs a state clustered
+# with the SVD stage) and fields=
+@app.route("/products/similar/<int:product_id>", methods=["GET"])
+def get_similar_products(product_id):
+    k = request.args.get("k", default=SIMILAR_PRODUCTS_K, type=int)
+    if k is None or not 1 <= k <= SIMILAR_PRODUCTS_MAX_K:
+        raise QueryError(f"'k' must be an integer between 1 and {SIMILAR_PRODUCTS_MAX_K}")
+    backend = request.args.get("backend", DEFAULT_BACKEND)
+    if backend not in BACKENDS:
+        raise QueryError(f"Unknown backend '{backend}', expected one of {', '.join(sorted(BACKENDS))}")
+
+    state = get_clustering_state()
+    if state is None:
+        return jsonify({"error": "Products have not been clustered yet"}), 404
+    row = np.flatnonzero(state.product_ids == product_id)
+    if not row.size:
+        return jsonify({"error": f"Product {product_id} has not been clustered yet"}), 404
+
+    # One extra neighbour, since the product itself is (normally) its own best match
+    try:
+        neighbour_index = state.neighbour_index(backend)
+    except ValueError as e:
+        raise QueryError(str(e))
+    indices, sims = neighbour_index.kneighbors(state.search_vectors[row], k + 1)
+    similarity = {}
+    for index, sim in zip(indices[0], sims[0]):
+        neighbour_id = int(state.product_ids[index]) if index >= 0 else None
+        if neighbour_id is not None and neighbour_id != product_id and len(similarity) < k:
+            similarity[neighbour_id] = float(sim)
+    if not similarity:
+        return jsonify([])
+
+    with get_connection() as conn:
+        fields = parse_fields(request.args.get("fields"), get_product_columns(conn))
+        select = sql.SQL(", ").join(sql.Identifier(f) for f in fields) if fields else sql.SQL("*")
+        cur = conn.cursor()
+        cur.execute(sql.SQL('SELECT {} FROM product WHERE id = ANY(%s);').format(select), (list(similarity),))
+        rows = cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
+        cur.close()
+
+    results = [dict(zip(columns, row)) for row in rows]
+    for result in results:
+        result["similarity"] = similarity[result["id"]]
+    results.sort(key=lambda r: -r["similarity"])
     return jsonify(results)
 
 @app.route("/products/link/<int:source_product_id>/<int:destination_product_id>", methods=["PUT"])
 def link_product(source_product_id, destination_product_id):
-    conn = None
-    cur = None
-    try:
-        conn = connect_to_database()
-        if conn is None:
-            raise RuntimeError("Failed to establish database connection")
+    with get_connection() as conn:
         cur = conn.cursor()
-        # return the updated row id so we can detect if update affected a row
-        cur.execute('UPDATE product SET link_to = %s WHERE id = %s RETURNING id;', (destination_product_id, source_product_id,))
-        updated = cur.fetchone()
-        conn.commit()
-        if not updated:
-            return jsonify({"error": f"Product {source_product_id} not found or not updated"}), 404
-        return jsonify({"success": True, "updated_id": updated[0]}), 200
-    except Exception as e:
-        # attempt rollback if possible
         try:
-            if conn:
-                conn.rollback()
-        except Exception:
-            pass
-        return jsonify({"error": str(e)}), 500
-    finally:
-        try:
-            if cur:
-                cur.close()
-        except Exception:
-            pass
-        try:
-            if conn:
-                conn.close()
-        except Exception:
-            pass
+            # return the updated row id so we can detect if update affected a row
+            cur.execute('UPDATE product SET link_to = %s WHERE id = %s RETURNING id;', (destination_product_id, source_product_id,))
+            updated = cur.fetchone()
+            conn.commit()
+            if not updated:
+                return jsonify({"error": f"Product {source_product_id} not found or not updated"}), 404
+            return jsonify({"success": True, "updated_id": updated[0]}), 200
+        except psycopg2.Error as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cur.close()
         
 @app.route("/products/incomplete/alike", methods=["GET"])
 def get_incomplete_products_with_alike_products():
-    conn = connect_to_database()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM product WHERE active = 0 AND cluster_count != 1;')
-    rows = cur.fetchall()
-    
-    # map rows to list[dict] using column names so jsonify can serialize it
-    columns = [desc[0] for desc in cur.description] if cur.description else []
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT * FROM product WHERE active = 0 AND cluster_count != 1;')
+        rows = cur.fetchall()
+        
+        # map rows to list[dict] using column names so jsonify can serialize it
+        columns = [desc[0] for desc in cur.description] if cur.description else []
+        cur.close()
+
     results = [dict(zip(columns, row)) for row in rows] if rows else []
     
-    cur.close()
-    conn.close()
-    
     return jsonify(results)
 
 @app.route("/products/latest", methods=["GET"])
 def get_latest_product():
-    conn = connect_to_database()
-    cur = conn.cursor()
-    try:
-        # Assuming 'id' is auto-incrementing, the highest ID is the latest
-        cur.execute('SELECT * FROM product WHERE newly_added = 1;')
-        row = cur.fetchone()
-        
-        if row:
-            columns = [desc[0] for desc in cur.description]
-            result = dict(zip(columns, row))
-            return jsonify(result)
-        return jsonify({"error": "No products found"}), 404
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cur.close()
-        conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # Assuming 'id' is auto-incrementing, the highest ID is the latest
+            cur.execute('SELECT * FROM product WHERE newly_added = 1;')
+            row = cur.fetchone()
+            
+            if row:
+                columns = [desc[0] for desc in cur.description]
+                result = dict(zip(columns, row))
+                return jsonify(result)
+            return jsonify({"error": "No products found"}), 404
+        except psycopg2.Error as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cur.close()
 
+# Bulk write-back of cluster assignments: the (id, cluster_id, cluster_count) triples are
+# staged into a temp table with execute_values, then applied with one UPDATE ... FROM that
+# skips rows whose assignment did not change
 @app.route("/products/update/cluster", methods=["PUT"])
 def update_cluster_id():
     data = request.get_json()
@@ -239,14 +560,8 @@ def update_cluster_id():
         
     if isinstance(data, dict):
         data = [data]
-        
-    conn = connect_to_database()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
-        
-    cur = conn.cursor()
-    updated_count = 0
-    
+
+    assignments = {}
     try:
         for item in data:
             product_id = item.get('id')
@@ -257,24 +572,44 @@ def update_cluster_id():
             cluster_count = item.get('cluster_count')
                 
             if product_id is not None and cluster_id is not None:
-                if cluster_count is not None:
-                    cur.execute('UPDATE product SET cluster_id = %s, cluster_count = %s WHERE id = %s;', (int(cluster_id), int(cluster_count), int(product_id)))
-                else:
-                    cur.execute('UPDATE product SET cluster_id = %s WHERE id = %s;', (int(cluster_id), int(product_id)))
-                updated_count += 1
+                # Last assignment wins if an id is posted twice
+                assignments[int(product_id)] = (int(product_id), int(cluster_id), int(cluster_count) if cluster_count is not None else None)
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Invalid cluster assignment: {e}"}), 400
         
-        conn.commit()
-        return jsonify({"success": True, "updated_count": updated_count}), 200
-    except Exception as e:
-        if conn:
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute('CREATE TEMP TABLE cluster_updates (id integer PRIMARY KEY, cluster_id integer NOT NULL, cluster_count integer) ON COMMIT DROP;')
+            execute_values(cur, 'INSERT INTO cluster_updates (id, cluster_id, cluster_count) VALUES %s;',
+                           list(assignments.values()), page_size=5000)
+            cur.execute("""
+                UPDATE product AS p
+                SET cluster_id = u.cluster_id,
+                    cluster_count = COALESCE(u.cluster_count, p.cluster_count)
+                FROM cluster_updates AS u
+                WHERE p.id = u.id
+                  AND (p.cluster_id IS DISTINCT FROM u.cluster_id
+                       OR (u.cluster_count IS NOT NULL AND p.cluster_count IS DISTINCT FROM u.cluster_count));
+            """)
+            updated_count = cur.rowcount
+            cur.execute('SELECT COUNT(*) FROM cluster_updates AS u JOIN product AS p ON p.id = u.id;')
+            matched_count = cur.fetchone()[0]
+            conn.commit()
+            return jsonify({
+                "success": True,
+                "received_count": len(data),
+                "matched_count": matched_count,
+                "updated_count": updated_count,
+                "unchanged_count": matched_count - updated_count,
+            }), 200
+        except psycopg2.Error as e:
             conn.rollback()
-        return jsonify({"error": str(e)}), 500
-    finally:
-        if cur:
+            return jsonify({"error": str(e)}), 500
+        finally:
             cur.close()
-        if conn:
-            conn.close()
             
+# Clear the newly_added flag of the posted products in one statement
 @app.route("/products/update/newly_added_products", methods=["PUT"])
 def update_newly_added_products():
     data = request.get_json()
@@ -284,76 +619,86 @@ def update_newly_added_products():
         
     if isinstance(data, dict):
         data = [data]
-        
-    conn = connect_to_database()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
-        
-    cur = conn.cursor()
-    
+
     try:
-        for item in data:
-            product_id = item.get('id')
-            
-            if product_id is not None:
-                cur.execute('UPDATE product SET newly_added = 0 WHERE id = %s;', (int(product_id),))
+        product_ids = [int(item.get('id')) for item in data if item.get('id') is not None]
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Invalid product id: {e}"}), 400
         
-        conn.commit()
-        return jsonify({"success": True}), 200
-    except Exception as e:
-        if conn:
+    with get_connection() as conn:
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('UPDATE product SET newly_added = 0 WHERE id = ANY(%s) AND newly_added IS DISTINCT FROM 0;', (product_ids,))
+            updated_count = cur.rowcount
+            conn.commit()
+            return jsonify({"success": True, "received_count": len(data), "updated_count": updated_count}), 200
+        except psycopg2.Error as e:
             conn.rollback()
-        return jsonify({"error": str(e)}), 500
-    finally:
-        if cur:
+            return jsonify({"error": str(e)}), 500
+        finally:
             cur.close()
-        if conn:
-            conn.close()
     
 
+# Get all newly added products (supports the same fields=/pagination/streaming options as /products)
 @app.route("/products/new", methods=["GET"])
 def get_all_newly_added_products():
-    conn = connect_to_database()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM product WHERE active = 0 AND newly_added = 1;')
-    rows = cur.fetchall()
-    
-    # map rows to list[dict] using column names so jsonify can serialize it
-    columns = [desc[0] for desc in cur.description] if cur.description else []
-    results = [dict(zip(columns, row)) for row in rows] if rows else []
-    
-    cur.close()
-    conn.close()
-    
-    return jsonify(results)
+    return query_products(base_conditions=("active = 0", "newly_added = 1"))
 
 @app.route("/products/stats", methods=["GET"])
 def get_product_stats():
-    conn = connect_to_database()
-    cur = conn.cursor()
-    
-    stats = {}
-    
-    # Total products
-    cur.execute("SELECT COUNT(*) FROM product;")
-    stats['total_products'] = cur.fetchone()[0]
-    
-    # Total verified products
-    cur.execute("SELECT COUNT(*) FROM product WHERE active=1;")
-    stats['verified_products'] = cur.fetchone()[0]
-    
-    # Total incomplete products
-    cur.execute("SELECT COUNT(*) FROM product WHERE active=0;")
-    stats['incomplete_products'] = cur.fetchone()[0]
-    
-    # Newly added products
-    cur.execute("SELECT COUNT(*) FROM product WHERE newly_added=1;")
-    stats['newly_added_products'] = cur.fetchone()[0]
-    
-    cur.close()
-    conn.close()
-    
-    return jsonify(stats)
+    with get_connection() as conn:
+        stats = read_product_stats(conn)
+    # The counters are the whole response, so they are their own version
+    etag = "stats-" + "-".join(str(stats[key]) for key in sorted(stats))
+    if is_not_modified(etag):
+        return not_modified(etag)
+
+    response = jsonify(stats)
+    response.set_etag(etag)
+    return response
+
+# Single-flight leases of the dashboard's background jobs (see schema.py and jobs.JobRunner).
+# POST takes or renews the lease of `key` for {"owner", "ttl"}: 200 when `owner` holds it now,
+# 409 while another owner holds an unexpired one. DELETE gives it up if `owner` still holds it.
+@app.route("/jobs/leases/<key>", methods=["POST"])
+def acquire_job_lease(key):
+    data = request.get_json(silent=True) or {}
+    owner, ttl = data.get("owner"), data.get("ttl")
+    if not isinstance(owner, str) or not owner:
+        raise QueryError("'owner' must be a non-empty string")
+    if not isinstance(ttl, (int, float)) or not 0 < ttl <= JOB_LEASE_MAX_TTL:
+        raise QueryError(f"'ttl' must be a number of seconds between 0 and {JOB_LEASE_MAX_TTL:g}")
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO job_leases (key, owner, expires_at) VALUES (%s, %s, now() + %s * interval '1 second')
+            ON CONFLICT (key) DO UPDATE SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+            WHERE job_leases.owner = EXCLUDED.owner OR job_leases.expires_at < now()
+            RETURNING owner;
+        """, (key, owner, float(ttl)))
+        acquired = cur.fetchone() is not None
+        if not acquired:
+            cur.execute('SELECT owner FROM job_leases WHERE key = %s;', (key,))
+            holder = cur.fetchone()
+        conn.commit()
+        cur.close()
+
+    if not acquired:
+        return jsonify({"error": f"Lease '{key}' is held by another job", "owner": holder[0] if holder else None}), 409
+    return jsonify({"key": key, "owner": owner}), 200
+
+@app.route("/jobs/leases/<key>", methods=["DELETE"])
+def release_job_lease(key):
+    owner = (request.get_json(silent=True) or {}).get("owner")
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM job_leases WHERE key = %s AND owner = %s;', (key, owner))
+        released = cur.rowcount > 0
+        conn.commit()
+        cur.close()
+    return jsonify({"released": released}), 200
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
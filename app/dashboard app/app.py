@@ -4,15 +4,26 @@ import plotly.express as px
 import requests
 import re
 import json
-from services import get_incompleted_products, get_product_info, get_all_products, get_alike_products, link_product, get_incomplete_products_with_alike_products, update_product_info, get_products_count, get_latest_product, get_all_newly_added_products, re_clustering, get_product_stats
+import time
+from services import get_product_info, get_products_info, get_alike_products, link_product, update_product_info, submit_clustering_job, get_clustering_job, cancel_clustering_job, get_feature_similarities
 # predict_cluster
-from tool_functions import _sanitize_id, render_field, render_table, render_alike_products_table
+from tool_functions import _sanitize_id, render_field, render_virtual_table, table_window, render_alike_products_table, VIRTUAL_TABLE_MAX_ROWS
 from shared import app_dir
 from shinywidgets import output_widget, render_plotly
 from shiny import App, reactive, render, ui
 import pandas as pd
+import numpy as np
 from components import _ClickedProducts
-import joblib
+from schema import COMPUTED_COLUMNS
+from jobs import DONE, CANCELLED, FINISHED_STATES, JobConflict
+from features import NUTRITION_COLS, nutrition_similarities
+from product_cache import ListingQuery, shared_products
+
+# Seconds between two looks at the clustering job (while one runs / while none runs)
+JOB_POLL_INTERVAL = 1
+JOB_IDLE_POLL_INTERVAL = 5
+# Seconds the search box has to stay unchanged before the tables are filtered
+SEARCH_DEBOUNCE = 0.3
 
 # Add page title and sidebar
 app_ui = ui.page_sidebar(
@@ -35,6 +46,7 @@ app_ui = ui.page_sidebar(
         )
     ),
     ui.include_css(app_dir / "styles.css"),
+    ui.include_js(app_dir / "virtual_table.js"),
     title="Food products",
     fillable=True,
 )
@@ -49,18 +61,18 @@ def server(input, output, session):
     reactive_user_name = reactive.Value("")
     reactive_password = reactive.Value("")
     product_to_modify = reactive.Value(pd.DataFrame())
-    incomplete_products_with_alike_products = reactive.Value(pd.DataFrame())
     alike_products = reactive.Value(pd.DataFrame())
-    incomplete_products_without_alike_products = reactive.Value(pd.DataFrame())
+    # Versions of the parts of the shared product snapshot (product_cache.shared_products) this
+    # session last saw; a part only gets a new version when its content changed
+    product_versions = {part: reactive.Value(version) for part, version in shared_products.versions.items()}
     target_link_id = reactive.Value(None)
     products_to_compare = reactive.Value(pd.DataFrame())
     chart_type = reactive.Value("bar")
     clicked_products = _ClickedProducts()
-    last_count = reactive.Value(None)
     # current_tab = reactive.Value("Incomplete products with alike products")
-    newly_added_products = reactive.Value(pd.DataFrame())
-    product_stats = reactive.Value({})
     clicked_history = reactive.Value([])
+    # Id of the clustering job started from this session (None when it finished)
+    clustering_job_id = reactive.Value(None)
 
     # --------------------------------- #
     # LOG IN                            #
@@ -76,38 +88,47 @@ def server(input, output, session):
     #     if tab:
     #         current_tab.set(tab)
 
-    def update_the_tables():
-        # Update incomplete product listings
-        products = get_incompleted_products()
-        if isinstance(products, dict) and "error" in products:
-            return ui.tags.div(
-                ui.tags.p("Incomplete products"),
-                ui.tags.p(
-                    f"Error loading products: {products['error']}", class_="panel-box")
-            )
+    # --------------------------------- #
+    # Shared product snapshot           #
+    # --------------------------------- #
+    # The listings and stats live in one snapshot for the whole process, kept up to date by a
+    # single change feed; the session only follows the versions and reads the (read-only) frames,
+    # so a table is only rendered again when its listing changed
+    async def _on_products_changed(changed):
+        async with reactive.lock():
+            for part in changed:
+                product_versions[part].set(shared_products.versions[part])
+            await reactive.flush()
 
-        df_tmp = pd.json_normalize(products)
+    session.on_ended(shared_products.subscribe(_on_products_changed))
 
-        # Ensure cluster_id is numeric
-        if 'cluster_id' in df_tmp.columns:
-            df_tmp['cluster_id'] = pd.to_numeric(df_tmp['cluster_id'], errors='coerce').fillna(-1).astype(int)
+    @reactive.calc
+    def incomplete_products_with_alike_products():
+        product_versions["with_alike"].get()
+        return shared_products.frame("with_alike")
 
-        df_with_alike_products = df_tmp[df_tmp['cluster_id'] != -1]
-        df_without_alike_products = df_tmp[df_tmp['cluster_id'] == -1]
+    @reactive.calc
+    def incomplete_products_without_alike_products():
+        product_versions["without_alike"].get()
+        return shared_products.frame("without_alike")
+
+    @reactive.calc
+    def newly_added_products():
+        product_versions["newly_added"].get()
+        return shared_products.frame("newly_added")
+
+    @reactive.calc
+    def product_stats():
+        product_versions["stats"].get()
+        return shared_products.stats
+
+    def update_the_tables(stats=None):
+        # Ask for a reload of the shared snapshot (first page of each tab only, more rows are
+        # loaded on demand). The requests of all sessions within REFRESH_DEBOUNCE are served by
+        # one reload fetching the listings and stats concurrently, and only the listings whose
+        # content changed are published (and rendered again)
+        return shared_products.request_refresh(stats)
 
-        incomplete_products_with_alike_products.set(df_with_alike_products)
-        incomplete_products_without_alike_products.set(df_without_alike_products)
-        
-        # Update newly added product listing
-        all_newly_added_products = get_all_newly_added_products()
-        df_newly_added = pd.json_normalize(all_newly_added_products)
-        newly_added_products.set(df_newly_added)
-        
-        # Update stats
-        stats = get_product_stats()
-        product_stats.set(stats)
-        
-        
     @render.ui
     def login_card():
         if is_admin() == False:
@@ -119,7 +140,9 @@ def server(input, output, session):
                 class_="panel-box"
             )
         else:
-            update_the_tables()
+            # Another session may have loaded the snapshot already; the change feed keeps it current
+            if not shared_products.loaded:
+                update_the_tables()
 
             return ui.tags.div(
                 ui.tags.h4(f"Hello {reactive_user_name.get()}!"),
@@ -159,7 +182,7 @@ def server(input, output, session):
         if not is_admin():
             return ui.tags.div()
             
-        stats = product_stats.get()
+        stats = product_stats()
         if not stats:
             return ui.tags.div()
 
@@ -186,37 +209,6 @@ def server(input, output, session):
             ),
         )
         
-    # ------------------------------------------------------- #
-    # Monitor if there is a new product added to the database #
-    # --------------------------------------------------------#
-    def check_db_count():
-        # This function runs every interval_secs.
-        # If the return value changes, the decorated function below runs.
-        return get_products_count()
-
-    @reactive.poll(check_db_count, interval_secs=5)
-    def current_db_count():
-        # This runs only when check_db_count() returns a new value
-        return get_products_count()
-
-    @reactive.effect
-    def _notify_new_product():
-        current = current_db_count()
-        previous = last_count.get()
-
-        # Initialize on first run without showing modal
-        if previous is None:
-            last_count.set(current)
-            return
-
-        # Check if count increased or scan_sum changed
-        current_count, current_scan_sum = current
-        prev_count, prev_scan_sum = previous
-
-        if current_count != prev_count or current_scan_sum != prev_scan_sum:
-            last_count.set(current)
-            update_the_tables()
-
     # DYNAMIC CONTROL CENTER
     @render.ui
     def dynamic_control_center():
@@ -281,46 +273,187 @@ def server(input, output, session):
         )
 
     # INCOMPLETE PRODUCTS TAB
+    # Debounced search box: search_keywords only follows input.keywords once it stayed the
+    # same for SEARCH_DEBOUNCE seconds, so typing does not filter the tables per keystroke
+    pending_keywords = reactive.Value(None)
+    search_keywords = reactive.Value("")
+
+    @reactive.effect
+    def _on_keywords():
+        try:
+            keywords = (input.keywords() or "").strip()
+        except Exception:
+            return
+        pending_keywords.set((keywords, time.monotonic()))
+
+    @reactive.effect
+    def _apply_keywords():
+        pending = pending_keywords.get()
+        if pending is None:
+            return
+        keywords, changed = pending
+        wait = SEARCH_DEBOUNCE - (time.monotonic() - changed)
+        if wait > 0:
+            reactive.invalidate_later(wait)
+            return
+        search_keywords.set(keywords)
+        pending_keywords.set(None)
+
+    # The search indexes are part of the shared snapshot: synced once per change for all sessions
+    @reactive.calc
+    def with_alike_found():
+        df = incomplete_products_with_alike_products()
+        return shared_products.search_index("with_alike").filter(df, search_keywords.get())
+
+    @reactive.calc
+    def without_alike_found():
+        df = incomplete_products_without_alike_products()
+        return shared_products.search_index("without_alike").filter(df, search_keywords.get())
+
+    def follow_table_sort(table_id):
+        # Sort state of one table, (column, 'asc'/'desc') or None, set by the buttons of its header
+        sort = reactive.Value(None)
+
+        @reactive.effect
+        @reactive.event(input[f"{table_id}_sort"])
+        def _on_sort():
+            request = input[f"{table_id}_sort"]()
+            sort.set((request["column"], request["direction"]))
+
+        return sort
+
+    table_sorts = {table_id: follow_table_sort(table_id)
+                   for table_id in ("with_alike_table", "without_alike_table", "newly_added_table")}
+
+    # The search/sort of a listing done by the API, per listing: (what it answers, ListingQuery)
+    listing_queries = {}
+    # Bumped when a ListingQuery got its next page, so the views show its new rows
+    listing_query_pages = reactive.Value(0)
+
+    async def query_view(listing, keywords, sort):
+        # The listing searched/sorted by the API (a new query when the search, the sort or the
+        # listing changed); its next pages are fetched like the snapshot's when scrolled to
+        listing_query_pages.get()
+        key = (keywords, sort, shared_products.versions[listing])
+        known = listing_queries.get(listing)
+        if known is None or known[0] != key:
+            known = (key, ListingQuery(listing, keywords, sort))
+            listing_queries[listing] = known
+
+        query = known[1]
+        result = await query.load()
+        if result is not None:
+            ui.notification_show(f"Error loading products: {result['error']}", type="error")
+            return pd.DataFrame(), None, None
+        return query.frame, None, query
+
+    async def table_view(df, found, sort, listing):
+        # The rows of a listing as shown: (frame, row positions in the table's order, the
+        # ListingQuery serving them or None), the positions None when the frame is shown in
+        # its own order. While the snapshot has only loaded the first pages of the listing,
+        # the API searches/sorts the whole listing; otherwise the loaded rows are searched with
+        # the shared index (found() gives the matches) and sorted with the cached sort orders,
+        # so sorting again or flipping the direction does not sort the frame, and only the
+        # rows of a window are ever taken from it.
+        keywords = search_keywords.get()
+        if shared_products.has_more(listing) and (keywords or sort is not None):
+            return await query_view(listing, keywords, sort)
+
+        found = found()
+        if found is None or found.empty:
+            return pd.DataFrame(), None, None
+        if sort is None or sort[0] not in df.columns:
+            return found, None, None
+
+        column, direction = sort
+        try:
+            return df, shared_products.sort_positions(listing, df, column, direction == 'asc', rows=found), None
+        except TypeError:
+            # Values of the column that do not compare (mixed types): keep the API order
+            return found, None, None
+
+    @reactive.calc
+    async def with_alike_view():
+        return await table_view(incomplete_products_with_alike_products(), with_alike_found,
+                                table_sorts["with_alike_table"].get(), "with_alike")
+
+    @reactive.calc
+    async def without_alike_view():
+        return await table_view(incomplete_products_without_alike_products(), without_alike_found,
+                                table_sorts["without_alike_table"].get(), "without_alike")
+
+    @reactive.calc
+    async def newly_added_view():
+        df = newly_added_products()
+        return await table_view(df, lambda: df, table_sorts["newly_added_table"].get(), "newly_added")
+
+    def serve_virtual_table(table_id, view, listing=None):
+        # Feeds a render_virtual_table: a small reset message (row count) whenever the view
+        # changes, and the rows of the window the browser asks for. When the browser scrolled
+        # to the end of the loaded rows, the next page of the shared listing (or of the API
+        # search/sort serving the view) is fetched.
+        versions = {"current": 0}
+
+        @reactive.effect
+        async def _send_reset():
+            if not is_admin():
+                return
+            df, positions, query = await view()
+            total = len(df) if positions is None else len(positions)
+            if query is not None:
+                has_more = query.has_more
+            else:
+                has_more = listing is not None and shared_products.has_more(listing)
+            versions["current"] += 1
+            await session.send_custom_message("virtual_table_reset", {
+                "id": table_id, "version": versions["current"], "total": total, "has_more": has_more})
+
+        @reactive.effect
+        @reactive.event(input[f"{table_id}_window"])
+        async def _send_window():
+            request = input[f"{table_id}_window"]()
+            if not request or request.get("version") != versions["current"]:
+                return   # Asked before the last reset, a new request follows
+
+            with reactive.isolate():
+                df, positions, query = await view()
+            total = len(df) if positions is None else len(positions)
+            start = max(0, int(request.get("start", 0)))
+            end = min(total, int(request.get("end", 0)), start + VIRTUAL_TABLE_MAX_ROWS)
+            if end > start:
+                await session.send_custom_message("virtual_table_rows", {
+                    "id": table_id, "version": versions["current"], "start": start,
+                    **table_window(df, start, end, positions)})
+
+            result = None
+            if request.get("more") and query is not None:
+                result = await query.load_more()
+                with reactive.isolate():
+                    listing_query_pages.set(listing_query_pages.get() + 1)
+            elif request.get("more") and listing is not None and shared_products.has_more(listing):
+                result = await shared_products.load_more(listing)
+            if isinstance(result, dict) and "error" in result:
+                ui.notification_show(f"Error loading products: {result['error']}", type="error")
+
+    serve_virtual_table("with_alike_table", with_alike_view, "with_alike")
+    serve_virtual_table("without_alike_table", without_alike_view, "without_alike")
+    serve_virtual_table("newly_added_table", newly_added_view)
+
     @render.text
     def incomplete_products_instruction():
         if not is_admin():
             return ""
         return "Click on the product to check and modify its information."
 
+    # The listings only render the table shells; the rows are sent by serve_virtual_table,
+    # so sorting, searching and refreshing never re-render them
     @render.ui
     def incomplete_products_with_alike_products_listing():
         if not is_admin():
             return ui.tags.div()
 
-        df_with = incomplete_products_with_alike_products.get()
-
-        if (df_with is None or df_with.empty):
-            return ui.tags.div("No products found.")
-
-        # Apply general keyword search
-        try:
-            keywords = input.keywords()
-            if keywords:
-                mask = df_with.astype(str).apply(
-                    lambda col: col.str.contains(keywords, case=False, na=False))
-                df_with = df_with[mask.any(axis=1)]
-        except Exception:
-            pass
-
-        # Apply sorting
-        try:
-            sort_col = input.sort_column()
-            sort_dir = input.sort_direction()
-            if sort_col and sort_dir and sort_col in df_with.columns:
-                ascending = sort_dir == 'asc'
-                df_with = df_with.sort_values(by=sort_col, ascending=ascending)
-        except Exception:
-            pass
-
-        table_with = render_table(df_with)
-
         return ui.tags.div(
-            table_with,
+            render_virtual_table("with_alike_table"),
             style="display:flex; flex-direction:column; gap:1rem; margin-top:1rem; margin-bottom:1rem;",
             class_="incomplete_products_with_alike_products_listing"
         )
@@ -330,35 +463,8 @@ def server(input, output, session):
         if not is_admin():
             return ui.tags.div()
 
-        df_without = incomplete_products_without_alike_products.get()
-
-        if (df_without is None or df_without.empty):
-            return ui.tags.div("No products found.")
-
-        # Apply general keyword search
-        try:
-            keywords = input.keywords()
-            if keywords:
-                mask = df_without.astype(str).apply(
-                    lambda col: col.str.contains(keywords, case=False, na=False))
-                df_without = df_without[mask.any(axis=1)]
-        except Exception:
-            pass
-
-        # Apply sorting
-        try:
-            sort_col = input.sort_column()
-            sort_dir = input.sort_direction()
-            if sort_col and sort_dir and sort_col in df_without.columns:
-                ascending = sort_dir == 'asc'
-                df_without = df_without.sort_values(by=sort_col, ascending=ascending)
-        except Exception:
-            pass
-
-        table_without = render_table(df_without)
-
         return ui.tags.div(
-            table_without,
+            render_virtual_table("without_alike_table"),
             style="display:flex; flex-direction:column; gap:1rem; margin-top:1rem; margin-bottom:1rem;",
             class_="incomplete_products_without_alike_products_listing"
         )
@@ -368,69 +474,115 @@ def server(input, output, session):
         if not is_admin():
             return ui.tags.div()
 
-        df_newly_added = newly_added_products.get()
+        return ui.tags.div(
+            ui.tags.div(
+                ui.input_action_button("re_cluster_btn", "Find similar products", class_="button"),
+                ui.input_action_button("full_re_cluster_btn", "Re-cluster all products", class_="button"),
+                style="display:flex; gap:1rem;"
+            ),
+            ui.output_ui("clustering_job_status"),
+            render_virtual_table("newly_added_table"),
+            style="display:flex; flex-direction:column; gap:1rem; margin-top:1rem; margin-bottom:1rem;",
+            class_="newly_added_products_listing"
+        )
 
-        if (df_newly_added is None or df_newly_added.empty):
-            return ui.tags.div("No products found.")
+    def show_clustering_results(results_df):
+        if results_df is None or results_df.empty:
+            return
+        modal_ui = ui.modal(
+            ui.tags.p("Found similar products for newly added items:"),
+            ui.tags.ul(
+                [ui.tags.li(
+                    ui.tags.span(f"{row['name']}: {row['cluster_count'] - 1} similar products found (ID: "),
+                    ui.tags.a(
+                        str(row['id']),
+                        href="#",
+                        onclick=f"Shiny.setInputValue('modify_product_row', {row['id']}, {{priority: 'event'}});"
+                    ),
+                    ui.tags.span(")")
+                ) for _, row in results_df.iterrows()]
+            ),
+            easy_close=True,
+            footer=ui.modal_button("Close")
+        )
+        ui.modal_show(modal_ui)
 
-        # Apply sorting
+    def run_re_clustering(full_refit):
+        # Only the newly added products are placed, unless a full refit is asked (or needed).
+        # The job runs in a worker process; _watch_clustering_job picks up its result.
         try:
-            sort_col = input.sort_column()
-            sort_dir = input.sort_direction()
-            if sort_col and sort_dir and sort_col in df_newly_added.columns:
-                ascending = sort_dir == 'asc'
-                df_newly_added = df_newly_added.sort_values(by=sort_col, ascending=ascending)
-        except Exception:
-            pass
+            job = submit_clustering_job(full_refit=full_refit)
+        except JobConflict:
+            ui.notification_show("Products are already being clustered, wait until that job is finished.", type="warning")
+            return
+        except Exception as e:
+            ui.notification_show(f"Error: {str(e)}", type="error")
+            return
+        clustering_job_id.set(job.id)
+
+    @render.ui
+    def clustering_job_status():
+        if not is_admin():
+            return ui.tags.div()
 
-        table_newly_added = render_table(df_newly_added)
+        # The job of this session, or one started by another admin
+        job_id = clustering_job_id.get()
+        job = get_clustering_job(job_id) if job_id else get_clustering_job()
+        if job is None or job.status in FINISHED_STATES:
+            reactive.invalidate_later(JOB_IDLE_POLL_INTERVAL)
+            return ui.tags.div()
+        reactive.invalidate_later(JOB_POLL_INTERVAL)
 
+        title = "Re-clustering all products" if job.kind == "full_re_clustering" else "Finding similar products"
+        if not job_id:
+            title += " (started by another admin)"
         return ui.tags.div(
-            ui.input_action_button("re_cluster_btn", "Find similar products", class_="button"),
-            table_newly_added,
-            style="display:flex; flex-direction:column; gap:1rem; margin-top:1rem; margin-bottom:1rem;",
-            class_="newly_added_products_listing"
+            ui.tags.strong(title),
+            ui.tags.progress(value=f"{job.progress:.2f}", max="1", style="width:100%;"),
+            ui.tags.span(job.message),
+            ui.input_action_button("cancel_clustering_job", "Cancel", class_="button"),
+            style="display:flex; flex-direction:column; gap:0.5rem;",
+            class_="panel-box"
         )
 
+    @reactive.effect
+    def _watch_clustering_job():
+        job_id = clustering_job_id.get()
+        if job_id is None:
+            return
+        job = get_clustering_job(job_id)
+        if job is not None and job.status not in FINISHED_STATES:
+            reactive.invalidate_later(JOB_POLL_INTERVAL)
+            return
+
+        clustering_job_id.set(None)
+        if job is None:
+            return
+        if job.status == DONE:
+            show_clustering_results(job.result)
+            update_the_tables()
+            ui.notification_show("Finding simillar product completed!", type="message")
+        elif job.status == CANCELLED:
+            ui.notification_show("Finding similar products was cancelled, nothing was changed.", type="warning")
+        else:
+            ui.notification_show(f"Error: {job.error}", type="error")
+
+    @reactive.effect
+    @reactive.event(input.cancel_clustering_job)
+    def _on_cancel_clustering_job():
+        job = get_clustering_job()
+        if job is not None and cancel_clustering_job(job.id):
+            ui.notification_show("Cancelling... the job stops at its next step.", type="message")
+
     @reactive.effect
     @reactive.event(input.re_cluster_btn)
     def _on_re_cluster():
-        with ui.Progress(min=1, max=30) as p:
-            p.set(message="Finding similar products...", detail="This may take a while")
-            
-            all_products = get_all_products()
-            if isinstance(all_products, dict) and "error" in all_products:
-                ui.notification_show(f"Error fetching products: {all_products['error']}", type="error")
-                return
+        run_re_clustering(full_refit=False)
 
-            df_all = pd.json_normalize(all_products)
-            
-            try:
-                results_df = re_clustering(df_all)
-                
-                if not results_df.empty:
-                    modal_ui = ui.modal(
-                        ui.tags.p("Found similar products for newly added items:"),
-                        ui.tags.ul(
-                            [ui.tags.li(
-                                ui.tags.span(f"{row['name']}: {row['cluster_count'] - 1} similar products found (ID: "),
-                                ui.tags.a(
-                                    str(row['id']),
-                                    href="#",
-                                    onclick=f"Shiny.setInputValue('modify_product_row', {row['id']}, {{priority: 'event'}});"
-                                ),
-                                ui.tags.span(")")
-                            ) for _, row in results_df.iterrows()]
-                        ),
-                        easy_close=True,
-                        footer=ui.modal_button("Close")
-                    )
-                    ui.modal_show(modal_ui)
-                
-                update_the_tables()
-                ui.notification_show("Finding simillar product completed!", type="message")
-            except Exception as e:
-                ui.notification_show(f"Error: {str(e)}", type="error")
+    @reactive.effect
+    @reactive.event(input.full_re_cluster_btn)
+    def _on_full_re_cluster():
+        run_re_clustering(full_refit=True)
 
     @reactive.effect
     @reactive.event(input.reset_search_by_keywords)
@@ -442,8 +594,8 @@ def server(input, output, session):
     @reactive.event(input.reset_all)
     def _on_reset_all():
         session.send_input_message("keywords", {"value": ""})
-        session.send_input_message("sort_column", {"value": "-"})
-        session.send_input_message("sort_direction", {"value": "-"})
+        for sort in table_sorts.values():
+            sort.set(None)
 
     @render.ui
     def product_edit_form():
@@ -454,8 +606,7 @@ def server(input, output, session):
         # Segment fields into 3 groups
         primary_fields = ["id", "name", "link_to", "name_search", "active", "unit",
                           "synonyms", "brands", "brands_search", "categories", "barcode", "bron"]
-        nutrition_fields = ["energy", "protein", "fat", "saturated_fatty_acid", "carbohydrates", "sugar", "starch", "dietary_fiber", "salt", "sodium", "k", "ca", "p", "fe", "polyols", "cholesterol", "omega3", "omega6", "mov",
-                            "eov", "vit_a", "vit_b12", "vit_b6", "vit_b1", "vit_b2", "vit_c", "vit_d", "mg", "water", "remarks_carbohydrates", "glucose", "fructose", "excess_fructose", "lactose", "sorbitol", "mannitol", "fructans", "gos"]
+        nutrition_fields = NUTRITION_COLS
         other_fields = [
             c for c in df.columns if c not in primary_fields + nutrition_fields]
 
@@ -695,18 +846,7 @@ def server(input, output, session):
 
         # Directly trigger the comparison logic
         if current_clicked:
-            products_list = []
-            for pid in current_clicked:
-                p_info = get_product_info(pid)
-                if isinstance(p_info, dict) and "error" not in p_info:
-                    products_list.append(p_info)
-
-            if products_list:
-                df_compare = pd.DataFrame(products_list)
-            else:
-                df_compare = pd.DataFrame()
-
-            products_to_compare.set(df_compare)
+            products_to_compare.set(fetch_products_to_compare(current_clicked))
 
     @reactive.effect
     @reactive.event(input.toggle_checked_product)
@@ -818,9 +958,16 @@ def server(input, output, session):
             updated_alike_products_pd = pd.json_normalize(response_2)
             alike_products.set(updated_alike_products_pd)
 
-        response = get_incomplete_products_with_alike_products()
-        products = pd.json_normalize(response)
-        incomplete_products_with_alike_products.set(products)
+    def fetch_products_to_compare(pids):
+        # One batch request for all compared products, kept in the order they were selected
+        pids = list(dict.fromkeys(int(pid) for pid in pids))
+        products_list = get_products_info(pids)
+        if not products_list or (isinstance(products_list, dict) and "error" in products_list):
+            return pd.DataFrame()
+
+        df_compare = pd.DataFrame(products_list)
+        order = {pid: i for i, pid in enumerate(pids)}
+        return df_compare.sort_values(by='id', key=lambda ids: ids.map(order), ignore_index=True)
 
     @reactive.effect
     @reactive.event(input.compare_products)
@@ -833,21 +980,8 @@ def server(input, output, session):
         # Combine all IDs: clicked products + the one triggered by the compare button
         all_pids = list(set(clicked_pids + [product_to_compare_with_pid]))
 
-        # Fetch product info for each ID and collect into a list
-        products_list = []
-        for pid in all_pids:
-            p_info = get_product_info(pid)
-            # If get_product_info returns a dict (single product), append it
-            if isinstance(p_info, dict) and "error" not in p_info:
-                products_list.append(p_info)
-
-        # Convert list of dicts to DataFrame
-        if products_list:
-            df_compare = pd.DataFrame(products_list)
-        else:
-            df_compare = pd.DataFrame()
-
-        products_to_compare.set(df_compare)
+        # Fetch all products in one request
+        products_to_compare.set(fetch_products_to_compare(all_pids))
 
     @reactive.effect
     @reactive.event(input.show_radar)
@@ -876,8 +1010,7 @@ def server(input, output, session):
             id_col = "row"
 
         # Select numeric columns
-        numeric_cols = ["energy", "protein", "fat", "saturated_fatty_acid", "carbohydrates", "sugar", "starch", "dietary_fiber", "salt", "sodium", "k", "ca", "p", "fe", "polyols", "cholesterol", "omega3", "omega6", "mov",
-                        "eov", "vit_a", "vit_b12", "vit_b6", "vit_b1", "vit_b2", "vit_c", "vit_d", "mg", "water", "remarks_carbohydrates", "glucose", "fructose", "excess_fructose", "lactose", "sorbitol", "mannitol", "fructans", "gos"]
+        numeric_cols = NUTRITION_COLS
 
         # Filter numeric_cols to only those present in df and not all NaNs
         numeric_cols = [
@@ -955,15 +1088,11 @@ def server(input, output, session):
         else:
             meta_table = ui.tags.div("No metadata available.")
 
-        # Calculate difference scores
+        # Similarity scores
         diff_scores_ui = ui.tags.div()
-        if numeric_cols and "active" in df.columns:
-            # Use df_plot which has NaNs filled with 0
-            df_calc = df_plot.copy()
-            df_calc['active'] = df['active'].values
-
-            verified_df = df_calc[df_calc['active'] == 1]
-            unverified_df = df_calc[df_calc['active'] == 0]
+        if "id" in df.columns and "active" in df.columns:
+            verified_df = df[df['active'] == 1]
+            unverified_df = df[df['active'] == 0]
 
             if not verified_df.empty and not unverified_df.empty:
                 # Matrix: Unverified vs Each Verified
@@ -977,64 +1106,58 @@ def server(input, output, session):
                 header_row = ui.tags.tr(
                     *header_cells, style="padding: 5px; border: 1px solid #ddd; background-color: #a5b4fb; text-align: center;")
 
-                body_rows = []
-                for _, u_row in unverified_df.iterrows():
-                    u_id = str(u_row[id_col])
-                    row_cells = [ui.tags.td(
-                        u_id, style="padding: 5px; border: 1px solid #ddd; font-weight: bold;")]
-
-                    # Calculate distances first to find min
-                    dists = []
-                    sim_pcts = []
-                    for _, v_row in verified_df.iterrows():
-                        diff = u_row[numeric_cols] - v_row[numeric_cols]
-                        dist = (diff ** 2).sum() ** 0.5
-                        v_norm = (v_row[numeric_cols] ** 2).sum() ** 0.5
-
-                        if v_norm == 0:
-                            sim_pct = 100.0 if dist == 0 else float('-inf')
-                        else:
-                            diff_pct = (dist / v_norm * 100)
-                            sim_pct = 100 - diff_pct
-
-                        dists.append(dist)
-                        sim_pcts.append(sim_pct)
-
-                    min_dist = min(dists) if dists else -1
-
-                    for i, dist in enumerate(dists):
-                        sim_pct = sim_pcts[i]
-                        style = "padding: 5px; border: 1px solid #ddd;"
-                        if dist == min_dist:
-                            style += " color: green; font-weight: bold;"
-
-                        display_val = f"{sim_pct:.1f}%" if sim_pct != float(
-                            '-inf') else "N/A"
-                        
-                        v_id = verified_ids[i]
-                        onclick_val = f"event.stopPropagation(); Shiny.setInputValue('compare_specific_pair', [{repr(u_id)}, {repr(v_id)}], {{priority: 'event'}})"
-                        
-                        cell_content = ui.tags.a(
-                            display_val,
-                            href="#",
-                            onclick=onclick_val,
-                            style="text-decoration: underline; cursor: pointer; color: inherit;"
-                        )
-
-                        row_cells.append(ui.tags.td(
-                            cell_content, style=style))
-
-                    body_rows.append(ui.tags.tr(*row_cells))
-
-                diff_scores_ui = ui.tags.div(
-                    ui.tags.h5("Nutrition value similarity score"),
-                    ui.tags.table(
-                        ui.tags.thead(header_row),
-                        ui.tags.tbody(*body_rows),
-                        class_="comparison_table"
-                    ),
-                    style="margin-top: 20px;"
-                )
+                def score_table(title, sim_matrix):
+                    # One unverified x verified table of percentages, the best score of each row in green
+                    body_rows = []
+                    for u, u_id in enumerate(unverified_df[id_col].astype(str)):
+                        row_cells = [ui.tags.td(
+                            u_id, style="padding: 5px; border: 1px solid #ddd; font-weight: bold;")]
+
+                        sims = sim_matrix[u]
+                        best_sim = np.nanmax(sims) if len(sims) and not np.isnan(sims).all() else None
+
+                        for i, sim_pct in enumerate(sims):
+                            style = "padding: 5px; border: 1px solid #ddd;"
+                            if sim_pct == best_sim:
+                                style += " color: green; font-weight: bold;"
+
+                            display_val = f"{sim_pct:.1f}%" if not np.isnan(sim_pct) else "N/A"
+
+                            v_id = verified_ids[i]
+                            onclick_val = f"event.stopPropagation(); Shiny.setInputValue('compare_specific_pair', [{repr(u_id)}, {repr(v_id)}], {{priority: 'event'}})"
+
+                            cell_content = ui.tags.a(
+                                display_val,
+                                href="#",
+                                onclick=onclick_val,
+                                style="text-decoration: underline; cursor: pointer; color: inherit;"
+                            )
+
+                            row_cells.append(ui.tags.td(
+                                cell_content, style=style))
+
+                        body_rows.append(ui.tags.tr(*row_cells))
+
+                    return ui.tags.div(
+                        ui.tags.h5(title),
+                        ui.tags.table(
+                            ui.tags.thead(header_row),
+                            ui.tags.tbody(*body_rows),
+                            class_="comparison_table"
+                        ),
+                        style="margin-top: 20px;"
+                    )
+
+                # All unverified x verified scores in one go, read from the stored clustering
+                # features (text, plus nutrition when NUTRITION_WEIGHT is set) instead of being
+                # computed again for every comparison; NaN for products not clustered yet
+                tables = [score_table("Similarity score (clustering features)",
+                                      get_feature_similarities(unverified_df['id'], verified_df['id']).to_numpy() * 100)]
+                # The nutrition values are compared on their own as well (Euclidean distance)
+                if numeric_cols:
+                    tables.append(score_table("Nutrition value similarity score",
+                                              nutrition_similarities(unverified_df[numeric_cols], verified_df[numeric_cols])))
+                diff_scores_ui = ui.tags.div(*tables)
 
         return ui.tags.div(
             ui.tags.div(
@@ -1071,14 +1194,8 @@ def server(input, output, session):
         if not pair_ids or len(pair_ids) != 2:
             return
 
-        products_list = []
-        for pid in pair_ids:
-            p_info = get_product_info(pid)
-            if isinstance(p_info, dict) and "error" not in p_info:
-                products_list.append(p_info)
-
-        if products_list:
-            df_compare = pd.DataFrame(products_list)
+        df_compare = fetch_products_to_compare(pair_ids)
+        if not df_compare.empty:
             products_to_compare.set(df_compare)
 
     @reactive.effect
@@ -1094,7 +1211,7 @@ def server(input, output, session):
 
         for col in cols:
             # Skip read-only columns
-            if col in ["id", "link_to", "cluster_id", "cluster_count", "app_ver", "created", "updated", "token"]:
+            if col in ["id", "link_to", "cluster_id", "cluster_count", "app_ver", "created", "updated", "token"] + COMPUTED_COLUMNS:
                 continue
 
             input_id = f"edit_{_sanitize_id(col)}"
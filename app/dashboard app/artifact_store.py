@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+import joblib
+import numpy as np
+from scipy import sparse
+
+from clustering import ClusteringState
+
+# Default location of the stored clustering state (next to the app, ignored by git)
+ARTIFACT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts")
+
+# Versions kept on disk; older ones are removed after each save
+KEEP_VERSIONS = 3
+
+_LATEST_FILE = "LATEST"
+_META_FILE = "meta.json"
+_VECTORIZER_FILE = "vectorizer.joblib"
+
+# The TF-IDF CSR matrix is stored as its three arrays (plain .npy instead of one .npz
+# archive) so they can be memory-mapped; together with the row index and labels
+_ARRAY_FILES = {
+    "tfidf_data": "tfidf_data.npy",
+    "tfidf_indices": "tfidf_indices.npy",
+    "tfidf_indptr": "tfidf_indptr.npy",
+    "product_ids": "product_ids.npy",
+    "labels": "labels.npy",
+    "text_hashes": "text_hashes.npy",
+}
+
+# Only stored for states fitted with the SVD stage (see clustering.reduce_dimensions)
+_OPTIONAL_ARRAY_FILES = {
+    "svd_components": "svd_components.npy",
+    "reduced": "reduced.npy",
+}
+
+
+class ArtifactStore:
+    """
+    Versioned clustering state on local disk.
+
+    Every save writes a new directory v<n>/ (vectorizer, TF-IDF matrix, product-id index,
+    DBSCAN labels, per-row text hashes, the SVD components and reduced rows if any, and
+    meta.json with the content hash of the input)
+    under a temporary name, renames it into place and then points LATEST at it, so readers
+    in other processes (API, other dashboard workers) never see a half-written version.
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, keep_versions=KEEP_VERSIONS):
+        self.root = root
+        self.keep_versions = keep_versions
+        self._lock = threading.Lock()
+
+    def _version_dir(self, version):
+        return os.path.join(self.root, f"v{version}")
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for name in os.listdir(self.root):
+            if name.startswith("v") and name[1:].isdigit():
+                found.append(int(name[1:]))
+        return sorted(found)
+
+    def latest_version(self):
+        try:
+            with open(os.path.join(self.root, _LATEST_FILE)) as f:
+                version = int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        return version if os.path.isdir(self._version_dir(version)) else None
+
+    def metadata(self, version=None):
+        """meta.json of a version (default: the latest), or None when nothing was stored yet."""
+        version = self.latest_version() if version is None else version
+        if version is None:
+            return None
+        with open(os.path.join(self._version_dir(version), _META_FILE)) as f:
+            return json.load(f)
+
+    def save(self, state, publish=True):
+        """
+        Stores `state` as a new version and returns its number.
+
+        With publish=False the version is only staged: it is written but LATEST keeps
+        pointing at the previous one until publish(version) (or discard(version)) is called.
+        """
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            version = max(self.versions(), default=0) + 1
+            tmp_dir = os.path.join(self.root, f".v{version}.tmp-{os.getpid()}")
+            os.makedirs(tmp_dir)
+            try:
+                vectors = sparse.csr_matrix(state.vectors)
+                arrays = {
+                    "tfidf_data": vectors.data,
+                    "tfidf_indices": vectors.indices,
+                    "tfidf_indptr": vectors.indptr,
+                    "product_ids": state.product_ids,
+                    "labels": state.labels,
+                    "text_hashes": state.text_hashes,
+                }
+                if state.components is not None:
+                    arrays["svd_components"] = state.components
+                    arrays["reduced"] = state.reduced
+                for key, filename in {**_ARRAY_FILES, **_OPTIONAL_ARRAY_FILES}.items():
+                    if key in arrays:
+                        np.save(os.path.join(tmp_dir, filename), np.ascontiguousarray(arrays[key]))
+                joblib.dump(state.features, os.path.join(tmp_dir, _VECTORIZER_FILE))
+
+                meta = {
+                    "version": version,
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "input_hash": state.content_hash(),
+                    "full_fit": state.full_fit,
+                    "eps": state.eps,
+                    "min_samples": state.min_samples,
+                    "n_products": int(len(state)),
+                    "n_features": int(vectors.shape[1]),
+                    "n_components": state.n_components,
+                    "nutrition_weight": state.nutrition_weight,
+                    "n_clusters": int(len(set(state.labels.tolist()) - {-1})),
+                }
+                with open(os.path.join(tmp_dir, _META_FILE), "w") as f:
+                    json.dump(meta, f, indent=2)
+
+                os.rename(tmp_dir, self._version_dir(version))
+            except Exception:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+
+            if publish:
+                self._publish(version)
+            return version
+
+    def publish(self, version):
+        """Points LATEST at a staged version."""
+        with self._lock:
+            if not os.path.isdir(self._version_dir(version)):
+                raise FileNotFoundError(f"Clustering artifact version {version} does not exist")
+            self._publish(version)
+
+    def discard(self, version):
+        """Removes a staged version that will not be published."""
+        with self._lock:
+            if version != self.latest_version():
+                shutil.rmtree(self._version_dir(version), ignore_errors=True)
+
+    def _publish(self, version):
+        latest_tmp = os.path.join(self.root, f".{_LATEST_FILE}.tmp-{os.getpid()}")
+        with open(latest_tmp, "w") as f:
+            f.write(str(version))
+        os.replace(latest_tmp, os.path.join(self.root, _LATEST_FILE))
+
+        self._prune(version)
+
+    def _prune(self, latest):
+        # Readers that memory-mapped a removed version keep working (the files stay alive until unmapped)
+        for version in self.versions():
+            if version <= latest - self.keep_versions:
+                shutil.rmtree(self._version_dir(version), ignore_errors=True)
+
+    def load(self, version=None, mmap=True):
+        """
+        Loads a stored ClusteringState (default: the latest), or returns None when there is none.
+
+        The arrays are memory-mapped read-only when `mmap` is set, and the vectorizer is only
+        unpickled the first time the state transforms new products.
+        """
+        version = self.latest_version() if version is None else version
+        if version is None:
+            return None
+        directory = self._version_dir(version)
+        meta = self.metadata(version)
+
+        mmap_mode = "r" if mmap else None
+        arrays = {key: np.load(os.path.join(directory, filename), mmap_mode=mmap_mode)
+                  for key, filename in _ARRAY_FILES.items()}
+        for key, filename in _OPTIONAL_ARRAY_FILES.items():
+            path = os.path.join(directory, filename)
+            arrays[key] = np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None
+        vectors = sparse.csr_matrix((arrays["tfidf_data"], arrays["tfidf_indices"], arrays["tfidf_indptr"]),
+                                    shape=(meta["n_products"], meta["n_features"]), copy=False)
+
+        def load_vectorizer():
+            return joblib.load(os.path.join(directory, _VECTORIZER_FILE))
+
+        return ClusteringState(load_vectorizer, vectors, arrays["product_ids"], arrays["labels"],
+                               arrays["text_hashes"], meta["full_fit"], meta["eps"], meta["min_samples"],
+                               arrays["svd_components"], arrays["reduced"])
@@ -0,0 +1,277 @@
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sklearn.cluster import DBSCAN
+
+from neighbors import build_index
+
+# Catalogues with at least this many products are clustered per block instead of all at once.
+# Blocking duplicates the products with several keys and pays a per-task overhead, so it only
+# wins once the quadratic global eps graph dominates: benchmark_blocking on one core took
+# 0.43 s global vs 0.82 s blocked at 30,000 products, 1.5 s vs 1.4 s at 50,000 and 11 s vs
+# 2.9 s at 100,000 (more workers move the break-even down)
+BLOCKING_MIN_PRODUCTS = 50000
+
+# Columns whose (normalized) values are blocking keys; the first significant token of the
+# name is one as well. Multi-valued cells are split on BLOCK_KEY_SEPARATORS.
+BLOCK_KEY_COLS = ['categories', 'brands_search']
+BLOCK_KEY_SEPARATORS = re.compile(r'[;,|]')
+
+# Blocks are clustered in a process pool; one task gets blocks of about this many products
+BLOCKING_WORKERS = None # None = os.cpu_count()
+BLOCKING_TASK_PRODUCTS = 5000
+
+# Name tokens that are never a blocking key (too common to say anything about a product)
+_name_stopwords = {
+    "met", "en", "in", "van", "op", "voor", "bij", "uit", "door", "naar", "om", "te", "de",
+    "het", "een", "als", "maar", "of", "ook", "dan", "tot", "over", "bio", "light", "original",
+}
+_non_alphanumeric_pattern = re.compile(r'[^a-z0-9]+')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=BLOCKING_WORKERS)
+        return _pool
+
+
+def _normalize_key(value):
+    # Lowercase, accents and punctuation removed, single spaces
+    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii').lower()
+    return _non_alphanumeric_pattern.sub(' ', value).strip()
+
+
+def _first_name_token(name):
+    for token in _normalize_key(name).split():
+        if len(token) >= 3 and not token.isdigit() and token not in _name_stopwords:
+            return token
+    return None
+
+
+def blocking_keys(df):
+    """
+    Blocking keys of every product of a raw product DataFrame: 'c:<category>', 'b:<brand>'
+    (normalized values of BLOCK_KEY_COLS) and 'n:<first significant name token>'.
+
+    Returns:
+        A Series of tuples of keys (empty for products without any), aligned with df.
+    """
+    columns = [(col[0], df[col]) for col in BLOCK_KEY_COLS if col in df.columns]
+    names = df['name'] if 'name' in df.columns else pd.Series(None, index=df.index, dtype=object)
+
+    keys = []
+    for position in range(len(df)):
+        row_keys = []
+        for prefix, values in columns:
+            value = values.iat[position]
+            if isinstance(value, str):
+                for part in BLOCK_KEY_SEPARATORS.split(value):
+                    part = _normalize_key(part)
+                    if part:
+                        row_keys.append(f"{prefix}:{part}")
+        name = names.iat[position]
+        token = _first_name_token(name) if isinstance(name, str) else None
+        if token:
+            row_keys.append(f"n:{token}")
+        keys.append(tuple(dict.fromkeys(row_keys)))
+    return pd.Series(keys, index=df.index, dtype=object)
+
+
+def block_rows(keys):
+    """
+    Groups row positions by blocking key: {key: array of positions}. Products without a key
+    form one block of their own (key '').
+    """
+    blocks = {}
+    for position, row_keys in enumerate(keys):
+        for key in row_keys or ('',):
+            blocks.setdefault(key, []).append(position)
+    return {key: np.asarray(rows, dtype=np.int64) for key, rows in blocks.items()}
+
+
+def _cluster_blocks(stacked, sizes, eps, min_samples):
+    # Runs in a pool worker: DBSCAN labels and core-sample mask of every block, given the
+    # rows of the blocks stacked (`sizes` rows each). Only pairs within one block are scored
+    # (block_radius_graph), so one DBSCAN over this block-diagonal graph clusters every
+    # block independently.
+    graph = build_index(stacked).block_radius_graph(sizes, eps)
+
+    dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed')
+    labels = dbscan.fit_predict(graph).astype(np.int64)
+    core = np.zeros(len(labels), dtype=bool)
+    core[dbscan.core_sample_indices_] = True
+    bounds = np.cumsum([0] + sizes)
+    return [(labels[start:end], core[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def reconcile_blocks(n_rows, block_results):
+    """
+    Merges the clusters of the blocks into global labels (-1 = noise).
+
+    `block_results` holds (rows, labels, core) per block. Clusters of different blocks that
+    share a core product are one cluster (a product core in one block is core globally as
+    well, its neighbourhood only grows); a product that is only a border point takes the
+    cluster of the first block it was clustered in, as DBSCAN does. The labels are numbered
+    0, 1, ... in the order of their first product, so they are unique over all blocks.
+    """
+    node_offset = n_rows
+    edge_rows, edge_nodes = [], []
+    first_node = np.full(n_rows, -1, dtype=np.int64)
+    for rows, labels, core in block_results:
+        clustered = labels >= 0
+        if not clustered.any():
+            continue
+        # Labels of the blocks of one task share a numbering; only their order matters here
+        nodes = node_offset + labels
+        node_offset += int(labels.max()) + 1
+
+        edge_rows.append(rows[clustered & core])
+        edge_nodes.append(nodes[clustered & core])
+        unset = clustered & (first_node[rows] == -1)
+        first_node[rows[unset]] = nodes[unset]
+
+    labels = np.full(n_rows, -1, dtype=np.int64)
+    if not edge_rows:
+        return labels
+
+    edge_rows = np.concatenate(edge_rows)
+    edge_nodes = np.concatenate(edge_nodes)
+    graph = sparse.coo_matrix((np.ones(len(edge_rows), dtype=np.int8), (edge_rows, edge_nodes)),
+                              shape=(node_offset, node_offset))
+    _, component = connected_components(graph, directed=False)
+
+    clustered = first_node >= 0
+    components = component[first_node[clustered]]
+    # Consecutive ids in order of the first product of each cluster
+    _, first_position, inverse = np.unique(components, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first_position))
+    labels[clustered] = order[inverse]
+    return labels
+
+
+def cluster_blocks(vectors, blocks, eps, min_samples, parallel=True):
+    """
+    DBSCAN labels of `vectors` (one row per product) computed per block of `blocks`
+    ({key: row positions}, see block_rows) and merged with reconcile_blocks.
+
+    Only products sharing a block are compared, so the work grows with the block sizes
+    instead of with the square of the catalogue. Blocks smaller than min_samples cannot hold
+    a cluster and are skipped; the others are sent to a process pool in tasks of about
+    BLOCKING_TASK_PRODUCTS products.
+    """
+    blocks = [rows for rows in blocks.values() if len(rows) >= min_samples]
+    blocks.sort(key=len, reverse=True)
+
+    tasks, task, task_size = [], [], 0
+    for rows in blocks:
+        task.append(rows)
+        task_size += len(rows)
+        if task_size >= BLOCKING_TASK_PRODUCTS:
+            tasks.append(task)
+            task, task_size = [], 0
+    if task:
+        tasks.append(task)
+
+    # One row selection per task (the rows of its blocks, stacked) rather than one per block
+    task_inputs = [(vectors[np.concatenate(task)], [len(rows) for rows in task]) for task in tasks]
+    if parallel and len(tasks) > 1:
+        futures = [_get_pool().submit(_cluster_blocks, stacked, sizes, eps, min_samples)
+                   for stacked, sizes in task_inputs]
+        results = [result for future in futures for result in future.result()]
+    else:
+        results = [result for stacked, sizes in task_inputs
+                   for result in _cluster_blocks(stacked, sizes, eps, min_samples)]
+
+    block_results = [(rows, labels, core) for rows, (labels, core) in
+                     zip([rows for task in tasks for rows in task], results)]
+    return reconcile_blocks(vectors.shape[0], block_results)
+
+
+def synthetic_products(n_rows=100000, seed=0):
+    """
+    Random catalogue of product families (name, brands_search, categories): every family
+    is a few variants of one name with one brand and category, like duplicate products.
+    """
+    rng = np.random.default_rng(seed)
+
+    def words(n, length):
+        # Distinct letter-only words (the text cleaning drops digits)
+        letters = rng.integers(0, 26, size=(n * 2, length))
+        unique = np.unique(letters, axis=0)[:n]
+        return np.array(["".join(chr(97 + c) for c in row) for row in unique], dtype=object)
+
+    vocabulary = words(20000, 6)
+    brands = words(2000, 5)
+    categories = words(200, 7)
+
+    family = np.sort(rng.integers(0, max(1, n_rows // 3), size=n_rows))
+    n_families = int(family.max()) + 1
+    family_words = vocabulary[rng.integers(0, len(vocabulary), size=(n_families, 5))]
+    words = family_words[family]
+    # One random word per product replaced, so the variants are near (not exact) duplicates
+    words[np.arange(n_rows), rng.integers(0, 5, size=n_rows)] = vocabulary[rng.integers(0, len(vocabulary), size=n_rows)]
+    return pd.DataFrame({
+        "name": [" ".join(row) for row in words],
+        "brands_search": brands[rng.integers(0, len(brands), size=n_families)][family],
+        "categories": categories[rng.integers(0, len(categories), size=n_families)][family],
+    })
+
+
+def benchmark_blocking(n_rows=100000, seed=0, eps=None, min_samples=None):
+    """
+    Clusters a synthetic catalogue (synthetic_products) at once and per block, and reports
+    the seconds of both, the number of blocks and of clusters, and the agreement of the
+    blocked labels with the global ones (adjusted Rand index, noise agreement).
+    """
+    from sklearn.metrics import adjusted_rand_score
+
+    from clustering import DBSCAN_EPS, DBSCAN_MIN_SAMPLES, _dbscan, fit_clustering
+
+    eps = DBSCAN_EPS if eps is None else eps
+    min_samples = DBSCAN_MIN_SAMPLES if min_samples is None else min_samples
+    df = synthetic_products(n_rows, seed)
+    texts = df['name'] + " " + df['brands_search'] + " " + df['categories']
+    vectors = fit_clustering(np.arange(n_rows), texts, eps, min_samples).search_vectors
+    blocks = block_rows(blocking_keys(df))
+
+    start = time.perf_counter()
+    global_labels = _dbscan(build_index(vectors), eps, min_samples)
+    global_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    blocked_labels = cluster_blocks(vectors, blocks, eps, min_samples)
+    blocked_seconds = time.perf_counter() - start
+
+    return {
+        "rows": n_rows,
+        "blocks": len(blocks),
+        "largest_block": max(len(rows) for rows in blocks.values()),
+        "global_seconds": global_seconds,
+        "blocked_seconds": blocked_seconds,
+        "global_clusters": len(set(global_labels.tolist()) - {-1}),
+        "blocked_clusters": len(set(blocked_labels.tolist()) - {-1}),
+        "adjusted_rand": float(adjusted_rand_score(global_labels, blocked_labels)),
+        "noise_agreement": float(np.mean((global_labels == -1) == (blocked_labels == -1))),
+    }
+
+
+if __name__ == "__main__":
+    # python blocking.py [rows ...] (several sizes show where blocking starts to pay off)
+    import sys
+
+    for n_rows in [int(arg) for arg in sys.argv[1:]] or [100000]:
+        result = benchmark_blocking(n_rows)
+        print(", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                        for key, value in result.items()))
@@ -0,0 +1,111 @@
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+from schema import CHANGE_POSITION_QUERY
+
+# Seconds between two reads of the change position while a notified change is not below it yet
+PENDING_POLL_INTERVAL = 0.5
+
+
+class ChangeListener:
+    """
+    Follows the product change-feed position (see schema.py) with PostgreSQL LISTEN/NOTIFY.
+
+    One background thread holds a dedicated connection that LISTENs on the change
+    channel; request threads call wait_for() to block (without touching the database)
+    until the position moved past the one they already have. A notification carries the
+    id of the committed transaction; the position is read again until it is past that id
+    (an older transaction still running holds it back). After every (re)connect the
+    position is read again as well, so the changes committed while the listener was not
+    connected are not waited for in vain.
+    """
+
+    def __init__(self, channel, reconnect_delay=5.0, **conn_kwargs):
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._conn_kwargs = conn_kwargs
+        self._cond = threading.Condition()
+        self._latest_seq = None
+        self._pending_xid = None   # highest transaction id known to be committed and not below the position yet
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="product-change-listener", daemon=True)
+
+    def start(self, latest_seq):
+        self._latest_seq = latest_seq
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+
+    @property
+    def latest_seq(self):
+        with self._cond:
+            return self._latest_seq
+
+    def _publish(self, seq):
+        with self._cond:
+            if self._latest_seq is None or seq > self._latest_seq:
+                self._latest_seq = seq
+                self._cond.notify_all()
+
+    def wait_for(self, since, timeout):
+        """Waits until the position moved past `since`, or `timeout` seconds passed. Returns the latest position."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._latest_seq is not None and self._latest_seq <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._latest_seq
+
+    def _pending(self, xid):
+        if self._pending_xid is None or xid > self._pending_xid:
+            self._pending_xid = xid
+
+    def _read_position(self, cur):
+        cur.execute(CHANGE_POSITION_QUERY)
+        position, _ = cur.fetchone()
+        self._publish(position)
+        if self._pending_xid is not None and self._pending_xid < position:
+            self._pending_xid = None
+
+    def _run(self):
+        while not self._stopped:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._conn_kwargs)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {self.channel};")
+                # Transactions that ended before the LISTEN sent their notifications to nobody:
+                # wait for the position to pass every transaction id handed out so far
+                cur.execute(CHANGE_POSITION_QUERY)
+                self._pending(cur.fetchone()[1] - 1)
+                self._read_position(cur)
+                while not self._stopped:
+                    # Wake up regularly so stop() is honoured, and often while a change is pending
+                    timeout = 5.0 if self._pending_xid is None else PENDING_POLL_INTERVAL
+                    if select.select([conn], [], [], timeout) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            try:
+                                self._pending(int(notify.payload))
+                            except ValueError:
+                                pass
+                    if self._pending_xid is not None:
+                        self._read_position(cur)
+            except psycopg2.Error as e:
+                print(f"❌Change listener failed, retrying: {e}")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
@@ -0,0 +1,432 @@
+import hashlib
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.cluster import DBSCAN
+from sklearn.decomposition import TruncatedSVD
+from sklearn.metrics import adjusted_rand_score
+from sklearn.preprocessing import normalize
+
+from blocking import cluster_blocks
+from features import NUTRITION_WEIGHT, build_feature_pipeline, feature_frame, nutrition_weight, text_vectorizer, transform_features, uses_nutrition
+from neighbors import DEFAULT_BACKEND, build_index
+
+# DBSCAN settings used for the product clusters
+DBSCAN_EPS = 0.3
+DBSCAN_MIN_SAMPLES = 3
+
+# Dimensions of the optional TruncatedSVD stage: the TF-IDF rows are projected to this many
+# dense float32 dimensions and clustered / searched there. None clusters the sparse TF-IDF rows.
+SVD_COMPONENTS = None
+
+# Share of the tokens of new products missing from the fitted vocabulary above which the
+# incremental mode gives up and the whole catalogue is re-fitted
+MAX_VOCABULARY_DRIFT = 0.2
+
+
+def text_hashes(texts):
+    """64-bit hash of every cleaned text, used to tell whether the clustering input changed."""
+    return pd.util.hash_pandas_object(pd.Series(texts, dtype=object), index=False).to_numpy()
+
+
+def input_hashes(texts, nutrition=None):
+    """Per-row hash of the clustering input: the cleaned text, plus the nutrition values when they are used."""
+    if nutrition is None:
+        return text_hashes(texts)
+    return pd.util.hash_pandas_object(feature_frame(texts, nutrition), index=False).to_numpy()
+
+
+def content_hash(product_ids, hashes):
+    """Hash of the whole clustering input (ids + cleaned texts), independent of the row order."""
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    order = np.argsort(product_ids, kind='stable')
+    digest = hashlib.sha256()
+    digest.update(product_ids[order].tobytes())
+    digest.update(np.asarray(hashes, dtype=np.uint64)[order].tobytes())
+    return digest.hexdigest()
+
+
+class ClusteringState:
+    """
+    Everything needed to place new products in the existing clusters without refitting:
+    the fitted feature pipeline (features.build_feature_pipeline: TF-IDF, plus the scaled
+    nutrition columns when NUTRITION_WEIGHT is set), the feature row of every clustered
+    product, the product ids of those rows, their DBSCAN labels (-1 = noise) and the hash
+    of the input each row was computed from.
+
+    `vectorizer` may also be a function returning the pipeline, so a stored state only
+    loads it when new products are actually transformed; states stored before the pipeline
+    existed hold a plain TfidfVectorizer. `full_fit` tells whether the
+    labels come straight from DBSCAN (False once incremental assignments were added).
+
+    With the SVD stage, `components` holds the fitted SVD components (n_components x terms)
+    and `reduced` the projected, L2-normalized float32 row of every product; clustering and
+    neighbour search then run on `reduced` (see search_vectors).
+    """
+
+    def __init__(self, vectorizer, vectors, product_ids, labels, hashes, full_fit=True, eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES,
+                 components=None, reduced=None):
+        self._vectorizer = vectorizer
+        self.vectors = sparse.csr_matrix(vectors)
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.text_hashes = np.asarray(hashes, dtype=np.uint64)
+        self.full_fit = full_fit
+        self.eps = eps
+        self.min_samples = min_samples
+        self.components = components
+        self.reduced = reduced
+        self._indexes = {}
+
+    @property
+    def features(self):
+        """The fitted feature pipeline."""
+        if not hasattr(self._vectorizer, 'transform'):
+            self._vectorizer = self._vectorizer()
+        return self._vectorizer
+
+    @property
+    def vectorizer(self):
+        """The fitted TF-IDF vectorizer (text part of the feature pipeline)."""
+        return text_vectorizer(self.features)
+
+    @property
+    def uses_nutrition(self):
+        return uses_nutrition(self.features)
+
+    @property
+    def nutrition_weight(self):
+        return nutrition_weight(self.features)
+
+    def transform(self, texts, nutrition=None):
+        """Feature rows of new products (`nutrition`: their NUTRITION_COLS, if the pipeline uses them)."""
+        return transform_features(self.features, texts, nutrition)
+
+    def content_hash(self):
+        return content_hash(self.product_ids, self.text_hashes)
+
+    @property
+    def n_components(self):
+        return self.components.shape[0] if self.components is not None else None
+
+    @property
+    def search_vectors(self):
+        """Rows clustering and neighbour search run on: the reduced rows, else the TF-IDF rows."""
+        return self.reduced if self.reduced is not None else self.vectors
+
+    def project(self, vectors):
+        """TF-IDF rows in the space of search_vectors."""
+        return project(vectors, self.components) if self.components is not None else vectors
+
+    def neighbour_index(self, backend=DEFAULT_BACKEND):
+        """Neighbour index over search_vectors (built once per backend)."""
+        if backend not in self._indexes:
+            self._indexes[backend] = build_index(self.search_vectors, backend)
+        return self._indexes[backend]
+
+    def similarity(self, row_ids, column_ids):
+        """
+        Cosine similarity of the feature rows of two lists of products, as a DataFrame
+        (row_ids x column_ids); NaN for products that are not in the state.
+        """
+        position = pd.Series(np.arange(len(self.product_ids)), index=self.product_ids)
+        rows = position.reindex(np.asarray(row_ids, dtype=np.int64)).to_numpy()
+        columns = position.reindex(np.asarray(column_ids, dtype=np.int64)).to_numpy()
+        result = np.full((len(rows), len(columns)), np.nan)
+        found_rows, found_columns = ~np.isnan(rows), ~np.isnan(columns)
+        if found_rows.any() and found_columns.any():
+            a = normalize(self.search_vectors[rows[found_rows].astype(np.int64)])
+            b = normalize(self.search_vectors[columns[found_columns].astype(np.int64)])
+            sims = a @ b.T
+            result[np.ix_(found_rows, found_columns)] = sims.toarray() if sparse.issparse(sims) else sims
+        return pd.DataFrame(result, index=list(row_ids), columns=list(column_ids))
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def next_label(self):
+        return int(self.labels.max()) + 1 if len(self.labels) and self.labels.max() >= 0 else 0
+
+    def cluster_counts(self):
+        """Cluster size of every row (1 for noise), as stored in product.cluster_count."""
+        labels = pd.Series(self.labels)
+        counts = labels.map(labels.value_counts())
+        counts[labels == -1] = 1
+        return counts.to_numpy()
+
+    def without(self, product_ids):
+        """Copy of the state without the given products (e.g. before re-adding them)."""
+        keep = ~np.isin(self.product_ids, list(product_ids))
+        return ClusteringState(self._vectorizer, self.vectors[keep], self.product_ids[keep], self.labels[keep],
+                               self.text_hashes[keep], False, self.eps, self.min_samples,
+                               self.components, self.reduced[keep] if self.reduced is not None else None)
+
+
+def reduce_dimensions(vectors, n_components, seed=0):
+    """
+    Fits a TruncatedSVD on the TF-IDF rows and returns (components, reduced): the components
+    as float32 (n_components x terms) and the projected rows, L2-normalized float32.
+    """
+    n_components = min(n_components, vectors.shape[1] - 1)
+    svd = TruncatedSVD(n_components=n_components, random_state=seed)
+    svd.fit(vectors)
+    components = svd.components_.astype(np.float32)
+    return components, project(vectors, components)
+
+
+def project(vectors, components):
+    """TF-IDF rows projected on fitted SVD components, L2-normalized (cosine = dot product)."""
+    reduced = np.asarray(vectors @ components.T, dtype=np.float32)
+    norms = np.linalg.norm(reduced, axis=1)
+    norms[norms == 0] = 1.0
+    reduced /= norms[:, None]
+    return reduced
+
+
+def _dbscan(index, eps, min_samples):
+    # DBSCAN over the eps-neighbourhood graph of a neighbour index (cosine distances)
+    dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed')
+    return dbscan.fit_predict(index.radius_graph(eps)).astype(np.int64)
+
+
+def fit_clustering(product_ids, texts, eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES, backend=DEFAULT_BACKEND,
+                   n_components=SVD_COMPONENTS, nutrition=None, nutrition_weight=NUTRITION_WEIGHT, blocks=None):
+    """
+    Full fit: TF-IDF over all texts and DBSCAN (cosine distance) over the TF-IDF rows, or
+    over their `n_components`-dimensional SVD projection when n_components is set.
+
+    With a `nutrition` DataFrame (NUTRITION_COLS of the same products) and a nutrition_weight,
+    the rows are the combined text + scaled nutrition features (features.py) instead.
+
+    DBSCAN gets the eps-neighbourhood graph from a neighbour index (see neighbors.py)
+    instead of computing all pairwise distances itself; with the exact backend and no SVD
+    the labels are the same as DBSCAN(metric='cosine') on the TF-IDF matrix. The graph
+    backend (SVD rows only) can miss eps pairs, and a missed pair can split a cluster.
+
+    With `blocks` ({blocking key: row positions}, see blocking.block_rows) only products
+    sharing a block are compared: every block is clustered on its own (in parallel) and the
+    clusters are merged over the products in several blocks (blocking.cluster_blocks).
+    The features are still fitted over all products, so the stored state is the same kind.
+    Blocks are always compared exactly.
+    """
+    if not nutrition_weight:
+        nutrition = None
+    feature_pipeline = build_feature_pipeline(nutrition_weight if nutrition is not None else 0)
+    vectors = sparse.csr_matrix(feature_pipeline.fit_transform(feature_frame(texts, nutrition)))
+
+    components, reduced = reduce_dimensions(vectors, n_components) if n_components else (None, None)
+    state = ClusteringState(feature_pipeline, vectors, product_ids, np.full(vectors.shape[0], -1),
+                            input_hashes(texts, nutrition), True, eps, min_samples, components, reduced)
+
+    if blocks is not None:
+        state.labels = cluster_blocks(state.search_vectors, blocks, eps, min_samples)
+    else:
+        state.labels = _dbscan(state.neighbour_index(backend), eps, min_samples)
+
+    return state
+
+
+def vocabulary_drift(vectorizer, texts):
+    """Share of the tokens in `texts` that are not in the fitted vocabulary."""
+    analyzer = vectorizer.build_analyzer()
+    vocabulary = vectorizer.vocabulary_
+    total = 0
+    unknown = 0
+    for text in texts:
+        tokens = analyzer(text)
+        total += len(tokens)
+        unknown += sum(1 for t in tokens if t not in vocabulary)
+    return unknown / total if total else 0.0
+
+
+def assign_new_products(state, product_ids, texts, eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES, backend=DEFAULT_BACKEND,
+                        nutrition=None):
+    """
+    Places new products in the existing clusters with an eps-neighbourhood query.
+
+    Each new product (in order) joins the cluster of its most similar clustered neighbour
+    within `eps` cosine distance. Without a clustered neighbour it starts a new cluster
+    (taking its noise neighbours along) when it has at least `min_samples` neighbours
+    including itself, like a DBSCAN core point; otherwise it stays noise (-1).
+
+    Only the new products are vectorized (with the fitted vocabulary/IDF and, if the state
+    uses them, nutrition scaling; pass their NUTRITION_COLS as `nutrition`), so the cost
+    grows with the number of new products, not with the catalogue.
+
+    Returns:
+        A tuple (new_state, changed_ids): the state with the new products appended and the
+        ids of all products whose cluster_id or cluster_count changed.
+    """
+    if not state.uses_nutrition:
+        nutrition = None
+    new_vectors = sparse.csr_matrix(state.transform(texts, nutrition))
+    new_search_vectors = state.project(new_vectors)
+    new_ids = np.asarray(product_ids, dtype=np.int64)
+    n_new = len(new_ids)
+    threshold = 1 - eps
+
+    # Neighbours among the clustered products come from the index; cosine similarity among
+    # the (few) new products is a dot product of the L2-normalized rows
+    old_neighbourhoods = state.neighbour_index(backend).radius_neighbors(new_search_vectors, eps)
+    new_normalized = normalize(new_search_vectors)
+    sim_new = new_normalized @ new_normalized.T
+    sim_new = sim_new.toarray() if sparse.issparse(sim_new) else np.asarray(sim_new)
+
+    labels = state.labels.copy()
+    new_labels = np.full(n_new, -1, dtype=np.int64)
+    next_label = state.next_label()
+    relabeled = set()
+
+    for i in range(n_new):
+        old_neighbours, old_sims = old_neighbourhoods[i]
+        new_neighbours = np.flatnonzero(sim_new[:, i] >= threshold)
+        new_neighbours = new_neighbours[new_neighbours != i]
+
+        # Most similar neighbour that already has a cluster
+        best_label, best_sim = -1, -1.0
+        for j, sim in zip(old_neighbours, old_sims):
+            if labels[j] != -1 and sim > best_sim:
+                best_label, best_sim = labels[j], sim
+        for j in new_neighbours:
+            if new_labels[j] != -1 and sim_new[j, i] > best_sim:
+                best_label, best_sim = new_labels[j], sim_new[j, i]
+
+        if best_label != -1:
+            new_labels[i] = best_label
+        elif len(old_neighbours) + len(new_neighbours) + 1 >= min_samples:
+            new_labels[i] = next_label
+            for j in old_neighbours:
+                labels[j] = next_label
+                relabeled.add(int(state.product_ids[j]))
+            new_neighbours_noise = new_neighbours[new_labels[new_neighbours] == -1]
+            new_labels[new_neighbours_noise] = next_label
+            next_label += 1
+
+    new_state = ClusteringState(state.features,
+                                sparse.vstack([state.vectors, new_vectors], format='csr'),
+                                np.concatenate([state.product_ids, new_ids]),
+                                np.concatenate([labels, new_labels]),
+                                np.concatenate([state.text_hashes, input_hashes(texts, nutrition)]),
+                                False, eps, min_samples, state.components,
+                                np.vstack([state.reduced, new_search_vectors]) if state.reduced is not None else None)
+
+    # Every member of a cluster that gained products has a new cluster_count
+    affected = set(new_labels.tolist()) | {int(l) for l, pid in zip(labels, state.product_ids) if int(pid) in relabeled}
+    affected.discard(-1)
+    changed = set(new_ids.tolist()) | relabeled
+    if affected:
+        changed |= set(new_state.product_ids[np.isin(new_state.labels, list(affected))].tolist())
+
+    return new_state, changed
+
+
+def _matrix_bytes(matrix):
+    if sparse.issparse(matrix):
+        matrix = sparse.csr_matrix(matrix)
+        return int(matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes)
+    return int(np.asarray(matrix).nbytes)
+
+
+def benchmark_reduction(vectors, n_components=(50, 100, 200), eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES):
+    """
+    Clusters the TF-IDF rows directly and after SVD reduction to each of `n_components`
+    dimensions, and reports per run: seconds (SVD fit + projection, and index + DBSCAN),
+    bytes of the vectors clustered (+ components), pairs in the eps graph, number of
+    clusters, and agreement with the sparse labels (adjusted Rand index, and share of rows
+    on which both agree whether they are noise).
+    """
+    def cluster(search_vectors):
+        start = time.perf_counter()
+        labels = _dbscan(build_index(search_vectors), eps, min_samples)
+        return labels, time.perf_counter() - start
+
+    baseline, seconds = cluster(vectors)
+    results = [{"space": "tfidf", "reduce_seconds": 0.0, "cluster_seconds": seconds,
+                "bytes": _matrix_bytes(vectors), "n_clusters": len(set(baseline.tolist()) - {-1}),
+                "adjusted_rand": 1.0, "noise_agreement": 1.0}]
+
+    for k in n_components:
+        start = time.perf_counter()
+        components, reduced = reduce_dimensions(vectors, k)
+        reduce_seconds = time.perf_counter() - start
+        labels, seconds = cluster(reduced)
+        results.append({
+            "space": f"svd{components.shape[0]}",
+            "reduce_seconds": reduce_seconds,
+            "cluster_seconds": seconds,
+            "bytes": _matrix_bytes(reduced) + _matrix_bytes(components),
+            "n_clusters": len(set(labels.tolist()) - {-1}),
+            "adjusted_rand": float(adjusted_rand_score(baseline, labels)),
+            "noise_agreement": float(np.mean((baseline == -1) == (labels == -1))),
+        })
+    return results
+
+
+def benchmark_nutrition_weight(product_ids, texts, nutrition, linked_pairs, weights=(0.25, 0.5, 1.0),
+                               eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES):
+    """
+    Clusters the products on their text only and with the nutrition block at each of
+    `weights`, and reports per run: seconds, number of clusters, share of noise, the share
+    of `linked_pairs` ((id, id) pairs an admin linked as the same product) put in one
+    cluster, products sharing a cluster per product (how much the run merges), and
+    agreement with the text-only labels (adjusted Rand index).
+
+    A weight is worth setting as NUTRITION_WEIGHT when it keeps more linked pairs together
+    without merging much more; eps is kept, so a weight mostly splits text clusters.
+    """
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    position = pd.Series(np.arange(len(product_ids)), index=product_ids)
+    pairs = pd.DataFrame(list(linked_pairs), columns=["a", "b"], dtype=np.int64)
+    pairs = pairs[pairs["a"].isin(position.index) & pairs["b"].isin(position.index)]
+    a, b = position[pairs["a"]].to_numpy(), position[pairs["b"]].to_numpy()
+
+    def run(weight):
+        start = time.perf_counter()
+        labels = fit_clustering(product_ids, texts, eps, min_samples, nutrition=nutrition, nutrition_weight=weight).labels
+        seconds = time.perf_counter() - start
+        sizes = pd.Series(labels[labels >= 0]).value_counts().to_numpy()
+        return labels, {
+            "nutrition_weight": float(weight),
+            "seconds": seconds,
+            "n_clusters": len(sizes),
+            "noise": float(np.mean(labels == -1)),
+            "linked_pairs_together": float(np.mean((labels[a] == labels[b]) & (labels[a] >= 0))) if len(a) else float("nan"),
+            "pairs_per_product": float((sizes * (sizes - 1)).sum() / max(1, len(labels))),
+        }
+
+    baseline, result = run(0.0)
+    results = [dict(result, adjusted_rand=1.0)]
+    for weight in weights:
+        labels, result = run(weight)
+        results.append(dict(result, adjusted_rand=float(adjusted_rand_score(baseline, labels))))
+    return results
+
+
+if __name__ == "__main__":
+    # Sparse vs SVD-reduced clustering on the TF-IDF rows of the latest stored clustering
+    # state: python clustering.py [n_components ...]
+    # Nutrition weights against the admin-linked products of the catalogue (the API must be
+    # running): python clustering.py --nutrition [weight ...]
+    import sys
+
+    from artifact_store import ArtifactStore
+
+    if sys.argv[1:2] == ["--nutrition"]:
+        from services import nutrition_weight_benchmark
+
+        for result in nutrition_weight_benchmark([float(w) for w in sys.argv[2:]] or (0.25, 0.5, 1.0)):
+            print(", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                            for key, value in result.items()))
+        sys.exit()
+
+    state = ArtifactStore().load()
+    if state is None:
+        sys.exit("No clustering artifacts stored yet, run a re-clustering first")
+    n_components = [int(k) for k in sys.argv[1:]] or [50, 100, 200]
+
+    print(f"{len(state)} products, {state.vectors.shape[1]} terms, eps={state.eps}, min_samples={state.min_samples}")
+    for result in benchmark_reduction(state.vectors, n_components, state.eps, state.min_samples):
+        print(", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                        for key, value in result.items()))
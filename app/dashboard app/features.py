@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+# Numeric nutrition columns of a product (compare dialog, edit form and clustering features)
+NUTRITION_COLS = ["energy", "protein", "fat", "saturated_fatty_acid", "carbohydrates", "sugar", "starch", "dietary_fiber", "salt", "sodium", "k", "ca", "p", "fe", "polyols", "cholesterol", "omega3", "omega6", "mov",
+                  "eov", "vit_a", "vit_b12", "vit_b6", "vit_b1", "vit_b2", "vit_c", "vit_d", "mg", "water", "remarks_carbohydrates", "glucose", "fructose", "excess_fructose", "lactose", "sorbitol", "mannitol", "fructans", "gos"]
+
+# Weight of the scaled nutrition block next to the (unit-length) TF-IDF row of a product, as
+# the length of an average nutrition row; 0 = cluster on the text only. Kept at 0 until
+# `python clustering.py --nutrition` (clustering.benchmark_nutrition_weight) shows a weight
+# that keeps more admin-linked products in one cluster on the real catalogue: with
+# DBSCAN_EPS tuned on text-only distances, a nutrition block mostly adds distance, and on a
+# synthetic catalogue with unrelated nutrition values 0.25 already kept 65% of the linked
+# pairs together instead of 88% (0.5: 1%).
+NUTRITION_WEIGHT = 0.0
+
+TEXT_COLUMN = "to_vectorize"
+
+
+def feature_frame(texts, nutrition=None):
+    """Input of the feature pipeline: the cleaned text plus the nutrition columns (as floats)."""
+    frame = pd.DataFrame({TEXT_COLUMN: list(texts)})
+    if nutrition is not None:
+        nutrition = pd.DataFrame(nutrition).reindex(columns=NUTRITION_COLS)
+        for col in NUTRITION_COLS:
+            frame[col] = pd.to_numeric(nutrition[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return frame
+
+
+def build_feature_pipeline(nutrition_weight=NUTRITION_WEIGHT):
+    """
+    One ColumnTransformer turning a feature_frame into a sparse matrix: the TF-IDF of the
+    cleaned text, and with a nutrition_weight the nutrition columns (missing = 0, then
+    standardized) next to it, scaled so an average nutrition row has length nutrition_weight.
+    """
+    transformers = [("text", TfidfVectorizer(use_idf=True), TEXT_COLUMN)]
+    weights = {"text": 1.0}
+    if nutrition_weight:
+        nutrition = make_pipeline(SimpleImputer(strategy="constant", fill_value=0.0), StandardScaler())
+        transformers.append(("nutrition", nutrition, NUTRITION_COLS))
+        weights["nutrition"] = nutrition_weight / np.sqrt(len(NUTRITION_COLS))
+    return ColumnTransformer(transformers, transformer_weights=weights, sparse_threshold=1.0)
+
+
+def text_vectorizer(pipeline):
+    """The TF-IDF step of a fitted feature pipeline (or the vectorizer itself for older states)."""
+    if isinstance(pipeline, ColumnTransformer):
+        return pipeline.named_transformers_["text"]
+    return pipeline
+
+
+def uses_nutrition(pipeline):
+    return isinstance(pipeline, ColumnTransformer) and "nutrition" in pipeline.named_transformers_
+
+
+def nutrition_weight(pipeline):
+    if not uses_nutrition(pipeline):
+        return 0.0
+    return round(float(pipeline.transformer_weights["nutrition"] * np.sqrt(len(NUTRITION_COLS))), 6)
+
+
+def transform_features(pipeline, texts, nutrition=None):
+    """Feature rows of new products with a fitted pipeline (TF-IDF only for older states)."""
+    if isinstance(pipeline, ColumnTransformer):
+        return pipeline.transform(feature_frame(texts, nutrition if uses_nutrition(pipeline) else None))
+    return pipeline.transform(texts)
+
+
+
+def nutrition_similarities(left, right):
+    """
+    The nutrition score of the compare dialog for every left x right pair of products, in
+    percent: 100 minus the Euclidean distance of their nutrition values relative to the length
+    of the right product's values (missing values count as 0). A right product without
+    nutrition values scores 100 against another one without, NaN against any other.
+    """
+    cols = [c for c in NUTRITION_COLS if c in left.columns and c in right.columns]
+    a = left[cols].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+    b = right[cols].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+    dist = np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2))
+    norm = np.sqrt((b ** 2).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sims = 100 - dist / norm * 100
+    return np.where(norm == 0, np.where(dist == 0, 100.0, np.nan), sims)
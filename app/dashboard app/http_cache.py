@@ -0,0 +1,65 @@
+import json
+import threading
+from collections import OrderedDict
+
+import requests
+
+
+class ConditionalCache:
+    """
+    Bounded LRU cache of JSON GET responses that revalidates with ETags.
+
+    A cached URL is re-requested with If-None-Match; when the API answers 304 the cached
+    body is returned, so neither the query nor the payload is repeated. Responses
+    without an ETag (or with an error status) are never cached.
+
+    The body is kept as the bytes received and decoded for every caller, so each one gets
+    its own objects: a caller changing the dict/list it got cannot change what the next
+    caller gets (decoding is cheaper than a deep copy).
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # url -> (etag, body bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_json(self, url, **kwargs):
+        with self._lock:
+            cached = self._entries.get(url)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached:
+            headers["If-None-Match"] = cached[0]
+
+        response = requests.get(url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and cached:
+            with self._lock:
+                self.hits += 1
+                if url in self._entries:
+                    self._entries.move_to_end(url)
+            return json.loads(cached[1])
+
+        data = response.json()
+        etag = response.headers.get("ETag")
+        with self._lock:
+            self.misses += 1
+            if response.status_code == 200 and etag:
+                self._entries[url] = (etag, response.content)
+                self._entries.move_to_end(url)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.pop(url, None)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
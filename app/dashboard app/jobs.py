@@ -0,0 +1,259 @@
+import multiprocessing
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+# Job states; a job ends in one of FINISHED_STATES
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# Finished jobs kept for status lookups
+KEEP_FINISHED_JOBS = 20
+
+# Seconds a single-flight lease stays valid without renewal (renewed every third of it while the
+# job is queued or running), so the lease of a crashed process frees up after this long
+JOB_LEASE_TTL = 60.0
+
+
+class JobCancelled(Exception):
+    """Raised inside a job by its progress callback once the job was cancelled."""
+
+
+class JobConflict(Exception):
+    """A job with the same single-flight key is still queued or running (job=None: in another process)."""
+
+    def __init__(self, job, key=None):
+        if job is None:
+            super().__init__(f"A job with key {key!r} is already running in another process")
+        else:
+            super().__init__(f"Job {job.id} ({job.kind}) is already {job.status}")
+        self.job = job
+
+
+class Job:
+    """
+    Status of one submitted job. `progress` (0-1) and `message` are reported by the worker
+    through the shared dict; `result` / `error` are set when the job finished.
+    """
+
+    def __init__(self, kind, key, shared, cancel_event):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._shared = shared
+        self._cancel_event = cancel_event
+        self._future = None
+
+    @property
+    def progress(self):
+        try:
+            return self._shared.get("progress", 0.0)
+        except Exception:
+            return 1.0 if self.status == DONE else 0.0
+
+    @property
+    def message(self):
+        try:
+            return self._shared.get("message", "")
+        except Exception:
+            return ""
+
+    @property
+    def finished_ok(self):
+        return self.status == DONE
+
+    def to_dict(self):
+        return {"id": self.id, "kind": self.kind, "status": self.status, "progress": self.progress,
+                "message": self.message, "error": self.error, "created": self.created, "finished": self.finished}
+
+
+def _run_job(fn, args, kwargs, shared, cancel_event):
+    # Runs in the worker process
+    def progress(fraction, message=None):
+        if cancel_event.is_set():
+            raise JobCancelled()
+        shared["progress"] = float(fraction)
+        if message is not None:
+            shared["message"] = message
+
+    if cancel_event.is_set():
+        raise JobCancelled()
+    shared["status"] = RUNNING
+    return fn(*args, progress=progress, **kwargs)
+
+
+class JobRunner:
+    """
+    Runs long jobs (re-clustering) in a worker process pool so the dashboard sessions stay
+    responsive.
+
+    `fn` is called in the worker as fn(*args, progress=callback, **kwargs) and reports with
+    callback(fraction, message); once the job is cancelled the next callback raises
+    JobCancelled, so work stops at the next checkpoint. `on_done(result)` runs in this
+    process after a successful run (e.g. to write the results back), so a cancelled or
+    failed job leaves no partial results behind. Only one job per single-flight `key` can
+    be queued or running at a time; submitting another raises JobConflict.
+
+    On its own that only holds within this process. With `acquire_lease(key, owner, ttl)`
+    (True when taken or renewed, False when another owner holds it) and
+    `release_lease(key, owner)`, a job also holds a lease of its key, shared by every process
+    (see services.acquire_job_lease). The lease is renewed while the job is queued or running;
+    a job whose lease was lost is cancelled.
+
+    The pool (default: one worker) is kept between jobs, so the caches of the worker
+    process (cleaned texts, stems) survive from one run to the next.
+    """
+
+    def __init__(self, max_workers=1, acquire_lease=None, release_lease=None, lease_ttl=JOB_LEASE_TTL):
+        self.max_workers = max_workers
+        self.acquire_lease = acquire_lease
+        self.release_lease = release_lease
+        self.lease_ttl = lease_ttl
+        self._executor = None
+        self._manager = None
+        self._renewer = None
+        self._stopped = threading.Event()
+        self._jobs = {}
+        self._active = {}   # single-flight key -> job
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._manager = multiprocessing.Manager()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        if self.acquire_lease is not None and self._renewer is None:
+            self._stopped.clear()
+            self._renewer = threading.Thread(target=self._renew_leases, daemon=True)
+            self._renewer.start()
+
+    def _renew_leases(self):
+        # Background thread: keeps the leases of the queued/running jobs from expiring
+        while not self._stopped.wait(self.lease_ttl / 3):
+            with self._lock:
+                jobs = [job for job in self._active.values() if job.status not in FINISHED_STATES]
+            for job in jobs:
+                try:
+                    held = self.acquire_lease(job.key, job.id, self.lease_ttl)
+                except Exception:
+                    traceback.print_exc()
+                    continue
+                if not held:
+                    print(f"❌Job {job.id} ({job.kind}) lost its lease, cancelling it")
+                    self.cancel(job.id)
+
+    def submit(self, kind, fn, *args, key=None, on_done=None, **kwargs):
+        """Queues fn(*args, **kwargs) in the pool and returns its Job."""
+        with self._lock:
+            key = kind if key is None else key
+            active = self._active.get(key)
+            if active is not None and active.status not in FINISHED_STATES:
+                raise JobConflict(active)
+
+            self._ensure_started()
+            shared = self._manager.dict({"status": QUEUED, "progress": 0.0, "message": "Waiting for a worker..."})
+            job = Job(kind, key, shared, self._manager.Event())
+            if self.acquire_lease is not None and not self.acquire_lease(key, job.id, self.lease_ttl):
+                raise JobConflict(None, key)
+            try:
+                job._future = self._executor.submit(_run_job, fn, args, kwargs, shared, job._cancel_event)
+            except Exception:
+                self._release(job)
+                raise
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self._prune()
+
+        job._future.add_done_callback(lambda future: self._finish(job, future, on_done))
+        return job
+
+    def _finish(self, job, future, on_done):
+        # Runs in a pool thread of this process once the worker is done
+        try:
+            result = future.result()
+        except (JobCancelled, CancelledError):
+            status, result, error = CANCELLED, None, None
+        except Exception as e:
+            status, result, error = FAILED, None, f"{type(e).__name__}: {e}"
+        else:
+            status, error = DONE, None
+            if on_done is not None:
+                try:
+                    result = on_done(result)
+                except Exception as e:
+                    traceback.print_exc()
+                    status, result, error = FAILED, None, f"{type(e).__name__}: {e}"
+
+        with self._lock:
+            job.result, job.error = result, error
+            job.finished = time.time()
+            job.status = status
+            try:
+                job._shared["progress"] = 1.0 if status == DONE else job._shared.get("progress", 0.0)
+            except Exception:
+                pass
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+        # Only now, after on_done wrote the results back, may another process start the next job
+        self._release(job)
+
+    def _release(self, job):
+        if self.release_lease is None:
+            return
+        try:
+            self.release_lease(job.key, job.id)
+        except Exception:
+            # The lease then expires after lease_ttl
+            traceback.print_exc()
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.status in FINISHED_STATES]
+        for job in sorted(finished, key=lambda j: j.created)[:max(0, len(finished) - KEEP_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and job.status == QUEUED:
+            try:
+                if job._shared.get("status") == RUNNING:
+                    job.status = RUNNING
+            except Exception:
+                pass
+        return job
+
+    def active(self, key):
+        """The queued or running job of a single-flight key, or None."""
+        with self._lock:
+            job = self._active.get(key)
+        return self.get(job.id) if job is not None else None
+
+    def cancel(self, job_id):
+        """Asks a job to stop; returns False when it already finished."""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            return False
+        job._cancel_event.set()
+        job._future.cancel()    # Only succeeds while the job is still queued
+        return True
+
+    def shutdown(self):
+        self._stopped.set()
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status not in FINISHED_STATES:
+                    job._cancel_event.set()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._manager.shutdown()
+            self._executor = self._manager = self._renewer = None
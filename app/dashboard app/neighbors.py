@@ -0,0 +1,613 @@
+import time
+
+import numpy as np
+from scipy import sparse
+
+# Largest similarity block (query rows x indexed rows) materialized at once by ExactIndex
+BLOCK_ELEMENTS = 2 ** 24
+
+# Rows of consecutive blocks scored against each other at once by block_radius_graph
+GROUP_ROWS = 1024
+
+# Defaults of the graph backend: every indexed row keeps its GRAPH_NEIGHBOURS most similar
+# rows, found in the leaves (at most GRAPH_LEAF_SIZE rows) of GRAPH_TREES random-projection
+# trees and refined by GRAPH_ROUNDS rounds of comparing each row with its neighbours'
+# neighbours. A query starts from its leaves in the first GRAPH_SEARCH_TREES trees, keeps
+# the GRAPH_SEARCH_WIDTH best rows found so far and moves on to their neighbours until none
+# of them changes.
+GRAPH_NEIGHBOURS = 16
+GRAPH_TREES = 8
+GRAPH_LEAF_SIZE = 64
+GRAPH_ROUNDS = 1
+GRAPH_SEARCH_WIDTH = 32
+GRAPH_SEARCH_TREES = 2
+
+# Rows of the graph backend compared with their candidates at once
+GRAPH_BLOCK_ROWS = 1024
+
+# Similarities this close count as equal when comparing backends (float32 rows)
+SIMILARITY_TOLERANCE = 1e-5
+
+# Pairs scored at once by _rowwise_dot on dense rows
+PAIR_BLOCK = 2 ** 20
+
+
+def _normalize_rows(vectors):
+    """L2-normalized rows: CSR (float64) for sparse input, a float32 array for dense input."""
+    if not sparse.issparse(vectors):
+        vectors = np.array(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1.0
+        vectors /= norms[:, None]
+        return vectors
+    vectors = sparse.csr_matrix(vectors, dtype=np.float64)
+    norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1.0 / norms) @ vectors)
+
+
+def _rowwise_dot(vectors, rows, cols):
+    """Similarity of the pairs (rows[i], cols[i]) of dense rows."""
+    sims = np.empty(len(rows), dtype=np.float64)
+    for start in range(0, len(rows), PAIR_BLOCK):
+        a = vectors[rows[start:start + PAIR_BLOCK]]
+        b = vectors[cols[start:start + PAIR_BLOCK]]
+        sims[start:start + PAIR_BLOCK] = np.einsum('ij,ij->i', a, b)
+    return sims
+
+
+def _block_pairs(block, threshold):
+    """(rows, cols, similarities) of the entries >= threshold of a similarity block."""
+    if sparse.issparse(block):
+        block = block.tocoo()
+        keep = block.data >= threshold
+        return block.row[keep], block.col[keep], block.data[keep]
+    rows, cols = np.nonzero(block >= threshold)
+    return rows, cols, block[rows, cols]
+
+
+def _top_k(indices, sims, k, exclude=-1):
+    """The k most similar (index, similarity) pairs of one query, padded with (-1, 0.0)."""
+    keep = indices != exclude
+    indices, sims = indices[keep], sims[keep]
+    if len(sims) > k:
+        part = np.argpartition(-sims, k - 1)[:k]
+        indices, sims = indices[part], sims[part]
+    order = np.lexsort((indices, -sims))
+    out_indices = np.full(k, -1, dtype=np.int64)
+    out_sims = np.zeros(k, dtype=np.float64)
+    out_indices[:len(order)] = indices[order]
+    out_sims[:len(order)] = sims[order]
+    return out_indices, out_sims
+
+
+def _distance_graph(n, rows, cols, sims):
+    """CSR matrix of cosine distances (1 - similarity) for DBSCAN(metric='precomputed').
+
+    Zero distances (identical texts) are kept as explicit entries, since only the stored
+    entries of a sparse precomputed matrix count as neighbours. Every row is ordered by
+    distance, as the radius neighbour search of DBSCAN wants it (otherwise it sorts the
+    rows again one by one).
+    """
+    rows = np.concatenate([np.asarray(rows, dtype=np.int64), np.arange(n)])
+    cols = np.concatenate([np.asarray(cols, dtype=np.int64), np.arange(n)])
+    distances = np.concatenate([np.clip(1.0 - np.asarray(sims, dtype=np.float64), 0.0, None), np.zeros(n)])
+
+    # Drop duplicate pairs (the diagonal added above)
+    _, first = np.unique(rows * n + cols, return_index=True)
+    rows, cols, distances = rows[first], cols[first], distances[first]
+
+    order = np.lexsort((cols, distances, rows))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return sparse.csr_matrix((distances[order], cols[order], indptr), shape=(n, n))
+
+
+class NeighbourIndex:
+    """
+    Cosine-similarity neighbour search over the (L2-normalized) rows of a sparse matrix
+    (TF-IDF) or of a dense array (e.g. SVD-reduced vectors, see clustering.reduce_dimensions).
+
+    Backends implement _candidates(); the similarities are always computed exactly on the
+    candidates, so an approximate backend can only miss neighbours, never report wrong scores.
+    """
+
+    name = None
+
+    def __init__(self, vectors):
+        self.vectors = _normalize_rows(vectors)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def _prepare(self, queries):
+        return self.vectors if queries is None else _normalize_rows(queries)
+
+    def _candidates(self, queries):
+        """Yields (query_offset, candidate_matrix) blocks: rows of similarities of the queries
+        against the indexed rows, restricted to the candidates of the backend."""
+        raise NotImplementedError
+
+    def kneighbors(self, queries=None, k=10, exclude_self=False):
+        """
+        The k most similar indexed rows of every query row (default: the indexed rows themselves).
+
+        Returns:
+            (indices, similarities), both of shape (n_queries, k), padded with -1 / 0.0 when
+            fewer than k candidates were found. `exclude_self` leaves out row i for query i.
+        """
+        queries = self._prepare(queries)
+        n_queries = queries.shape[0]
+        indices = np.full((n_queries, k), -1, dtype=np.int64)
+        sims = np.zeros((n_queries, k), dtype=np.float64)
+        for offset, block in self._candidates(queries):
+            block = sparse.csr_matrix(block)
+            for i in range(block.shape[0]):
+                start, end = block.indptr[i], block.indptr[i + 1]
+                exclude = offset + i if exclude_self else -1
+                indices[offset + i], sims[offset + i] = _top_k(block.indices[start:end], block.data[start:end], k, exclude)
+        return indices, sims
+
+    def radius_neighbors(self, queries=None, radius=0.3):
+        """List of (indices, similarities) of the indexed rows within `radius` cosine distance of each query."""
+        queries = self._prepare(queries)
+        threshold = 1.0 - radius
+        result = [None] * queries.shape[0]
+        for offset, block in self._candidates(queries):
+            block = sparse.csr_matrix(block)
+            for i in range(block.shape[0]):
+                start, end = block.indptr[i], block.indptr[i + 1]
+                row_indices, row_sims = block.indices[start:end], block.data[start:end]
+                keep = row_sims >= threshold
+                result[offset + i] = (row_indices[keep].astype(np.int64), row_sims[keep])
+        return result
+
+    def radius_graph(self, radius=0.3):
+        """Sparse cosine-distance matrix of all indexed pairs within `radius` (for DBSCAN(metric='precomputed'))."""
+        threshold = 1.0 - radius
+        rows, cols, sims = [], [], []
+        for offset, block in self._candidates(self.vectors):
+            block_rows, block_cols, block_sims = _block_pairs(block, threshold)
+            rows.append(block_rows + offset)
+            cols.append(block_cols)
+            sims.append(block_sims)
+        if not rows:
+            return _distance_graph(len(self), [], [], [])
+        return _distance_graph(len(self), np.concatenate(rows), np.concatenate(cols), np.concatenate(sims))
+
+    def block_radius_graph(self, sizes, radius=0.3, group_rows=GROUP_ROWS, block_elements=BLOCK_ELEMENTS):
+        """
+        radius_graph restricted to the pairs within one block, the indexed rows being
+        consecutive blocks of `sizes` rows (a block-diagonal graph). Consecutive blocks of
+        up to `group_rows` rows together are scored against each other and the pairs across
+        blocks dropped, so the work grows with the block sizes instead of with the square
+        of the number of rows, without a matrix product per (small) block. A larger block
+        is scored in slices of its rows, at most `block_elements` similarities at once.
+        """
+        threshold = 1.0 - radius
+        bounds = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+        block_of = np.repeat(np.arange(len(sizes)), sizes)
+        rows, cols, sims = [], [], []
+        first = 0
+        while first < len(sizes):
+            last = first + 1
+            while last < len(sizes) and bounds[last + 1] - bounds[first] <= group_rows:
+                last += 1
+            start, end = bounds[first], bounds[last]
+            group = self.vectors[start:end]
+            group_t = group.T
+            slice_rows = max(1, block_elements // (end - start))
+            for offset in range(0, end - start, slice_rows):
+                found_rows, found_cols, found_sims = _block_pairs(group[offset:offset + slice_rows] @ group_t,
+                                                                  threshold)
+                found_rows = found_rows + start + offset
+                found_cols = found_cols + start
+                same_block = block_of[found_rows] == block_of[found_cols]
+                rows.append(found_rows[same_block])
+                cols.append(found_cols[same_block])
+                sims.append(found_sims[same_block])
+            first = last
+        if not rows:
+            return _distance_graph(len(self), [], [], [])
+        return _distance_graph(len(self), np.concatenate(rows), np.concatenate(cols), np.concatenate(sims))
+
+
+class ExactIndex(NeighbourIndex):
+    """Exact search: sparse dot products of blocks of query rows against all indexed rows."""
+
+    name = "exact"
+
+    def __init__(self, vectors, block_elements=BLOCK_ELEMENTS):
+        super().__init__(vectors)
+        self.block_elements = block_elements
+        self._vectors_t = self.vectors.T.tocsc() if sparse.issparse(self.vectors) else self.vectors.T
+
+    def _candidates(self, queries):
+        block_rows = max(1, self.block_elements // max(1, len(self)))
+        for start in range(0, queries.shape[0], block_rows):
+            yield start, queries[start:start + block_rows] @ self._vectors_t
+
+
+def _top_columns(space, queries, ids, k):
+    """
+    Per query row, the k distinct rows of `space` among `ids` (n x m, -1 = none) most
+    similar to it, as (ids, similarities) of shape n x k, most similar first and padded
+    with (-1, -inf).
+    """
+    ids = np.sort(ids, axis=1)
+    duplicate = np.zeros(ids.shape, dtype=bool)
+    duplicate[:, 1:] = ids[:, 1:] == ids[:, :-1]
+    ids = np.where(duplicate, -1, ids)
+    sims = _candidate_sims(space, queries, ids)
+    if ids.shape[1] > k:
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        ids, sims = np.take_along_axis(ids, part, axis=1), np.take_along_axis(sims, part, axis=1)
+    order = np.argsort(-sims, axis=1, kind='stable')
+    ids, sims = np.take_along_axis(ids, order, axis=1), np.take_along_axis(sims, order, axis=1)
+    ids = np.where(np.isinf(sims), -1, ids)
+    if ids.shape[1] < k:
+        pad = k - ids.shape[1]
+        ids = np.pad(ids, ((0, 0), (0, pad)), constant_values=-1)
+        sims = np.pad(sims, ((0, 0), (0, pad)), constant_values=-np.inf)
+    return ids, sims
+
+
+def _candidate_sims(space, queries, ids):
+    """Similarities (n x m) of every query row with the rows `ids` (n x m, -1 = none) of `space`."""
+    sims = np.matmul(np.take(space, np.maximum(ids, 0), axis=0), queries[:, :, None])[:, :, 0]
+    return np.where(ids < 0, -np.inf, sims)
+
+
+class _ProjectionTree:
+    """
+    Random-projection tree over the (dense) rows of `space`: a node is split by the
+    hyperplane halfway between two of its rows (at random when that leaves one side empty,
+    e.g. for identical rows) until it has at most leaf_size rows. `leaves` holds the leaf
+    of every row; route() finds the leaf of new rows (a random split sends them left).
+    """
+
+    def __init__(self, space, leaf_size, rng):
+        self.leaf_size = leaf_size
+        self._levels = []   # per level: (split nodes, their normals, offsets, degenerate, child keys)
+        node = np.zeros(len(space), dtype=np.int64)
+        while True:
+            sizes = np.bincount(node)
+            rows = np.flatnonzero(sizes[node] > leaf_size)
+            if not len(rows):
+                break
+            nodes, lookup, counts = np.unique(node[rows], return_inverse=True, return_counts=True)
+            members = rows[np.argsort(lookup, kind='stable')]
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            a = space[members[starts + (rng.random(len(nodes)) * counts).astype(np.int64)]]
+            b = space[members[starts + (rng.random(len(nodes)) * counts).astype(np.int64)]]
+            normals = a - b
+            offsets = np.einsum('ij,ij->i', normals, (a + b) / 2)
+            side = np.einsum('ij,ij->i', space[rows], normals[lookup]) > offsets[lookup]
+            upper = np.bincount(lookup, weights=side, minlength=len(nodes))
+            degenerate = (upper == 0) | (upper == counts)
+            random_side = degenerate[lookup]
+            side[random_side] = rng.random(int(random_side.sum())) < 0.5
+            split = node * 2
+            split[rows] += side
+            keys, node = np.unique(split, return_inverse=True)
+            node = node.ravel()
+            self._levels.append((nodes, normals, offsets, degenerate, keys))
+        self.leaves = node
+        self._order = np.argsort(node, kind='stable')
+        self._bounds = np.searchsorted(node[self._order], np.arange(node.max() + 2))
+
+    def route(self, queries):
+        """Leaf of every (dense) query row."""
+        node = np.zeros(len(queries), dtype=np.int64)
+        for nodes, normals, offsets, degenerate, keys in self._levels:
+            lookup = np.minimum(np.searchsorted(nodes, node), len(nodes) - 1)
+            split = (nodes[lookup] == node) & ~degenerate[lookup]
+            side = np.einsum('ij,ij->i', queries, normals[lookup]) > offsets[lookup]
+            node = np.searchsorted(keys, node * 2 + (split & side))
+        return node
+
+    def members(self, leaves):
+        """Rows of each of `leaves`, as an array of len(leaves) x leaf_size padded with -1."""
+        positions = self._bounds[leaves][:, None] + np.arange(self.leaf_size)
+        inside = positions < self._bounds[leaves + 1][:, None]
+        return np.where(inside, self._order[np.minimum(positions, len(self._order) - 1)], -1)
+
+
+class GraphIndex(NeighbourIndex):
+    """
+    Approximate search over a k-nearest-neighbour graph of the indexed rows, which must be
+    dense (the SVD-reduced rows, see clustering.reduce_dimensions): on sparse TF-IDF rows
+    the exact index is already cheap. The graph starts from the rows sharing a leaf in
+    `n_trees` random-projection trees and is refined by `rounds` rounds of comparing each
+    row with its neighbours' neighbours (NN-descent).
+
+    A query row starts from the rows of its leaf in the first `search_trees` trees and
+    repeatedly scores the graph neighbours of the `search_width` best rows found so far,
+    until those stop changing; the indexed rows themselves are answered from their graph
+    row. Radius
+    queries then follow the graph (both directions) from every row found within the
+    radius. All candidates are scored exactly, so the index can only miss neighbours.
+    """
+
+    name = "graph"
+
+    def __init__(self, vectors, n_neighbors=GRAPH_NEIGHBOURS, n_trees=GRAPH_TREES, leaf_size=GRAPH_LEAF_SIZE,
+                 rounds=GRAPH_ROUNDS, search_width=GRAPH_SEARCH_WIDTH, search_trees=GRAPH_SEARCH_TREES, seed=0):
+        if sparse.issparse(vectors):
+            raise ValueError("The graph backend indexes dense (SVD-reduced) rows, use the exact backend for sparse rows")
+        super().__init__(vectors)
+        n = len(self)
+        self.n_neighbors = min(n_neighbors, max(n - 1, 0))
+        self.search_width = search_width
+        self.search_trees = search_trees
+        rng = np.random.default_rng(seed)
+        self._trees = [_ProjectionTree(self.vectors, leaf_size, rng) for _ in range(n_trees)]
+
+        ids = np.full((n, self.n_neighbors), -1, dtype=np.int64)
+        if self.n_neighbors:
+            ids = self._merge(ids, np.hstack([self._leaf_neighbours(tree.leaves) for tree in self._trees]))
+            for _ in range(rounds):
+                ids = self._descend(ids)
+        self.graph = ids
+        # Graph rows and the rows having them in theirs, followed by the radius searches
+        found = ids >= 0
+        adjacency = sparse.csr_matrix((np.ones(int(found.sum()), dtype=np.int8),
+                                       (np.repeat(np.arange(n), self.n_neighbors)[found.ravel()], ids[found])),
+                                      shape=(n, n))
+        self._adjacency = sparse.csr_matrix(adjacency + adjacency.T)
+
+    def _leaf_neighbours(self, leaves):
+        # (rows, ids) candidates: the most similar rows within the same leaf
+        k = self.n_neighbors
+        order = np.argsort(leaves, kind='stable')
+        bounds = np.flatnonzero(np.diff(leaves[order])) + 1
+        candidates = np.full((len(self), k), -1, dtype=np.int64)
+        for members in np.split(order, bounds):
+            sims = self.vectors[members] @ self.vectors[members].T
+            np.fill_diagonal(sims, -np.inf)
+            top = min(k, len(members) - 1)
+            if top <= 0:
+                continue
+            part = np.argpartition(-sims, top - 1, axis=1)[:, :top]
+            candidates[members, :top] = members[part]
+        return candidates
+
+    def _merge(self, ids, candidates):
+        # The best n_neighbors of the current graph rows and the candidate ids of every row
+        for start in range(0, len(self), GRAPH_BLOCK_ROWS):
+            block = slice(start, start + GRAPH_BLOCK_ROWS)
+            rows = np.arange(start, min(start + GRAPH_BLOCK_ROWS, len(self)))
+            new_ids = np.where(candidates[block] == rows[:, None], -1, candidates[block])
+            ids[block] = _top_columns(self.vectors, self.vectors[block], np.hstack([ids[block], new_ids]),
+                                      self.n_neighbors)[0]
+        return ids
+
+    def _descend(self, ids):
+        # One NN-descent round: every row is compared with the neighbours of its nearer half
+        # of neighbours and with the rows that have it as a neighbour (up to n_neighbors of them)
+        n, k = ids.shape
+        rows = np.repeat(np.arange(n), k)
+        targets = ids.ravel()
+        found = targets >= 0
+        rows, targets = rows[found], targets[found]
+        order = np.argsort(targets, kind='stable')
+        rows, targets = rows[order], targets[order]
+        rank = np.arange(len(targets)) - np.searchsorted(targets, targets)
+        keep = rank < k
+        reverse = np.full((n, k), -1, dtype=np.int64)
+        reverse[targets[keep], rank[keep]] = rows[keep]
+
+        near = ids[:, :(k + 1) // 2]
+        candidates = np.hstack([reverse, np.where(near[:, :, None] >= 0, ids[np.maximum(near, 0)], -1).reshape(n, -1)])
+        return self._merge(ids, candidates)
+
+    def _search(self, queries):
+        # Indexed rows (ids) of the search_width best rows found for every query row
+        width = min(self.search_width, len(self))
+        entries = np.hstack([tree.members(tree.route(queries)) for tree in self._trees[:self.search_trees]])
+        ids = _top_columns(self.vectors, queries, entries, width)[0]
+        while True:
+            frontier = np.where(ids[:, :, None] >= 0, self.graph[np.maximum(ids, 0)], -1).reshape(len(queries), -1)
+            new_ids = _top_columns(self.vectors, queries, np.hstack([ids, frontier]), width)[0]
+            if np.array_equal(new_ids, ids):
+                return ids
+            ids = new_ids
+
+    def _prepare(self, queries):
+        if queries is not None and sparse.issparse(queries):
+            queries = queries.toarray()
+        return super()._prepare(queries)
+
+    def _query_sims(self, queries, rows, cols):
+        # Exact similarities of the pairs (queries[rows[i]], indexed row cols[i])
+        return np.einsum('ij,ij->i', queries[rows], self.vectors[cols])
+
+    def _candidates(self, queries):
+        n = len(self)
+        own_rows = queries is self.vectors
+        for start in range(0, queries.shape[0], GRAPH_BLOCK_ROWS):
+            block = queries[start:start + GRAPH_BLOCK_ROWS]
+            if own_rows:
+                ids = np.hstack([np.arange(start, start + block.shape[0])[:, None], self.graph[start:start + block.shape[0]]])
+            else:
+                ids = self._search(block)
+            query_rows, slots = np.nonzero(ids >= 0)
+            cols = ids[query_rows, slots]
+            if own_rows:
+                sims = _rowwise_dot(self.vectors, query_rows + start, cols)
+            else:
+                sims = self._query_sims(block, query_rows, cols)
+            yield start, sparse.csr_matrix((sims, (query_rows, cols)), shape=(block.shape[0], n))
+
+    def _within_radius(self, score, rows, cols, threshold):
+        """
+        (rows, cols, similarities) of the pairs of query rows and indexed rows with a
+        similarity of at least `threshold`, found from the candidate pairs (rows, cols) by
+        following the graph from every match of a query to its graph neighbours.
+        `score(rows, cols)` gives the exact similarities of pairs.
+        """
+        n = len(self)
+        keys = seen = np.unique(rows * n + cols)
+        found_rows, found_cols, found_sims = [], [], []
+        while len(keys):
+            rows, cols = keys // n, keys % n
+            sims = score(rows, cols)
+            match = sims >= threshold
+            rows, cols = rows[match], cols[match]
+            found_rows.append(rows)
+            found_cols.append(cols)
+            found_sims.append(sims[match])
+
+            starts, ends = self._adjacency.indptr[cols], self._adjacency.indptr[cols + 1]
+            counts = ends - starts
+            positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+            keys = np.unique(np.repeat(rows, counts) * n + self._adjacency.indices[positions])
+            keys = keys[~np.isin(keys, seen, assume_unique=True)]
+            seen = np.union1d(seen, keys)
+        return np.concatenate(found_rows), np.concatenate(found_cols), np.concatenate(found_sims)
+
+    def radius_neighbors(self, queries=None, radius=0.3):
+        if queries is None:
+            graph = self.radius_graph(radius)
+            return [(graph.indices[graph.indptr[i]:graph.indptr[i + 1]].astype(np.int64),
+                     1.0 - graph.data[graph.indptr[i]:graph.indptr[i + 1]]) for i in range(len(self))]
+        queries = self._prepare(queries)
+        result = []
+        for start in range(0, queries.shape[0], GRAPH_BLOCK_ROWS):
+            block = queries[start:start + GRAPH_BLOCK_ROWS]
+            ids = self._search(block)
+            query_rows, slots = np.nonzero(ids >= 0)
+            rows, cols, sims = self._within_radius(lambda r, c: self._query_sims(block, r, c),
+                                                   query_rows, ids[query_rows, slots], 1.0 - radius)
+            order = np.lexsort((cols, rows))
+            bounds = np.searchsorted(rows[order], np.arange(block.shape[0] + 1))
+            result.extend((cols[order][bounds[i]:bounds[i + 1]], sims[order][bounds[i]:bounds[i + 1]])
+                          for i in range(block.shape[0]))
+        return result
+
+    def radius_graph(self, radius=0.3):
+        # Every row starts from itself and its graph row; pairs are kept in both directions
+        n = len(self)
+        start_rows = np.repeat(np.arange(n), self.n_neighbors + 1)
+        start_cols = np.hstack([np.arange(n)[:, None], self.graph]).ravel()
+        valid = start_cols >= 0
+        rows, cols, sims = self._within_radius(lambda r, c: _rowwise_dot(self.vectors, r, c),
+                                               start_rows[valid], start_cols[valid], 1.0 - radius)
+        return _distance_graph(n, np.concatenate([rows, cols]), np.concatenate([cols, rows]),
+                               np.concatenate([sims, sims]))
+
+
+BACKENDS = {
+    ExactIndex.name: ExactIndex,
+    GraphIndex.name: GraphIndex,
+}
+
+# Backend used by clustering and the similar-products API
+DEFAULT_BACKEND = "exact"
+
+
+def build_index(vectors, backend=DEFAULT_BACKEND, **options):
+    """Builds a neighbour index over the rows of `vectors` with one of BACKENDS."""
+    try:
+        index_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown neighbour index backend '{backend}', expected one of {sorted(BACKENDS)}")
+    return index_class(vectors, **options)
+
+
+def recall_at_k(index, baseline, k=10, sample=1000, seed=0):
+    """
+    Share of the exact top-k neighbours (from `baseline`) that `index` also returns, over a
+    random sample of the indexed rows used as queries (each row itself left out). Rows tied
+    with the k-th exact neighbour count as found (product texts are often identical).
+    """
+    rng = np.random.default_rng(seed)
+    n = len(baseline)
+    rows = np.sort(rng.choice(n, size=min(sample, n), replace=False))
+    queries = baseline.vectors[rows]
+    expected, expected_sims = baseline.kneighbors(queries, k + 1)
+    found, found_sims = index.kneighbors(queries, k + 1)
+
+    hits = total = 0
+    for row, exact_row, exact_sims, found_row, found_sims in zip(rows, expected, expected_sims, found, found_sims):
+        keep = (exact_row >= 0) & (exact_row != row)
+        exact_sims = exact_sims[keep][:k]
+        keep = (found_row >= 0) & (found_row != row)
+        found_sims = found_sims[keep][:k]
+        if len(exact_sims):
+            # A found row at least as similar as the k-th exact one is a hit (ties: any of them will do)
+            hits += min(len(exact_sims), int(np.sum(found_sims >= exact_sims[-1] - SIMILARITY_TOLERANCE)))
+        total += len(exact_sims)
+    return hits / total if total else 1.0
+
+
+def _pairs(graph):
+    # Stored entries, not nonzero(): identical texts are stored with distance 0
+    graph = graph.tocoo()
+    return set(zip(graph.row.tolist(), graph.col.tolist()))
+
+
+def benchmark(vectors, k=10, sample=1000, radius=0.3, backends=None):
+    """
+    Build time, top-k query time (for `sample` queries at once and for one) and recall@k
+    against the exact backend for every backend, plus the time and recall of the
+    eps-neighbourhood graph (the pairs DBSCAN sees) at `radius` (skipped when None). The
+    graph backend needs dense (SVD-reduced) vectors.
+    """
+    baseline = build_index(vectors, "exact")
+    exact_pairs = _pairs(baseline.radius_graph(radius)) if radius is not None else None
+
+    results = []
+    for backend in backends or sorted(BACKENDS):
+        start = time.perf_counter()
+        index = build_index(vectors, backend)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        recall = recall_at_k(index, baseline, k, sample)
+        query_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for row in range(min(sample, 100)):
+            index.kneighbors(vectors[row:row + 1], k + 1)
+        single_query_seconds = (time.perf_counter() - start) / min(sample, 100)
+
+        result = {
+            "backend": backend,
+            "build_seconds": build_seconds,
+            "query_seconds": query_seconds,
+            "single_query_ms": single_query_seconds * 1000,
+            f"recall_at_{k}": recall,
+        }
+        if exact_pairs is not None:
+            start = time.perf_counter()
+            found_pairs = _pairs(index.radius_graph(radius))
+            result["radius_graph_seconds"] = time.perf_counter() - start
+            result["radius_graph_recall"] = len(found_pairs & exact_pairs) / max(len(exact_pairs), 1)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    # Recall / speed of every backend against the exact baseline, on the SVD-reduced rows of
+    # the latest stored clustering state (its own, or projected to n_components dimensions):
+    # python neighbors.py [k] [sample] [n_components]
+    import sys
+
+    from artifact_store import ArtifactStore
+    from clustering import reduce_dimensions
+
+    state = ArtifactStore().load()
+    if state is None:
+        sys.exit("No clustering artifacts stored yet, run a re-clustering first")
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    if len(sys.argv) > 3 or state.reduced is None:
+        vectors = reduce_dimensions(state.vectors, int(sys.argv[3]) if len(sys.argv) > 3 else 100)[1]
+    else:
+        vectors = state.reduced
+
+    print(f"{len(state)} products, {vectors.shape[1]} dimensions, k={k}, {sample} sampled queries, eps={state.eps}")
+    for result in benchmark(vectors, k, sample, state.eps):
+        print(", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                        for key, value in result.items()))
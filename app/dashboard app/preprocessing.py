@@ -1,13 +1,20 @@
 import pandas as pd
 import numpy as np
+import os
 import unicodedata
 import re
 import string
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import nltk
 from nltk.stem import PorterStemmer
 from nltk.tokenize import word_tokenize
 from gensim.parsing.preprocessing import remove_stopwords
 
+from token_cache import TokenCache, load_caches, save_caches
+
 # Ensure NLTK resources are available (needed for word_tokenize and PorterStemmer)
 try:
     nltk.data.find('tokenizers/punkt')
@@ -18,6 +25,19 @@ except:
     pass # Handle other potential import errors silently
 
 
+# Inputs with at least this many rows to clean (after the cache) are sharded over a process pool
+PARALLEL_MIN_ROWS = 20000
+PARALLEL_WORKERS = None # None = os.cpu_count()
+PARALLEL_SHARD_SIZE = 2000
+
+# Cleaned texts kept in memory, keyed on the hash of the concatenated raw text columns
+CACHE_MAX_ENTRIES = 500000
+
+# Per-token memos of the stemmer and of the dedupe comparison key (bounded LRU)
+TOKEN_CACHE_MAX_ENTRIES = 200000
+TOKEN_CACHE_FILE = "token_caches.json"
+
+
 # --- 1. Helper Functions ---
 
 # Small list of common Dutch conjunctions/prepositions/articles to remove (from your original code)
@@ -26,29 +46,97 @@ _dutch_stopwords = {
     "naar", "om", "te", "de", "het", "een", "als", "maar", "of",
     "ook", "dan", "tot", "over"
 }
-_stopwords_pattern = re.compile(r"\b(?:" + "|".join(re.escape(w) for w in _dutch_stopwords) + r")\b", flags=re.IGNORECASE)
+# The lookahead on the possible first letters lets the regex skip most positions without
+# trying every alternative (same matches, about twice as fast)
+_stopwords_pattern = re.compile(
+    r"\b(?=[" + "".join(sorted({w[0] for w in _dutch_stopwords})) + r"])"
+    r"(?:" + "|".join(re.escape(w) for w in _dutch_stopwords) + r")\b",
+    flags=re.IGNORECASE
+)
+
+# Patterns of the cleaning steps, compiled once (shared by the per-row and the vectorized path)
+_numbers_pattern = re.compile(r'[,\d]+')
+_whitespace_pattern = re.compile(r'\s+')
+_specific_chars_pattern = re.compile(r"[()=&%+\;/.\u00B0-]+")
+_dutch_possessive_pattern = re.compile(r"(?:'n|’n)\b")
+_apostrophe_pattern = re.compile(r"['’]\b")
+_non_alphanumeric_pattern = re.compile(r'[^a-z0-9]+')
 
 # Initializing stemmer once for efficiency
 _porter_stemmer = PorterStemmer()
 
+_stem_cache = TokenCache(TOKEN_CACHE_MAX_ENTRIES)
+_dedupe_key_cache = TokenCache(TOKEN_CACHE_MAX_ENTRIES)
+_token_caches = {"stem": _stem_cache, "dedupe_key": _dedupe_key_cache}
+
+def load_token_caches(directory: str) -> bool:
+    """Loads the stem / dedupe-key caches saved by save_token_caches in `directory`."""
+    return load_caches(os.path.join(directory, TOKEN_CACHE_FILE), _token_caches)
+
+def save_token_caches(directory: str):
+    """Saves the stem / dedupe-key caches of this process to `directory`."""
+    save_caches(os.path.join(directory, TOKEN_CACHE_FILE), _token_caches)
+
+def token_cache_stats() -> dict:
+    """Size and hit/miss counters of the token caches (including the lookups of the pool workers)."""
+    return {name: cache.stats() for name, cache in _token_caches.items()}
+
 def _remove_specific_chars_keep_spaces(s: str) -> str:
     """Removes specific punctuation/symbols and collapses whitespace."""
     if not isinstance(s, str):
         return s
     # 1. Replace listed characters with a single space
-    s = re.sub(r"[()=&%+\;/.\u00B0-]+", " ", s)
+    s = _specific_chars_pattern.sub(" ", s)
     # 2. Remove English/apostrophe possessive forms and typographic variants
     s = s.replace("'s", " ").replace("’s", " ")
     # 3. Remove possessive forms from Dutch words (e.g., 'n)
-    s = re.sub(r"(?:'n|’n)\b", " ", s)
+    s = _dutch_possessive_pattern.sub(" ", s)
     # 4. Also remove isolated trailing apostrophe if any
-    s = re.sub(r"['’]\b", " ", s)
+    s = _apostrophe_pattern.sub(" ", s)
     # 5. Remove common Dutch stopwords (as whole words)
     s = _stopwords_pattern.sub(" ", s)
     # 6. Collapse whitespace and strip
-    s = re.sub(r'\s+', ' ', s).strip()
+    s = _whitespace_pattern.sub(' ', s).strip()
     return s
 
+def _remove_specific_chars_series(series: pd.Series) -> pd.Series:
+    """
+    Vectorized _remove_specific_chars_keep_spaces over a Series of strings (same steps and result).
+
+    The rows are joined with newlines and every step runs once over the whole text, instead of
+    once per row. The rows have no newlines left after step 2, and a newline is a word boundary
+    like the start/end of a row, so no pattern matches across rows.
+    """
+    texts = series.tolist()
+    if not texts:
+        return series.copy()
+    text = "\n".join(texts)
+    if text.count("\n") != len(texts) - 1:
+        # Newlines inside the rows: fall back to the per-row path
+        return series.apply(_remove_specific_chars_keep_spaces)
+
+    text = _specific_chars_pattern.sub(" ", text)
+    text = text.replace("'s", " ").replace("’s", " ")
+    text = _dutch_possessive_pattern.sub(" ", text)
+    text = _apostrophe_pattern.sub(" ", text)
+    text = _stopwords_pattern.sub(" ", text)
+    # str.split() splits on the same characters as \s, so this is the per-row collapse + strip
+    rows = [" ".join(row.split()) for row in text.split("\n")]
+    return pd.Series(rows, index=series.index, dtype=series.dtype)
+
+def _dedupe_key(t: str) -> str:
+    """Comparison key of a token for _dedupe_words."""
+    # Normalize to ASCII (remove accents), lowercase, and strip non-alphanumerics for comparison key
+    key = unicodedata.normalize('NFKD', t)
+    key = key.encode('ascii', 'ignore').decode('ascii')
+    key = key.lower()
+    key = _non_alphanumeric_pattern.sub('', key)
+    
+    # Fallback if normalization removed everything (should be rare after initial cleaning)
+    if not key:
+        key = t.lower()
+    return key
+
 def _dedupe_words(text: str) -> str:
     """Removes duplicate words within a cell based on normalized key, preserving first occurrence order."""
     if not isinstance(text, str):
@@ -59,16 +147,7 @@ def _dedupe_words(text: str) -> str:
     out = []
     
     for t in tokens:
-        # Normalize to ASCII (remove accents), lowercase, and strip non-alphanumerics for comparison key
-        key = unicodedata.normalize('NFKD', t)
-        key = key.encode('ascii', 'ignore').decode('ascii')
-        key = key.lower()
-        key = re.sub(r'[^a-z0-9]+', '', key)
-        
-        # Fallback if normalization removed everything (should be rare after initial cleaning)
-        if not key:
-            key = t.lower()
-            
+        key = _dedupe_key_cache.get(t, _dedupe_key)
         if key not in seen:
             seen.add(key)
             out.append(t)
@@ -81,7 +160,7 @@ def _stem_sentence(sentence: str) -> str:
         return ''
     # Use NLTK word_tokenize and the pre-initialized stemmer
     token_words = word_tokenize(sentence)
-    stem_sentence = [_porter_stemmer.stem(word) for word in token_words]
+    stem_sentence = [_stem_cache.get(word, _porter_stemmer.stem) for word in token_words]
     return ' '.join(stem_sentence)
 
 def _remove_one_letter_words(text: str) -> str:
@@ -93,9 +172,73 @@ def _remove_one_letter_words(text: str) -> str:
     return ' '.join(tokens)
 
 
-# --- 2. Main Refactored Function ---
+def _normalize_series(series: pd.Series) -> pd.Series:
+    """Step 2: lowercase, remove numbers/commas (rest of concat_text_2)."""
+    return (
+        series
+        .str.lower()
+        .str.replace(_numbers_pattern, '', regex=True)     # remove commas and all numeric characters
+        .str.replace(_whitespace_pattern, ' ', regex=True) # collapse multiple spaces
+        .str.strip()
+    )
+
+def _finish_text(text: str) -> str:
+    """Steps 3b to 6 for one row whose specific chars/stopwords are already removed."""
+    text = _dedupe_words(text)
+    text = _stem_sentence(text)
+    text = _dedupe_words(text)
+    text = _remove_one_letter_words(text)
+    return _dedupe_words(text)
+
+def _clean_text(text: str) -> str:
+    """Steps 3 to 6 for one (lowercased) row, in the same order as the original separate passes."""
+    return _finish_text(_remove_specific_chars_keep_spaces(text))
+
+def _clean_texts(texts: list) -> list:
+    return [_clean_text(t) for t in texts]
+
+def _finish_texts(texts: list) -> list:
+    return [_finish_text(t) for t in texts]
+
+
+# --- 2. Row cache and process pool ---
+
+_cleaned_cache = {}
+_cleaned_cache_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+def _init_worker():
+    for cache in _token_caches.values():
+        cache.record_new()
+
+def _clean_shard(clean_rows, texts):
+    # In a pool worker: the cleaned rows, and the token cache entries/counters to merge in the parent
+    return clean_rows(texts), {name: cache.take_new() for name, cache in _token_caches.items()}
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS, initializer=_init_worker)
+        return _pool
+
+def clear_cleaned_text_cache():
+    """Forgets all cached cleaned texts (e.g. after the cleaning rules changed)."""
+    with _cleaned_cache_lock:
+        _cleaned_cache.clear()
 
-def create_cleaned_text_feature(df: pd.DataFrame, text_cols: list) -> pd.DataFrame:
+def _cache_put(keys, values):
+    with _cleaned_cache_lock:
+        _cleaned_cache.update(zip(keys, values))
+        # Dicts keep insertion order: drop the oldest entries first
+        while len(_cleaned_cache) > CACHE_MAX_ENTRIES:
+            del _cleaned_cache[next(iter(_cleaned_cache))]
+
+
+# --- 3. Main Refactored Function ---
+
+def create_cleaned_text_feature(df: pd.DataFrame, text_cols: list, vectorized: bool = True) -> pd.DataFrame:
     """
     Combines all text preprocessing steps from the original pipeline into one function,
     adds the result to a new 'to_vectorize' column, and returns the updated DataFrame.
@@ -108,9 +251,17 @@ def create_cleaned_text_feature(df: pd.DataFrame, text_cols: list) -> pd.DataFra
     5. Stemming words.
     6. Removing one-letter words.
 
+    The regex cleaning of step 3 runs over the whole Series with compiled patterns
+    (_remove_specific_chars_series); the remaining steps run in one pass per row
+    (_finish_text). Results are cached per row on a hash of the concatenated text columns,
+    so unchanged products are not cleaned again, and at least PARALLEL_MIN_ROWS uncached
+    rows are sharded over a process pool.
+
     Args:
         df: The input DataFrame containing the raw product data.
         text_cols: List of column names to concatenate and process.
+        vectorized: False runs step 3 per row as well (_clean_text), to validate the
+            vectorized path against it.
 
     Returns:
         The input DataFrame with a new column 'to_vectorize' containing the 
@@ -120,53 +271,113 @@ def create_cleaned_text_feature(df: pd.DataFrame, text_cols: list) -> pd.DataFra
     # Create a copy of the input DataFrame to ensure functional programming principles 
     # and avoid SettingWithCopyWarning if the input df is a view.
     df_out = df.copy()
+    if df_out.empty:
+        df_out['to_vectorize'] = pd.Series(dtype=object)
+        return df_out
     
-    # --- Step 1 & 2: Initial Concatenation, Cleanup, Lowercasing, and removing numbers ---
+    # --- Step 1: Concatenation ---
     
     # Concat and basic cleanup (equivalent to concat_text and first part of concat_text_2)
     # .fillna('') must come first to allow .astype(str) to work uniformly
-    text_series = (
+    raw_series = (
         df_out[text_cols]
         .fillna('')                 # replace NaN with empty string
         .astype(str)                # ensure all values are strings
         .agg(' '.join, axis=1)      # join columns with spaces
     )
-    
-    # Lowercase, remove numbers/commas (rest of concat_text_2)
-    text_series = (
-        text_series
-        .str.lower()
-        .str.replace(r'[,\d]+', '', regex=True)  # remove commas and all numeric characters
-        .str.replace(r'\s+', ' ', regex=True)    # collapse multiple spaces
-        .str.strip()
-    )
-    
-    # --- Step 3 & 4: Deduplicate and Remove specific chars/stopwords ---
-    
-    # 3a. Remove specific chars and Dutch stopwords (remove_specific_chars_keep_spaces logic)
-    text_series = text_series.apply(_remove_specific_chars_keep_spaces)
-    
-    # 3b. Apply deduplication (first dedupe, original concat_text_3)
-    text_series = text_series.apply(_dedupe_words)
 
-    # --- Step 5: Stemming ---
-    
-    # Apply stemming (stemSentence logic, originally concat_text_5)
-    text_series = text_series.apply(_stem_sentence)
-    
-    # Apply deduplication again after stemming (second dedupe, original concat_text_5 end)
-    text_series = text_series.apply(_dedupe_words)
-    
-    # --- Step 6: Final cleanup (Remove one-letter words) ---
-    
-    # Remove one-letter words (concat_text_7)
-    text_series = text_series.apply(_remove_one_letter_words)
+    # Look up the rows cleaned before; only the distinct unseen texts go through the pipeline
+    keys = pd.util.hash_pandas_object(raw_series, index=False).to_numpy()
+    with _cleaned_cache_lock:
+        cleaned = [_cleaned_cache.get(key) for key in keys]
+    missing = {}
+    for position, (key, value) in enumerate(zip(keys, cleaned)):
+        if value is None and key not in missing:
+            missing[key] = position
+
+    if missing:
+        # --- Step 2: Lowercase, remove numbers/commas ---
+        text_series = _normalize_series(raw_series.iloc[list(missing.values())])
 
-    # Final deduplication (concat_text_7 end)
-    text_series = text_series.apply(_dedupe_words)
+        # --- Step 3a: Remove specific chars and Dutch stopwords, over the whole Series ---
+        if vectorized:
+            text_series = _remove_specific_chars_series(text_series)
+            clean_rows = _finish_texts
+        else:
+            clean_rows = _clean_texts
+        texts = text_series.tolist()
+
+        # --- Steps 3b to 6: one fused pass per row ---
+        if len(texts) >= PARALLEL_MIN_ROWS:
+            shards = [texts[i:i + PARALLEL_SHARD_SIZE] for i in range(0, len(texts), PARALLEL_SHARD_SIZE)]
+            results = []
+            for shard, taken in _get_pool().map(_clean_shard, repeat(clean_rows), shards):
+                results.extend(shard)
+                # The stems computed in the workers are kept (and saved) by this process
+                for name, cache in _token_caches.items():
+                    cache.merge(taken[name])
+        else:
+            results = clean_rows(texts)
+
+        _cache_put(missing.keys(), results)
+        new_values = dict(zip(missing.keys(), results))
+        cleaned = [new_values[key] if value is None else value for key, value in zip(keys, cleaned)]
     
     # Assign the resulting series to the new column 'to_vectorize'
-    df_out['to_vectorize'] = text_series
+    df_out['to_vectorize'] = pd.Series(cleaned, index=df_out.index, dtype=raw_series.dtype)
     
     # Return the updated DataFrame
-    return df_out
\ No newline at end of file
+    return df_out
+
+
+# --- 4. Benchmark ---
+
+def synthetic_catalogue(n_rows: int = 1000000, seed: int = 0) -> pd.DataFrame:
+    """Random product names/brands/categories with the symbols, numbers, possessives and stopwords the cleaning removes."""
+    rng = np.random.default_rng(seed)
+    words = np.array([
+        "melk", "kaas", "volle", "halfvolle", "yoghurt", "koekjes", "chocolade", "appel", "sap",
+        "brood", "boter", "pindakaas", "café", "crème", "brûlée", "bio", "light", "original",
+        "Kellogg's", "Mama's", "zo'n", "A&B", "(bio)", "100%", "1,5L", "500g", "g", "l", "x",
+        "met", "van", "en", "de", "het", "voor", "koek-jes", "sap/nectar", "25°", "+", "=",
+    ], dtype=object)
+
+    def column(min_words, max_words):
+        lengths = rng.integers(min_words, max_words + 1, size=n_rows)
+        tokens = words[rng.integers(0, len(words), size=int(lengths.sum()))]
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        return [" ".join(tokens[bounds[i]:bounds[i + 1]]) for i in range(n_rows)]
+
+    return pd.DataFrame({"name": column(1, 6), "brands": column(0, 2), "categories": column(1, 4)})
+
+def benchmark_cleaning(n_rows: int = 1000000, seed: int = 0) -> dict:
+    """
+    Times the regex cleaning stage (steps 2 and 3a) per row (Series.apply) and vectorized
+    (compiled patterns with .str ops) on a synthetic catalogue, and checks both give the same text.
+    """
+    df = synthetic_catalogue(n_rows, seed)
+    text_series = _normalize_series(df.fillna('').astype(str).agg(' '.join, axis=1))
+
+    start = time.perf_counter()
+    per_row = text_series.apply(_remove_specific_chars_keep_spaces)
+    per_row_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = _remove_specific_chars_series(text_series)
+    vectorized_seconds = time.perf_counter() - start
+
+    return {
+        "rows": n_rows,
+        "per_row_seconds": per_row_seconds,
+        "vectorized_seconds": vectorized_seconds,
+        "identical": per_row.tolist() == vectorized.tolist(),
+    }
+
+
+if __name__ == "__main__":
+    # python preprocessing.py [rows]
+    import sys
+
+    result = benchmark_cleaning(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
+    print(", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in result.items()))
@@ -0,0 +1,490 @@
+import asyncio
+import hashlib
+
+import pandas as pd
+
+from search_index import SearchIndex
+from sort_index import SortIndex
+from services import get_all_newly_added_products, get_incompleted_products_page, get_product_changes, get_products_info
+
+# Columns the incomplete-product tables need (shown columns, sort/search columns and the tab split)
+TABLE_FIELDS = ['id', 'name', 'name_search', 'energy', 'protein', 'unit', 'synonyms', 'brands', 'brands_search',
+                'categories', 'barcode', 'link_to', 'scan_count', 'active', 'cluster_id', 'cluster_count',
+                'missing_field_count']
+# Rows fetched per page of an incomplete tab (the next page is loaded when the table is scrolled to its end)
+TABLE_PAGE_SIZE = 200
+# Server-side filters splitting the incomplete products over the two tabs
+WITH_ALIKE_FILTERS = {"min_cluster_count": 2}
+WITHOUT_ALIKE_FILTERS = {"cluster_count": 1}
+# Columns requested from the change feed: the table columns plus what decides which tab a product belongs to
+CHANGE_FIELDS = TABLE_FIELDS + ['is_incomplete', 'newly_added']
+# Seconds one change-feed request waits for a change before asking again
+CHANGE_FEED_WAIT = 25
+# Seconds a refresh request waits for others to join it: all requests of this window are served by one reload
+REFRESH_DEBOUNCE = 0.25
+
+# Columns a keyword search looks in: those of the API's keyword= filter (product_query.KEYWORD_COLUMNS),
+# so searching the loaded rows finds what the API would
+SEARCH_COLUMNS = ['name', 'name_search', 'brands', 'brands_search', 'categories', 'synonyms', 'barcode']
+
+# Listings of the snapshot and the filters of their pages (None: loaded at once, not paged)
+LISTINGS = {"with_alike": WITH_ALIKE_FILTERS, "without_alike": WITHOUT_ALIKE_FILTERS, "newly_added": None}
+# Parts of the snapshot that are versioned (and published) separately
+PARTS = list(LISTINGS) + ["stats"]
+
+
+def _incomplete(df):
+    return (df['active'] == 0) & (df['is_incomplete'] == True)
+
+
+# Which rows of the change feed belong to a listing
+_BELONGS = {
+    "with_alike": lambda df: _incomplete(df) & (df['cluster_count'].fillna(1) >= 2),
+    "without_alike": lambda df: _incomplete(df) & (df['cluster_count'].fillna(1) == 1),
+    "newly_added": lambda df: (df['active'] == 0) & (df['newly_added'] == 1),
+}
+
+
+def _is_error(result):
+    return isinstance(result, dict) and "error" in result
+
+
+def _listing_rows(name, rows, listed, full_rows=None):
+    """
+    The change-feed `rows` entering listing `name`, with the columns of the listing. The feed
+    only has CHANGE_FIELDS: the paged listings hold TABLE_FIELDS (all in the feed), while a
+    product of the newly added listing (all columns) keeps its other columns when it is
+    already `listed`, and otherwise takes its row from `full_rows` (fetched whole). A product
+    in neither is left out.
+    """
+    if LISTINGS[name] is not None:
+        return rows[[column for column in TABLE_FIELDS if column in rows.columns]]
+
+    listed = listed if 'id' in listed.columns else pd.DataFrame(columns=['id'])
+    kept = listed[listed['id'].isin(rows['id'])].set_index('id')
+    overlap = [column for column in kept.columns if column in rows.columns]
+    kept = kept.drop(columns=overlap).join(rows.set_index('id')[overlap]).reset_index()
+
+    entering = pd.DataFrame()
+    if full_rows is not None and not full_rows.empty:
+        entering = full_rows[full_rows['id'].isin(rows['id']) & ~full_rows['id'].isin(kept['id'])]
+    columns = list(listed.columns) if not listed.empty else list(entering.columns)
+    parts = [part.reindex(columns=columns) for part in (kept, entering) if not part.empty]
+    return pd.concat(parts, ignore_index=True) if parts else rows.iloc[:0].reindex(columns=columns)
+
+
+def fetch_listing_page(name, cursor=None, keyword="", sort=None):
+    """
+    One page of an incomplete listing as (DataFrame, next cursor), or the error: the first
+    page or the one after `cursor`, searched (`keyword`) and sorted (`sort`: (column,
+    'asc'/'desc')) by the API when given, in the default order (most scanned first) otherwise.
+    """
+    query = {}
+    if keyword:
+        query['keyword'] = keyword
+    if sort is not None:
+        query['sort'], query['direction'] = sort
+    page = get_incompleted_products_page(cursor=cursor, limit=TABLE_PAGE_SIZE, fields=TABLE_FIELDS,
+                                         **LISTINGS[name], **query)
+    if _is_error(page):
+        return page
+
+    df_page, new_cursor = page
+
+    # Ensure cluster_id is numeric
+    if 'cluster_id' in df_page.columns:
+        df_page['cluster_id'] = pd.to_numeric(df_page['cluster_id'], errors='coerce').fillna(-1).astype(int)
+    return df_page, new_cursor
+
+
+def _content_hash(df):
+    # Hash of the columns and values of a frame in row order (the index is ignored)
+    try:
+        rows = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:
+        # Unhashable cells (lists, dicts): hash their text instead
+        rows = pd.util.hash_pandas_object(df.astype(str), index=False)
+    digest = hashlib.sha1(rows.to_numpy().tobytes())
+    digest.update("\x00".join(map(str, df.columns)).encode())
+    return digest.hexdigest()
+
+
+class ProductSnapshot:
+    """
+    Process-wide snapshot of the product listings (the two incomplete tabs, the newly added
+    products and the stats), shared by all dashboard sessions.
+
+    One background task follows the change feed for the whole process and applies its
+    deltas; sessions subscribe() with a callback that gets the parts (PARTS) that changed
+    and read the listings with frame(). A frame is never changed in place: every change
+    builds a new DataFrame and swaps it in (copy-on-write), so a session can keep using the
+    frame it read while the snapshot moves on, and all sessions share one copy of the data.
+    Treat the frames as read-only. A new frame with the same content as the current one is
+    dropped, so only the parts whose content changed get a new version and are published.
+
+    Full reloads are asked with request_refresh(), which coalesces the requests of all
+    sessions within REFRESH_DEBOUNCE into one reload fetching its datasets concurrently.
+
+    Runs on the event loop of the app (the methods are called from sessions' reactive code).
+    """
+
+    def __init__(self):
+        self.versions = {part: 0 for part in PARTS}
+        self._frames = {name: pd.DataFrame() for name in LISTINGS}
+        self._hashes = {name: None for name in LISTINGS}
+        self._cursors = {name: None for name in LISTINGS}   # keyset cursor of the next page, None when all loaded
+        self._indexes = {name: SearchIndex(columns=SEARCH_COLUMNS) for name in LISTINGS}
+        self._index_versions = {name: None for name in LISTINGS}
+        self._sort_indexes = {name: SortIndex() for name in LISTINGS}
+        self._stats = {}
+        self._loaded = False
+        self._subscribers = {}
+        self._next_token = 0
+        self._follow_task = None
+        self._notify_tasks = set()
+        self._pending_refresh = None     # refresh task still taking requests
+        self._refresh_stats = None
+        self._refresh_lock = asyncio.Lock()
+        self._loading_more = {}          # listing -> task fetching its next page
+        self._since = None               # change-feed position the frames are current with
+        self._positioned = asyncio.Event()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def frame(self, name):
+        return self._frames[name]
+
+    def has_more(self, name):
+        return self._cursors[name] is not None
+
+    def search_index(self, name):
+        """The search index of a listing, synced with its current frame (once per version, for all sessions)."""
+        if self._index_versions[name] != self.versions[name]:
+            self._indexes[name].sync(self._frames[name])
+            self._index_versions[name] = self.versions[name]
+        return self._indexes[name]
+
+    def sort_positions(self, name, df, column, ascending=True, rows=None):
+        """
+        Row positions of df, a frame of listing `name`, sorted on `column` (see SortIndex.positions).
+        The orders are cached per version of the listing and shared by all sessions; a frame
+        that is no longer the listing's current one is sorted without caching.
+        """
+        version = self.versions[name] if df is self._frames[name] else None
+        return self._sort_indexes[name].positions(df, column, ascending, rows, version)
+
+    # --- Subscriptions ---
+
+    def subscribe(self, callback):
+        """
+        Calls `await callback(changed)` with the set of the parts that changed after every
+        change of the snapshot (their new versions are in `versions`). Returns the function
+        that unsubscribes (e.g. for session.on_ended); the change feed is only followed
+        while there are subscribers.
+        """
+        token = self._next_token
+        self._next_token += 1
+        self._subscribers[token] = callback
+        if self._follow_task is None or self._follow_task.done():
+            self._follow_task = asyncio.create_task(self._follow_changes())
+
+        def unsubscribe():
+            self._subscribers.pop(token, None)
+            if not self._subscribers and self._follow_task is not None:
+                self._follow_task.cancel()
+                self._follow_task = None
+                # Nobody looks: the next session starts from a fresh load
+                self._loaded = False
+                self._since = None
+                self._positioned.clear()
+
+        return unsubscribe
+
+    def _publish(self, changed):
+        if not changed:
+            return
+        for part in changed:
+            self.versions[part] += 1
+        for callback in list(self._subscribers.values()):
+            task = asyncio.create_task(callback(set(changed)))
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+
+    def _swap(self, name, df, changed, cursor=None):
+        # Swap in a new frame (and the cursor of its next page), unless nothing changed
+        content_hash = _content_hash(df)
+        if content_hash == self._hashes[name] and cursor == self._cursors[name]:
+            return
+        self._frames[name] = df
+        self._hashes[name] = content_hash
+        self._cursors[name] = cursor
+        changed.add(name)
+
+    def _set_stats(self, stats, changed):
+        if stats != self._stats:
+            self._stats = stats
+            changed.add("stats")
+
+    # --- Loading ---
+
+    async def reload(self, stats=None):
+        """
+        Loads the first page of each incomplete listing, the newly added products and (unless
+        given) the stats again, for every session; the requests run concurrently. Returns the
+        error of a failed request, if any (the snapshot is then left as it was).
+
+        The change-feed position (and the stats) are read before the listings, so the change
+        feed is followed from there: a change committed while the listings load is applied
+        again afterwards instead of being missed (applying a change twice gives the same rows).
+        """
+        position = await asyncio.to_thread(get_product_changes)
+        if _is_error(position):
+            return position
+
+        paged = [name for name, filters in LISTINGS.items() if filters is not None]
+        requests = [asyncio.to_thread(fetch_listing_page, name) for name in paged]
+        requests.append(asyncio.to_thread(get_all_newly_added_products))
+        results = await asyncio.gather(*requests)
+
+        for result in results[:len(paged)]:
+            if _is_error(result):
+                return result
+
+        changed = set()
+        for name, (df_page, cursor) in zip(paged, results):
+            self._swap(name, df_page, changed, cursor)
+        self._swap("newly_added", pd.json_normalize(results[len(paged)]), changed)
+        self._set_stats(stats if stats is not None else position["stats"], changed)
+        self._loaded = True
+        self._since = position["last_seq"]
+        self._positioned.set()
+        self._publish(changed)
+        return None
+
+    def request_refresh(self, stats=None):
+        """
+        Asks for a reload of the snapshot. The requests made within REFRESH_DEBOUNCE seconds
+        of the first one are served by one reload (with the newest `stats` given, if any);
+        a request made while a reload is running gets the next one. Returns the task of the
+        reload, whose result is the error of a failed request, if any.
+        """
+        if stats is not None:
+            self._refresh_stats = stats
+        if self._pending_refresh is None:
+            self._pending_refresh = asyncio.create_task(self._refresh())
+        return self._pending_refresh
+
+    async def _refresh(self):
+        await asyncio.sleep(REFRESH_DEBOUNCE)
+        # From here on, new requests schedule the next refresh
+        self._pending_refresh = None
+        stats, self._refresh_stats = self._refresh_stats, None
+        async with self._refresh_lock:
+            error = await self.reload(stats)
+        if error is not None:
+            print(f"Error refreshing the products: {error['error']}")
+        return error
+
+    async def load_more(self, name):
+        """
+        Appends the next page of an incomplete listing. The page is fetched in a thread, so
+        the event loop (and every other session) keeps running, and the sessions asking for
+        the next page of one listing at the same time share one request.
+        """
+        task = self._loading_more.get(name)
+        if task is None:
+            task = asyncio.create_task(self._load_more(name))
+            self._loading_more[name] = task
+            task.add_done_callback(lambda _: self._loading_more.pop(name, None))
+        # A session that goes away must not cancel the page the others wait for
+        return await asyncio.shield(task)
+
+    async def _load_more(self, name):
+        cursor = self._cursors[name]
+        if cursor is None:
+            return self._frames[name]
+        page = await asyncio.to_thread(fetch_listing_page, name, cursor)
+        if _is_error(page):
+            return page
+        if self._cursors[name] != cursor:
+            # Reloaded meanwhile: this page does not follow the loaded rows anymore
+            return self._frames[name]
+
+        df_page, cursor = page
+        loaded = self._frames[name]
+        if not loaded.empty:
+            df_page = pd.concat([loaded, df_page], ignore_index=True)
+
+        changed = set()
+        self._swap(name, df_page, changed, cursor)
+        self._publish(changed)
+        return df_page
+
+    # --- Change feed ---
+
+    def _apply_changes(self, name, changed, deleted_ids, full_rows=None):
+        # Replace/remove the changed products in one listing, keeping it ordered like the API
+        # (see _listing_rows for the columns of the rows put in)
+        df = listed = self._frames[name]
+        cursor = self._cursors[name]
+
+        touched = set(deleted_ids)
+        if not changed.empty:
+            touched |= set(changed['id'].tolist())
+        if df is None or df.empty or 'id' not in df.columns:
+            df = pd.DataFrame()
+        elif not df['id'].isin(touched).any() and changed.empty:
+            return df
+        else:
+            df = df[~df['id'].isin(touched)]
+
+        rows = changed[_BELONGS[name](changed)] if not changed.empty else changed
+        if cursor is not None and not rows.empty:
+            # Rows past the last loaded row will arrive with the next page instead
+            cursor_scan, cursor_id = (int(v) for v in cursor.split(":"))
+            scan = rows['scan_count'].fillna(0)
+            rows = rows[(scan > cursor_scan) | ((scan == cursor_scan) & (rows['id'] <= cursor_id))]
+
+        if not rows.empty:
+            rows = _listing_rows(name, rows, listed, full_rows)
+        if not rows.empty:
+            df = rows if df.empty else pd.concat([df, rows], ignore_index=True)
+            # Ordered like the API: COALESCE(scan_count, 0) DESC, id
+            order = df.assign(_scan=pd.to_numeric(df['scan_count'], errors='coerce').fillna(0))
+            order = order.sort_values(by=['_scan', 'id'], ascending=[False, True], kind='stable')
+            df = df.loc[order.index].reset_index(drop=True)
+            if 'cluster_id' in df.columns:
+                df['cluster_id'] = pd.to_numeric(df['cluster_id'], errors='coerce').fillna(-1).astype(int)
+        return df
+
+    def apply_feed(self, feed, full_rows=None):
+        """
+        Applies one answer of the change feed (changed rows, deleted ids, stats) to every
+        listing; `full_rows` are the whole rows of the products entering the newly added
+        listing (see entering_rows()).
+        """
+        rows = pd.json_normalize(feed.get("changed", []))
+        deleted_ids = feed.get("deleted", [])
+        changed = set()
+        for name in LISTINGS:
+            # The newly added listing is loaded whole, so it has no cursor to respect
+            df = self._apply_changes(name, rows, deleted_ids, full_rows)
+            if df is not self._frames[name]:
+                self._swap(name, df, changed, self._cursors[name])
+        self._set_stats(feed["stats"], changed)
+        self._publish(changed)
+
+    async def entering_rows(self, feed):
+        """
+        The whole rows (a DataFrame) of the products of a change-feed answer that enter the
+        newly added listing, or the error: the feed only has CHANGE_FIELDS.
+        """
+        rows = pd.json_normalize(feed.get("changed", []))
+        if rows.empty:
+            return None
+        entering = rows[_BELONGS["newly_added"](rows)]
+        listed = self._frames["newly_added"]
+        if 'id' in listed.columns:
+            entering = entering[~entering['id'].isin(listed['id'])]
+        if entering.empty:
+            return None
+        result = await asyncio.to_thread(get_products_info, entering['id'].tolist())
+        return result if _is_error(result) else pd.json_normalize(result)
+
+    async def _follow_changes(self):
+        # Long-polls /products/changes once for the whole process, from the position read
+        # by the last reload: the request only returns when something was committed (or
+        # after CHANGE_FEED_WAIT seconds)
+        while True:
+            since = self._since
+            if since is None:
+                # Not loaded yet (the first session asks for the load)
+                await self._positioned.wait()
+                continue
+            feed = await asyncio.to_thread(get_product_changes, since, CHANGE_FEED_WAIT, CHANGE_FIELDS)
+            if "error" in feed:
+                await asyncio.sleep(5)
+                continue
+            if self._since != since or feed["last_seq"] == since:
+                # Reloaded meanwhile (the frames follow another position), or nothing changed
+                continue
+
+            if feed.get("truncated"):
+                # Too many changes: the reload moves the position on
+                if await self.request_refresh(stats=feed["stats"]) is not None:
+                    await asyncio.sleep(5)
+                continue
+
+            full_rows = await self.entering_rows(feed)
+            if _is_error(full_rows):
+                await asyncio.sleep(5)
+                continue
+            if self._since == since:
+                self.apply_feed(feed, full_rows)
+                self._since = feed["last_seq"]
+
+
+class ListingQuery:
+    """
+    An incomplete listing searched and/or sorted by the API (its keyword=, sort= and
+    direction= arguments), paged like the snapshot's listings.
+
+    A session uses one while the snapshot has not loaded the whole listing: searching or
+    sorting only the loaded pages would miss (or misplace) every product that is not loaded
+    yet. Calls of load()/load_more() made while one is running share its request.
+    """
+
+    def __init__(self, name, keyword="", sort=None):
+        self.name = name
+        self.keyword = keyword
+        self.sort = sort
+        self.frame = pd.DataFrame()
+        self.cursor = None
+        self.loaded = False
+        self._task = None
+
+    @property
+    def has_more(self):
+        return self.loaded and self.cursor is not None
+
+    async def load(self):
+        """Loads the first page (once). Returns the error of a failed request, if any."""
+        if self.loaded:
+            return None
+        return await self._run()
+
+    async def load_more(self):
+        """Appends the next page. Returns the error of a failed request, if any."""
+        if not self.has_more:
+            return None
+        return await self._run()
+
+    async def _run(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._fetch())
+            self._task.add_done_callback(lambda _: setattr(self, "_task", None))
+        return await asyncio.shield(self._task)
+
+    async def _fetch(self):
+        page = await asyncio.to_thread(fetch_listing_page, self.name, self.cursor if self.loaded else None,
+                                       self.keyword, self.sort)
+        if _is_error(page):
+            return page
+
+        df_page, self.cursor = page
+        if self.loaded and not self.frame.empty:
+            df_page = pd.concat([self.frame, df_page], ignore_index=True)
+        # A new frame per page (frames handed out are never changed)
+        self.frame = df_page
+        self.loaded = True
+        return None
+
+
+# The snapshot shared by all sessions of this process
+shared_products = ProductSnapshot()
@@ -0,0 +1,225 @@
+import base64
+import json
+
+from psycopg2 import sql
+
+# Products are always paged in the order the dashboard shows them: most scanned first
+ORDER_BY = "COALESCE(scan_count, 0) DESC, id"
+
+# Columns searched by the `keyword` filter
+KEYWORD_COLUMNS = ['name', 'name_search', 'brands', 'brands_search', 'categories', 'synonyms', 'barcode']
+
+# Columns always returned so the next page's cursor can be computed
+CURSOR_FIELDS = ['id', 'scan_count']
+
+MAX_PAGE_SIZE = 5000
+
+# Directions of the `sort` argument
+SORT_DIRECTIONS = {"asc": "ASC", "desc": "DESC"}
+
+
+class QueryError(ValueError):
+    """Raised for invalid pagination/filter/projection arguments (answered with 400)."""
+    pass
+
+
+def _cursor_value(value):
+    # Sort values are sent back as query parameters: JSON numbers/strings as they are,
+    # anything else (Decimal, dates) as its text, which PostgreSQL casts back exactly
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def encode_cursor(row: dict, args=None) -> str:
+    """
+    Builds the opaque keyset cursor pointing just after `row`: `<scan_count>:<id>` for the
+    default order, or (with a `sort` in `args`) the sort, direction, sort value and id.
+    """
+    sort = _sort_arg(args) if args is not None else None
+    if sort is None:
+        scan_count = row.get('scan_count') or 0
+        return f"{int(scan_count)}:{int(row['id'])}"
+
+    column, direction = sort
+    payload = json.dumps([column, direction, _cursor_value(row.get(column)), int(row['id'])])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        scan_count, product_id = cursor.split(":")
+        return int(scan_count), int(product_id)
+    except (AttributeError, ValueError):
+        raise QueryError(f"Invalid cursor: {cursor!r}")
+
+
+def decode_sorted_cursor(cursor: str, sort):
+    """(sort value, id) of a cursor of the sorted order `sort` ((column, direction))."""
+    try:
+        column, direction, value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        product_id = int(product_id)
+    except (AttributeError, TypeError, ValueError):
+        raise QueryError(f"Invalid cursor: {cursor!r}")
+    if (column, direction) != tuple(sort):
+        raise QueryError("The cursor belongs to another sort order")
+    return value, product_id
+
+
+def _sort_arg(args):
+    # (column, 'asc'/'desc') of the `sort`/`direction` arguments, None for the default order
+    column = (args.get("sort") or "").strip()
+    if not column:
+        return None
+    direction = (args.get("direction") or "asc").strip().lower()
+    if direction not in SORT_DIRECTIONS:
+        raise QueryError("'direction' must be 'asc' or 'desc'")
+    return column, direction
+
+
+def _int_arg(args, name):
+    value = args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError(f"'{name}' must be an integer")
+
+
+def _int_list_arg(args, name):
+    value = args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        values = [int(v) for v in str(value).split(",") if v.strip()]
+    except ValueError:
+        raise QueryError(f"'{name}' must be a comma separated list of integers")
+    if len(values) > MAX_PAGE_SIZE:
+        raise QueryError(f"'{name}' accepts at most {MAX_PAGE_SIZE} values")
+    return values
+
+
+def parse_fields(fields_arg, columns):
+    """Validates a comma separated `fields=` argument against the product columns."""
+    if not fields_arg:
+        return None
+    fields = [f.strip() for f in fields_arg.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in columns]
+    if unknown:
+        raise QueryError(f"Unknown fields: {', '.join(unknown)}")
+    # Keep the requested order, add the cursor columns if missing
+    return fields + [f for f in CURSOR_FIELDS if f not in fields]
+
+
+def build_product_query(args, columns, base_conditions=()):
+    """
+    Builds the SELECT for a product listing endpoint from the request arguments.
+
+    Supported arguments:
+        fields: comma separated list of columns to return (default: all columns).
+        ids: comma separated product ids (batch lookup in one query).
+        active, newly_added, cluster_count: exact match filters.
+        min_cluster_count: only products with at least this cluster size.
+        min_missing_fields: only products with at least this many empty fields.
+        keyword: case-insensitive substring match on the KEYWORD_COLUMNS.
+        sort, direction: order by this column ('asc' or 'desc', empty values last, then
+            by id) instead of the default ORDER_BY.
+        limit: page size; when omitted every matching row is returned.
+        cursor: value of the X-Next-Cursor header of the previous page (of the same sort).
+
+    Args:
+        args: The request arguments (werkzeug MultiDict or plain dict).
+        columns: The product table columns, used to validate `fields`.
+        base_conditions: SQL conditions (strings without parameters) the endpoint always applies.
+
+    Returns:
+        A tuple (query, params, limit). When `limit` is not None the query fetches
+        one extra row so the caller can tell whether there is a next page.
+    """
+    fields = parse_fields(args.get("fields"), columns)
+    sort = _sort_arg(args)
+    if sort is not None:
+        if sort[0] not in columns:
+            raise QueryError(f"Unknown sort column: {sort[0]}")
+        if fields and sort[0] not in fields:
+            # The cursor of the next page needs the sort value of the last row
+            fields.append(sort[0])
+    if fields:
+        select = sql.SQL(", ").join(sql.Identifier(f) for f in fields)
+    else:
+        select = sql.SQL("*")
+
+    conditions = [sql.SQL(c) for c in base_conditions]
+    params = []
+
+    ids = _int_list_arg(args, "ids")
+    if ids is not None:
+        conditions.append(sql.SQL("id = ANY(%s)"))
+        params.append(ids)
+
+    for name in ("active", "newly_added"):
+        value = _int_arg(args, name)
+        if value is not None:
+            conditions.append(sql.SQL("{} = %s").format(sql.Identifier(name)))
+            params.append(value)
+
+    cluster_count = _int_arg(args, "cluster_count")
+    if cluster_count is not None:
+        conditions.append(sql.SQL("COALESCE(cluster_count, 1) = %s"))
+        params.append(cluster_count)
+
+    min_cluster_count = _int_arg(args, "min_cluster_count")
+    if min_cluster_count is not None:
+        conditions.append(sql.SQL("COALESCE(cluster_count, 1) >= %s"))
+        params.append(min_cluster_count)
+
+    min_missing_fields = _int_arg(args, "min_missing_fields")
+    if min_missing_fields is not None:
+        conditions.append(sql.SQL("missing_field_count >= %s"))
+        params.append(min_missing_fields)
+
+    keyword = (args.get("keyword") or "").strip()
+    if keyword:
+        searchable = [c for c in KEYWORD_COLUMNS if c in columns]
+        if searchable:
+            conditions.append(sql.SQL("({})").format(sql.SQL(" OR ").join(
+                sql.SQL("{}::text ILIKE %s").format(sql.Identifier(c)) for c in searchable)))
+            pattern = "%" + keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            params.extend([pattern] * len(searchable))
+
+    cursor = args.get("cursor")
+    if cursor and sort is None:
+        scan_count, product_id = decode_cursor(cursor)
+        conditions.append(sql.SQL("(COALESCE(scan_count, 0) < %s OR (COALESCE(scan_count, 0) = %s AND id > %s))"))
+        params.extend([scan_count, scan_count, product_id])
+    elif cursor:
+        # Rows after (value, id) in the order (empty last, column, id)
+        value, product_id = decode_sorted_cursor(cursor, sort)
+        column = sql.Identifier(sort[0])
+        if value is None:
+            conditions.append(sql.SQL("({} IS NULL AND id > %s)").format(column))
+            params.append(product_id)
+        else:
+            after = sql.SQL(">" if sort[1] == "asc" else "<")
+            conditions.append(sql.SQL("({col} IS NULL OR {col} {after} %s OR ({col} = %s AND id > %s))").format(
+                col=column, after=after))
+            params.extend([value, value, product_id])
+
+    limit = _int_arg(args, "limit")
+    if limit is not None and not (1 <= limit <= MAX_PAGE_SIZE):
+        raise QueryError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+
+    query = sql.SQL("SELECT {} FROM product").format(select)
+    if conditions:
+        query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+    if sort is None:
+        query += sql.SQL(" ORDER BY " + ORDER_BY)
+    else:
+        query += sql.SQL(" ORDER BY {col} IS NULL, {col} " + SORT_DIRECTIONS[sort[1]] + ", id").format(
+            col=sql.Identifier(sort[0]))
+    if limit is not None:
+        query += sql.SQL(" LIMIT %s")
+        params.append(limit + 1)
+
+    return query, params, limit
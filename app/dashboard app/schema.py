@@ -0,0 +1,284 @@
+# Database objects the API relies on besides the imported `product` table.
+# Every statement is idempotent, so ensure_schema() can run each time the API starts.
+
+# Columns maintained by the database itself (never edited from the dashboard, not counted as missing)
+COMPUTED_COLUMNS = ['missing_field_count', 'is_incomplete', 'change_seq', 'change_xid']
+
+# --- Completeness of a product ---
+# missing_field_count = number of NULL columns of the row, is_incomplete = missing_field_count > 0.
+# The trigger reads the row generically, so columns added to `product` later are counted too.
+# BEFORE triggers fire in name order, so product_change_seq (change feed, below) sets its columns
+# before product_completeness runs; the computed columns are skipped, so the count does not
+# depend on that order.
+_COMPLETENESS_COLUMNS = """
+ALTER TABLE product
+    ADD COLUMN IF NOT EXISTS missing_field_count integer,
+    ADD COLUMN IF NOT EXISTS is_incomplete boolean;
+"""
+
+_COMPLETENESS_FUNCTION = """
+CREATE OR REPLACE FUNCTION product_set_completeness() RETURNS trigger AS $$
+BEGIN
+    NEW.missing_field_count := (
+        SELECT COUNT(*)
+        FROM json_each(row_to_json(NEW)) AS f
+        WHERE json_typeof(f.value) = 'null'
+          AND f.key NOT IN (""" + ", ".join(f"'{column}'" for column in COMPUTED_COLUMNS) + """)
+    );
+    NEW.is_incomplete := NEW.missing_field_count > 0;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_COMPLETENESS_TRIGGER = """
+DROP TRIGGER IF EXISTS product_completeness ON product;
+CREATE TRIGGER product_completeness
+    BEFORE INSERT OR UPDATE ON product
+    FOR EACH ROW EXECUTE FUNCTION product_set_completeness();
+"""
+
+# Backfill rows written before the trigger existed (the no-op update fires the trigger)
+_COMPLETENESS_BACKFILL = """
+UPDATE product SET is_incomplete = is_incomplete WHERE is_incomplete IS NULL;
+"""
+
+# Serves /products/incompleted: incomplete products of one `active` value, most scanned first
+_COMPLETENESS_INDEX = """
+CREATE INDEX IF NOT EXISTS product_incomplete_scan_count_idx
+    ON product (active, is_incomplete, (COALESCE(scan_count, 0)) DESC, id)
+    WHERE is_incomplete;
+"""
+
+# --- Product counters (KPI cards and change detection) ---
+# One row, kept up to date by statement-level triggers that apply the aggregate of the
+# changed rows (transition tables), so /products/stats never scans the product table.
+PRODUCT_STATS_AGGREGATE = """
+SELECT COUNT(*),
+       COUNT(*) FILTER (WHERE active = 1),
+       COUNT(*) FILTER (WHERE active = 0),
+       COUNT(*) FILTER (WHERE newly_added = 1),
+       COALESCE(SUM(scan_count), 0)
+FROM {table}
+"""
+
+_STATS_TABLE = """
+CREATE TABLE IF NOT EXISTS product_stats (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    total_products bigint NOT NULL,
+    verified_products bigint NOT NULL,
+    incomplete_products bigint NOT NULL,
+    newly_added_products bigint NOT NULL,
+    scan_sum bigint NOT NULL
+);
+"""
+
+_STATS_FUNCTION = """
+CREATE OR REPLACE FUNCTION product_stats_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE product_stats s
+        SET total_products = s.total_products - d.total,
+            verified_products = s.verified_products - d.verified,
+            incomplete_products = s.incomplete_products - d.incomplete,
+            newly_added_products = s.newly_added_products - d.newly_added,
+            scan_sum = s.scan_sum - d.scan_sum
+        FROM (""" + PRODUCT_STATS_AGGREGATE.format(table="old_rows") + """) AS d(total, verified, incomplete, newly_added, scan_sum);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE product_stats s
+        SET total_products = s.total_products + d.total,
+            verified_products = s.verified_products + d.verified,
+            incomplete_products = s.incomplete_products + d.incomplete,
+            newly_added_products = s.newly_added_products + d.newly_added,
+            scan_sum = s.scan_sum + d.scan_sum
+        FROM (""" + PRODUCT_STATS_AGGREGATE.format(table="new_rows") + """) AS d(total, verified, incomplete, newly_added, scan_sum);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# Transition tables only allow one event per trigger
+_STATS_TRIGGERS = """
+DROP TRIGGER IF EXISTS product_stats_insert ON product;
+DROP TRIGGER IF EXISTS product_stats_update ON product;
+DROP TRIGGER IF EXISTS product_stats_delete ON product;
+CREATE TRIGGER product_stats_insert AFTER INSERT ON product
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_stats_apply();
+CREATE TRIGGER product_stats_update AFTER UPDATE ON product
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_stats_apply();
+CREATE TRIGGER product_stats_delete AFTER DELETE ON product
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_stats_apply();
+"""
+
+# Recount once at startup (in the same transaction as the triggers), so the counters
+# are exact even if the table was changed while the triggers did not exist
+_STATS_REFRESH = """
+INSERT INTO product_stats (id, total_products, verified_products, incomplete_products, newly_added_products, scan_sum)
+SELECT true, * FROM (""" + PRODUCT_STATS_AGGREGATE.format(table="product") + """) AS counts
+ON CONFLICT (id) DO UPDATE SET
+    total_products = EXCLUDED.total_products,
+    verified_products = EXCLUDED.verified_products,
+    incomplete_products = EXCLUDED.incomplete_products,
+    newly_added_products = EXCLUDED.newly_added_products,
+    scan_sum = EXCLUDED.scan_sum;
+"""
+
+# --- Change feed ---
+# Every written row gets the next value of product_change_seq (its version) and the id of
+# the transaction writing it (change_xid, xid8: PostgreSQL 13+), deletions are logged with
+# theirs, and each committed statement sends a NOTIFY on CHANGE_CHANNEL with its transaction
+# id, so /products/changes can wait for changes instead of being polled.
+#
+# Sequence values and transaction ids are handed out in start order, not commit order, so
+# neither can tell on its own which changes are committed. The feed position is the oldest
+# transaction still running (CHANGE_POSITION_QUERY): every transaction below it has ended,
+# so the changes with a change_xid below it are all committed and no new one can appear
+# there. A long transaction holds the position back (delays the feed), it never loses changes.
+#
+# Logged deletions are kept for CHANGE_FEED_RETENTION; every deleting statement prunes the older
+# ones and raises product_feed_horizon to the position above them. The feed answers a `since`
+# below the horizon as truncated (the client reloads), since deletions after it may be gone.
+CHANGE_CHANNEL = "product_changes"
+CHANGE_FEED_RETENTION = "7 days"
+
+# The position below which logged deletions may have been pruned (no row: none pruned yet)
+CHANGE_HORIZON_QUERY = "SELECT horizon FROM product_feed_horizon;"
+
+# The current feed position, plus the next transaction id to be handed out
+CHANGE_POSITION_QUERY = """
+SELECT pg_snapshot_xmin(snapshot)::text::bigint, pg_snapshot_xmax(snapshot)::text::bigint
+FROM pg_current_snapshot() AS snapshot;
+"""
+
+_CHANGE_SEQ = """
+CREATE SEQUENCE IF NOT EXISTS product_change_seq;
+ALTER TABLE product ADD COLUMN IF NOT EXISTS change_seq bigint;
+ALTER TABLE product ADD COLUMN IF NOT EXISTS change_xid xid8;
+CREATE TABLE IF NOT EXISTS product_deletions (
+    id integer NOT NULL,
+    change_seq bigint NOT NULL DEFAULT nextval('product_change_seq')
+);
+ALTER TABLE product_deletions ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE product_deletions ADD COLUMN IF NOT EXISTS deleted_at timestamptz NOT NULL DEFAULT now();
+CREATE TABLE IF NOT EXISTS product_feed_horizon (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    horizon bigint NOT NULL
+);
+"""
+
+_CHANGE_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION product_set_change_seq() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('product_change_seq');
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION product_log_deletion() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO product_deletions (id) VALUES (OLD.id);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION product_prune_deletions() RETURNS trigger AS $$
+BEGIN
+    WITH pruned AS (
+        DELETE FROM product_deletions
+        WHERE deleted_at < now() - interval '""" + CHANGE_FEED_RETENTION + """'
+        RETURNING change_xid
+    )
+    INSERT INTO product_feed_horizon (id, horizon)
+    SELECT true, MAX(change_xid::text::bigint) + 1 FROM pruned HAVING COUNT(*) > 0
+    ON CONFLICT (id) DO UPDATE SET horizon = GREATEST(product_feed_horizon.horizon, EXCLUDED.horizon);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION product_notify_changes() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('""" + CHANGE_CHANNEL + """', pg_current_xact_id()::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_CHANGE_TRIGGERS = """
+DROP TRIGGER IF EXISTS product_change_seq ON product;
+DROP TRIGGER IF EXISTS product_deletion_log ON product;
+DROP TRIGGER IF EXISTS product_deletion_prune ON product;
+DROP TRIGGER IF EXISTS product_change_notify ON product;
+CREATE TRIGGER product_change_seq
+    BEFORE INSERT OR UPDATE ON product
+    FOR EACH ROW EXECUTE FUNCTION product_set_change_seq();
+CREATE TRIGGER product_deletion_log
+    AFTER DELETE ON product
+    FOR EACH ROW EXECUTE FUNCTION product_log_deletion();
+CREATE TRIGGER product_deletion_prune
+    AFTER DELETE ON product
+    FOR EACH STATEMENT EXECUTE FUNCTION product_prune_deletions();
+CREATE TRIGGER product_change_notify
+    AFTER INSERT OR UPDATE OR DELETE ON product
+    FOR EACH STATEMENT EXECUTE FUNCTION product_notify_changes();
+"""
+
+_CHANGE_BACKFILL = """
+UPDATE product SET change_seq = change_seq WHERE change_seq IS NULL OR change_xid IS NULL;
+"""
+
+_CHANGE_INDEXES = """
+DROP INDEX IF EXISTS product_change_seq_idx;
+DROP INDEX IF EXISTS product_deletions_change_seq_idx;
+CREATE INDEX IF NOT EXISTS product_change_xid_idx ON product (change_xid);
+CREATE INDEX IF NOT EXISTS product_deletions_change_xid_idx ON product_deletions (change_xid);
+CREATE INDEX IF NOT EXISTS product_deletions_deleted_at_idx ON product_deletions (deleted_at);
+"""
+
+# --- Job leases ---
+# Single-flight of the dashboard's background jobs over all its processes: the job holding the
+# lease of a key renews it while it runs; a lease left to expire (crashed process) can be taken over.
+_JOB_LEASES = """
+CREATE TABLE IF NOT EXISTS job_leases (
+    key text PRIMARY KEY,
+    owner text NOT NULL,
+    expires_at timestamptz NOT NULL
+);
+"""
+
+MIGRATIONS = [
+    _COMPLETENESS_COLUMNS,
+    _COMPLETENESS_FUNCTION,
+    _COMPLETENESS_TRIGGER,
+    _COMPLETENESS_BACKFILL,
+    _COMPLETENESS_INDEX,
+    _STATS_TABLE,
+    _STATS_FUNCTION,
+    _STATS_TRIGGERS,
+    _STATS_REFRESH,
+    _CHANGE_SEQ,
+    _CHANGE_FUNCTIONS,
+    _CHANGE_TRIGGERS,
+    _CHANGE_BACKFILL,
+    _CHANGE_INDEXES,
+    _JOB_LEASES,
+]
+
+
+def ensure_schema(conn):
+    """Creates/updates the columns, triggers and indexes the API needs, in one transaction."""
+    cur = conn.cursor()
+    try:
+        for statement in MIGRATIONS:
+            cur.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
@@ -0,0 +1,203 @@
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+# Length of the n-grams of the substring index
+GRAM_SIZE = 3
+
+# Cells of a row are joined with this separator, which never occurs in a search query, so a
+# match cannot span two cells (as with a per-column search)
+_CELL_SEPARATOR = "\x00"
+_token_pattern = re.compile(r"\w+")
+
+
+def _row_hashes(df):
+    try:
+        return pd.util.hash_pandas_object(df, index=False).to_numpy()
+    except TypeError:
+        # Unhashable cells (lists, dicts): hash their text instead
+        return pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy()
+
+
+def _row_texts(df):
+    # The text a row is searched in: its cells as text, lowercased. Missing cells are empty
+    # (pandas 3 keeps them missing through astype(str), and "nan" is not a match anyway)
+    return df.fillna('').astype(str).agg(_CELL_SEPARATOR.join, axis=1).str.lower().tolist()
+
+
+class SearchIndex:
+    """
+    Case-insensitive substring search over the rows of a product DataFrame, keyed on `key`,
+    in `columns` (all columns when None).
+
+    Keeps the text of every row with two posting lists: the GRAM_SIZE-grams of the texts
+    (a row containing the query contains all of its n-grams, so intersecting their postings
+    leaves only a few candidates to check) and the word tokens (for queries shorter than an
+    n-gram). sync() updates the index from the rows that were added, changed or removed
+    since the last call, so a refresh only re-indexes its delta.
+
+    Only the rows given to sync() are searched: for a listing that is loaded page by page,
+    searching the index finds nothing on the pages not loaded yet (the dashboard asks the
+    API instead until the listing is loaded whole, see product_cache.ListingQuery).
+    """
+
+    def __init__(self, key='id', columns=None):
+        self.key = key
+        self.columns = columns
+        self._columns = None
+        self._texts = {}    # key -> row text
+        self._hashes = {}   # key -> row hash (to tell which rows changed)
+        self._grams = {}    # n-gram -> set of keys
+        self._tokens = {}   # token -> set of keys
+
+    def __len__(self):
+        return len(self._texts)
+
+    def clear(self):
+        self._columns = None
+        self._texts.clear()
+        self._hashes.clear()
+        self._grams.clear()
+        self._tokens.clear()
+
+    def _add(self, key, text, row_hash):
+        self._texts[key] = text
+        self._hashes[key] = row_hash
+        for gram in {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}:
+            if _CELL_SEPARATOR not in gram:
+                self._grams.setdefault(gram, set()).add(key)
+        for token in set(_token_pattern.findall(text)):
+            self._tokens.setdefault(token, set()).add(key)
+
+    def _remove(self, key):
+        text = self._texts.pop(key, None)
+        self._hashes.pop(key, None)
+        if text is None:
+            return
+        for gram in {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}:
+            keys = self._grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._grams[gram]
+        for token in set(_token_pattern.findall(text)):
+            keys = self._tokens.get(token)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tokens[token]
+
+    def sync(self, df):
+        """
+        Makes the index match the rows of `df`: new and changed rows (by a hash of the row)
+        are (re-)indexed and rows no longer in df are dropped. Returns the number of rows
+        indexed or dropped.
+        """
+        if df is None or df.empty or self.key not in df.columns:
+            changed = len(self._texts)
+            self.clear()
+            return changed
+        if self.columns is not None:
+            df = df[[self.key] + [c for c in self.columns if c in df.columns and c != self.key]]
+        columns = list(df.columns)
+        if columns != self._columns:
+            self.clear()
+            self._columns = columns
+
+        keys = df[self.key].tolist()
+        hashes = _row_hashes(df)
+        removed = set(self._texts) - set(keys)
+        for key in removed:
+            self._remove(key)
+
+        positions = [i for i, (key, row_hash) in enumerate(zip(keys, hashes)) if self._hashes.get(key) != row_hash]
+        if positions:
+            texts = _row_texts(df.iloc[positions])
+            for position, text in zip(positions, texts):
+                key = keys[position]
+                self._remove(key)
+                self._add(key, text, hashes[position])
+        return len(removed) + len(positions)
+
+    def search(self, query):
+        """Keys of the rows with `query` in one of their cells (case-insensitive, literal)."""
+        query = query.lower()
+        if len(query) >= GRAM_SIZE:
+            postings = []
+            for gram in {query[i:i + GRAM_SIZE] for i in range(len(query) - GRAM_SIZE + 1)}:
+                keys = self._grams.get(gram)
+                if not keys:
+                    return set()
+                postings.append(keys)
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            if len(query) == GRAM_SIZE:
+                return candidates
+            return {key for key in candidates if query in self._texts[key]}
+
+        if _token_pattern.fullmatch(query):
+            # A query of word characters only can only match inside one token
+            keys = set()
+            for token, token_keys in self._tokens.items():
+                if query in token:
+                    keys |= token_keys
+            return keys
+        return {key for key, text in self._texts.items() if query in text}
+
+    def filter(self, df, query):
+        """The rows of df matching `query` (all rows for an empty query)."""
+        query = (query or "").strip()
+        if not query or df is None or df.empty:
+            return df
+        return df[df[self.key].isin(self.search(query))]
+
+
+def benchmark_search(n_rows=50000, queries=("kaas", "volle melk", "bio", "ka", "500"), seed=0):
+    """
+    Times building the index over a synthetic catalogue, a delta sync of 1% changed rows,
+    and the queries (index vs the str.contains scan), checking both find the same rows.
+    """
+    from preprocessing import synthetic_catalogue
+
+    df = synthetic_catalogue(n_rows, seed)
+    df.insert(0, 'id', np.arange(n_rows))
+    df['scan_count'] = np.random.default_rng(seed).integers(0, 1000, size=n_rows)
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.sync(df)
+    build_seconds = time.perf_counter() - start
+
+    changed = df.copy()
+    changed.loc[changed.index[::100], 'name'] = "gewijzigd product"
+    start = time.perf_counter()
+    index.sync(changed)
+    sync_seconds = time.perf_counter() - start
+
+    results = {"rows": n_rows, "build_seconds": build_seconds, "delta_sync_seconds": sync_seconds}
+    for query in queries:
+        start = time.perf_counter()
+        found = index.search(query)
+        index_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mask = changed.fillna('').astype(str).apply(
+            lambda col: col.str.contains(query, case=False, na=False, regex=False))
+        scan_ids = set(changed.loc[mask.any(axis=1), 'id'].tolist())
+        scan_seconds = time.perf_counter() - start
+
+        results[f"{query!r}_index_ms"] = index_seconds * 1000
+        results[f"{query!r}_scan_ms"] = scan_seconds * 1000
+        results[f"{query!r}_same"] = found == scan_ids
+    return results
+
+
+if __name__ == "__main__":
+    # python search_index.py [rows]
+    import sys
+
+    result = benchmark_search(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
+    print(", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in result.items()))
@@ -0,0 +1,106 @@
+import io
+
+import pandas as pd
+
+# pyarrow is optional: without it the API and the dashboard simply keep using JSON
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+# PostgreSQL type OIDs (cursor.description type_code) -> Arrow type names
+_PG_TYPES = {
+    16: "bool",
+    20: "int64", 21: "int64", 23: "int64",
+    700: "float64", 701: "float64", 1700: "float64",
+    1082: "date32",
+    1114: "timestamp", 1184: "timestamptz",
+}
+
+
+def arrow_available():
+    return pa is not None
+
+
+def _arrow_type(type_code):
+    name = _PG_TYPES.get(type_code)
+    if name == "bool":
+        return pa.bool_()
+    if name == "int64":
+        return pa.int64()
+    if name == "float64":
+        return pa.float64()
+    if name == "date32":
+        return pa.date32()
+    if name == "timestamp":
+        return pa.timestamp("us")
+    if name == "timestamptz":
+        return pa.timestamp("us", tz="UTC")
+    return pa.string()
+
+
+def arrow_schema(description):
+    """Arrow schema for the columns of a psycopg2 cursor description."""
+    return pa.schema([pa.field(col.name, _arrow_type(col.type_code)) for col in description])
+
+
+def rows_to_record_batch(rows, schema):
+    """Converts psycopg2 row tuples to one Arrow record batch (NULL -> null, numeric -> float64)."""
+    arrays = []
+    for i, field in enumerate(schema):
+        values = [row[i] for row in rows]
+        if pa.types.is_floating(field.type):
+            values = [None if v is None else float(v) for v in values]
+        elif pa.types.is_string(field.type):
+            values = [None if v is None else str(v) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _drain(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def iter_arrow_stream(schema, row_batches):
+    """Yields the bytes of an Arrow IPC stream, one chunk per batch of rows (plus the end-of-stream marker)."""
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    for rows in row_batches:
+        writer.write_batch(rows_to_record_batch(rows, schema))
+        yield _drain(sink)
+    writer.close()
+    yield _drain(sink)
+
+
+def arrow_bytes(schema, rows):
+    return b"".join(iter_arrow_stream(schema, [rows] if rows else []))
+
+
+# Integer/boolean columns become nullable pandas dtypes, so NULL cluster_id/scan_count
+# don't turn the whole column into floats
+def _pandas_type(arrow_type):
+    if pa.types.is_integer(arrow_type):
+        return pd.Int64Dtype()
+    if pa.types.is_boolean(arrow_type):
+        return pd.BooleanDtype()
+    return None
+
+
+def record_batch_to_dataframe(batch):
+    return batch.to_pandas(types_mapper=_pandas_type)
+
+
+def iter_arrow_dataframes(source):
+    """Decodes an Arrow IPC stream batch by batch, yielding one typed DataFrame per record batch."""
+    for batch in pa.ipc.open_stream(source):
+        yield record_batch_to_dataframe(batch)
+
+
+def arrow_to_dataframe(source):
+    """Decodes an Arrow IPC stream (bytes or a readable file object) into a typed DataFrame."""
+    return pa.ipc.open_stream(source).read_all().to_pandas(types_mapper=_pandas_type)
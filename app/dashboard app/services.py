@@ -1,39 +1,158 @@
-import joblib
+import json
+import threading
+import pandas as pd
 from pandas import DataFrame
 import requests
-from preprocessing import create_cleaned_text_feature
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import StandardScaler
-from sklearn.compose import ColumnTransformer
-from sklearn.cluster import DBSCAN
-from sklearn.feature_extraction.text import CountVectorizer
-from matplotlib import pyplot as plt
-from sklearn.decomposition import TruncatedSVD
+from preprocessing import create_cleaned_text_feature, load_token_caches, save_token_caches
+from http_cache import ConditionalCache
+from jobs import JobRunner
+from artifact_store import ArtifactStore
+from clustering import DBSCAN_EPS, DBSCAN_MIN_SAMPLES, MAX_VOCABULARY_DRIFT, SVD_COMPONENTS, assign_new_products, benchmark_nutrition_weight, content_hash, fit_clustering, input_hashes, vocabulary_drift
+from features import NUTRITION_COLS, NUTRITION_WEIGHT
+from blocking import BLOCKING_MIN_PRODUCTS, block_rows, blocking_keys
+from serialization import ARROW_MIMETYPE, arrow_available, arrow_to_dataframe, iter_arrow_dataframes
 
-# Get all products
+# Product, alike-products and stats responses, revalidated with ETags instead of re-downloaded.
+# Every call gets its own decoded copy of a cached response.
+_response_cache = ConditionalCache(max_entries=256)
 
+# Rows requested per call when walking through a paginated product endpoint
+PAGE_SIZE = 1000
+
+
+def _page_params(fields=None, cursor=None, limit=None, **filters):
+    params = {k: v for k, v in filters.items() if v is not None and v != ""}
+    if fields:
+        params['fields'] = ",".join(fields)
+    if limit:
+        params['limit'] = limit
+    if cursor:
+        params['cursor'] = cursor
+    return params
 
-def get_all_products():
-    API_URL = "http://127.0.0.1:5000/products"
 
+# Get one page of a paginated product endpoint as (products, next_cursor);
+# next_cursor is None on the last page
+
+
+def _get_product_page(API_URL, **params):
     try:
-        products = requests.get(API_URL)
-        return products.json()
+        response = requests.get(API_URL, params=_page_params(**params))
+        products = response.json()
+        if isinstance(products, dict) and "error" in products:
+            return products
+        return products, response.headers.get("X-Next-Cursor")
     except Exception as e:
         return {"error": str(e)}
 
-# Get all incompleted products
 
+# Ask for Arrow (typed, columnar) when pyarrow is installed, JSON otherwise
 
-def get_incompleted_products():
-    API_URL = "http://127.0.0.1:5000/products/incompleted"
 
+def _frame_headers():
+    if arrow_available():
+        return {"Accept": ARROW_MIMETYPE + ", application/json;q=0.5"}
+    return {"Accept": "application/json"}
+
+
+def _is_arrow(response):
+    return response.headers.get("Content-Type", "").startswith(ARROW_MIMETYPE)
+
+
+# Get one page of a paginated product endpoint as (DataFrame, next_cursor)
+
+
+def _get_product_frame_page(API_URL, **params):
     try:
-        products = requests.get(API_URL)
-        return products.json()
+        response = requests.get(API_URL, params=_page_params(**params), headers=_frame_headers())
+        if response.status_code != 200:
+            return response.json()
+        if _is_arrow(response):
+            df = arrow_to_dataframe(response.content)
+        else:
+            df = pd.json_normalize(response.json())
+        return df, response.headers.get("X-Next-Cursor")
     except Exception as e:
         return {"error": str(e)}
 
+
+# Walk through every page of a paginated product endpoint
+
+
+def _get_all_product_pages(API_URL, page_size=PAGE_SIZE, **params):
+    products = []
+    cursor = None
+    while True:
+        page = _get_product_page(API_URL, cursor=cursor, limit=page_size, **params)
+        if isinstance(page, dict):
+            return page
+        rows, cursor = page
+        products.extend(rows)
+        if not cursor:
+            return products
+
+# Products per DataFrame chunk when consuming a streamed (NDJSON) export
+STREAM_CHUNK_SIZE = 5000
+
+
+def _iter_product_stream(API_URL, chunk_size=STREAM_CHUNK_SIZE, **params):
+    """
+    Yields DataFrames of products read incrementally from a streamed endpoint.
+
+    With pyarrow installed the API sends Arrow record batches, which are decoded as they
+    arrive (one chunk per server batch). Otherwise NDJSON lines are grouped into chunks
+    of at most `chunk_size` products.
+    """
+    params = _page_params(**params)
+    params['stream'] = 1
+    headers = {"Accept": ARROW_MIMETYPE} if arrow_available() else {"Accept": "application/x-ndjson"}
+    with requests.get(API_URL, params=params, stream=True, headers=headers) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"Error streaming products ({response.status_code}): {response.text}")
+
+        if _is_arrow(response):
+            yield from iter_arrow_dataframes(response.raw)
+            return
+
+        batch = []
+        for line in response.iter_lines():
+            if not line:
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= chunk_size:
+                yield DataFrame(batch)
+                batch = []
+        if batch:
+            yield DataFrame(batch)
+
+# Get all products
+
+
+def get_all_products(fields=None, page_size=PAGE_SIZE, **filters):
+    API_URL = "http://127.0.0.1:5000/products"
+    return _get_all_product_pages(API_URL, page_size=page_size, fields=fields, **filters)
+
+# Stream all products as DataFrame chunks (memory stays flat while the catalogue grows)
+
+
+def iter_all_products(fields=None, chunk_size=STREAM_CHUNK_SIZE, **filters):
+    API_URL = "http://127.0.0.1:5000/products"
+    return _iter_product_stream(API_URL, chunk_size=chunk_size, fields=fields, **filters)
+
+# Get all incompleted products
+
+
+def get_incompleted_products(fields=None, page_size=PAGE_SIZE, **filters):
+    API_URL = "http://127.0.0.1:5000/products/incompleted"
+    return _get_all_product_pages(API_URL, page_size=page_size, fields=fields, **filters)
+
+# Get one page of incompleted products (most scanned first) as (DataFrame, next_cursor)
+
+
+def get_incompleted_products_page(cursor=None, limit=PAGE_SIZE, fields=None, **filters):
+    API_URL = "http://127.0.0.1:5000/products/incompleted"
+    return _get_product_frame_page(API_URL, cursor=cursor, limit=limit, fields=fields, **filters)
+
 # Get product info based on id
 
 
@@ -41,8 +160,26 @@ def get_product_info(product_id):
     API_URL = "http://127.0.0.1:5000/products/" + str(product_id)
 
     try:
-        product = requests.get(API_URL)
-        return product.json()
+        return _response_cache.get_json(API_URL)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# Get several products in one request (one `WHERE id = ANY(...)` query)
+
+
+def get_products_info(product_ids, fields=None):
+    API_URL = "http://127.0.0.1:5000/products"
+    product_ids = [int(pid) for pid in product_ids]
+    if not product_ids:
+        return []
+
+    try:
+        params = {'ids': ",".join(str(pid) for pid in product_ids)}
+        if fields:
+            params['fields'] = ",".join(fields)
+        products = requests.get(API_URL, params=params)
+        return products.json()
     except Exception as e:
         return {"error": str(e)}
 
@@ -61,8 +198,22 @@ def get_alike_products(product_id, cluster_id):
         str(product_id) + "/" + str(cluster_id)
 
     try:
-        products = requests.get(API_URL)
-        return products.json()
+        return _response_cache.get_json(API_URL)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# Top-k most similar products of one product (by text), most similar first, each with a `similarity` score
+def get_similar_products(product_id, k=10, fields=None, backend=None):
+    API_URL = "http://127.0.0.1:5000/products/similar/" + str(product_id)
+
+    params = {"k": k}
+    if fields:
+        params["fields"] = ",".join(fields)
+    if backend:
+        params["backend"] = backend
+    try:
+        return requests.get(API_URL, params=params).json()
     except Exception as e:
         return {"error": str(e)}
 
@@ -88,14 +239,30 @@ def link_product(source_product_id, destination_product_id):
         return {"error": str(e)}
 
 
-def get_products_count():
-    API_URL = "http://127.0.0.1:5000/products/count"
+# Follow the product change feed: returns the products changed/deleted from change
+# position `since` (waiting up to `wait` seconds for one) plus the current stats
+
+
+def get_product_changes(since=None, wait=0, fields=None):
+    API_URL = "http://127.0.0.1:5000/products/changes"
+    params = {}
+    if since is not None:
+        params['since'] = since
+    if wait:
+        params['wait'] = wait
+    if fields:
+        params['fields'] = ",".join(fields)
     try:
-        response = requests.get(API_URL)
-        data = response.json()
-        return (data.get("count", 0), data.get("scan_sum", 0))
-    except Exception:
-        return 0
+        # Give the long-poll enough time to answer before giving up client-side
+        response = requests.get(API_URL, params=params, timeout=wait + 10)
+        return response.json()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def get_products_count():
+    stats = get_product_stats()
+    return (stats.get("total_products", 0), stats.get("scan_sum", 0))
 
 
 def get_latest_product():
@@ -107,38 +274,138 @@ def get_latest_product():
         return {"error": "Failed to fetch latest product"}
 
 
-def re_clustering(df: DataFrame):
-    newly_added_products = df[df['newly_added'] == 1]
+# Text columns concatenated into the clustering feature
+CLUSTERING_TEXT_COLS = ['name', 'name_search', 'remarks', 'synonyms', 'brands', 'brands_search', 'bron', 'categories']
+
+# Nutrition columns used next to the text (features.py); only when NUTRITION_WEIGHT is set
+CLUSTERING_NUTRITION_COLS = NUTRITION_COLS if NUTRITION_WEIGHT else []
+
+# Columns re_clustering needs from the API (use as `fields` for get_all_products)
+CLUSTERING_FIELDS = ['id', 'newly_added'] + CLUSTERING_TEXT_COLS + CLUSTERING_NUTRITION_COLS
+
+
+# Fitted clustering of the catalogue (vectorizer, TF-IDF rows, labels), kept so newly added
+# products can be placed without refitting. Loaded lazily from the artifact store (and again
+# whenever another process published a newer version there).
+_artifact_store = ArtifactStore()
+_clustering_state = None
+_clustering_state_version = None
+_clustering_state_loaded = False
+_clustering_state_lock = threading.Lock()
+_token_caches_loaded = False
+
+
+def get_clustering_state():
+    """The current ClusteringState (memory-mapped from the latest stored version), or None."""
+    global _clustering_state, _clustering_state_version, _clustering_state_loaded
+    with _clustering_state_lock:
+        version = _artifact_store.latest_version()
+        if not _clustering_state_loaded or version != _clustering_state_version:
+            try:
+                _clustering_state = _artifact_store.load(version) if version is not None else None
+                _clustering_state_version = version
+            except Exception as e:
+                print(f"Error loading clustering artifacts: {e}")
+            _clustering_state_loaded = True
+        return _clustering_state
+
+
+def get_feature_similarities(row_ids, column_ids):
+    """
+    Cosine similarity of the clustering features (text, plus nutrition when used) of two
+    lists of products, as a DataFrame; NaN when there is no stored clustering or a product
+    is not in it.
+    """
+    state = get_clustering_state()
+    if state is None:
+        return pd.DataFrame(float('nan'), index=list(row_ids), columns=list(column_ids))
+    try:
+        return state.similarity(row_ids, column_ids)
+    except Exception as e:
+        print(f"Error computing feature similarities: {e}")
+        return pd.DataFrame(float('nan'), index=list(row_ids), columns=list(column_ids))
+
+
+def _stage_clustering_state(state):
+    # Written as a new artifact version, but only published by apply_clustering_result
+    version = _artifact_store.save(state, publish=False)
+    print(f"Clustering artifacts staged as version {version}")
+    return version
+
+
+def _publish_clustering_state(version):
+    # get_clustering_state loads it on its next call, since LATEST moved
+    _artifact_store.publish(version)
+    print(f"Clustering artifacts version {version} published")
+
+
+def _load_token_caches():
+    global _token_caches_loaded
+    with _clustering_state_lock:
+        if not _token_caches_loaded:
+            load_token_caches(_artifact_store.root)
+            _token_caches_loaded = True
+
+
+def _save_token_caches():
+    # The stem / dedupe-key memos are kept next to the artifacts for the next run
+    try:
+        save_token_caches(_artifact_store.root)
+    except Exception as e:
+        print(f"Error saving token caches: {e}")
+
+
+def _clean_products(products, progress=None, total=None, with_block_keys=False):
+    # with_block_keys adds the blocking keys of every product (from its raw columns) as 'block_keys'
+    _load_token_caches()
+    chunks = [products] if isinstance(products, DataFrame) else products
     
-    text_cols = ['name', 'name_search', 'remarks', 'synonyms', 'brands', 'brands_search', 'bron', 'categories']
+    text_cols = CLUSTERING_TEXT_COLS
+    keep_cols = ['id', 'name', 'newly_added', 'to_vectorize', 'block_keys'] + CLUSTERING_NUTRITION_COLS
     
-    df_cleaned = create_cleaned_text_feature(df, text_cols)
+    cleaned_chunks = []
+    cleaned_rows = 0
+    for chunk in chunks:
+        chunk_cleaned = create_cleaned_text_feature(chunk, text_cols)
+        if with_block_keys:
+            chunk_cleaned['block_keys'] = blocking_keys(chunk)
+        cleaned_chunks.append(chunk_cleaned[[c for c in keep_cols if c in chunk_cleaned.columns]])
+        cleaned_rows += len(chunk_cleaned)
+        if progress is not None:
+            fraction = 0.6 * min(1.0, cleaned_rows / total) if total else 0.3
+            progress(fraction, f"Cleaned {cleaned_rows} products")
     
-    tfidf_vectorizer = TfidfVectorizer(use_idf=True)
-    tfidf_vectors = tfidf_vectorizer.fit_transform(df_cleaned['to_vectorize'])
+    if not cleaned_chunks:
+        return DataFrame()
     
-    dbscan = DBSCAN(eps=0.3, min_samples=3, metric='cosine') # Using cosine distance for better text vector comparison
+    return pd.concat(cleaned_chunks, ignore_index=True)
+
+
+def _nutrition(df_cleaned):
+    # Nutrition input of the clustering features, None when clustering on the text only
+    return df_cleaned.reindex(columns=CLUSTERING_NUTRITION_COLS) if CLUSTERING_NUTRITION_COLS else None
 
-    # Fit DBSCAN on the TF-IDF matrix (one row per product) and save labels to product_text
-    labels = dbscan.fit_predict(tfidf_vectors)
-    df_cleaned['temp_cluster_id'] = labels
-    
-    # Calculate cluster_count
-    cluster_counts = df_cleaned['temp_cluster_id'].value_counts()
-    df_cleaned['cluster_count'] = df_cleaned['temp_cluster_id'].map(cluster_counts)
-    
-    # Set cluster_count to 1 where temp_cluster_id is -1
-    df_cleaned.loc[df_cleaned['temp_cluster_id'] == -1, 'cluster_count'] = 1
 
-    # Call API to update cluster_id
+def _write_back_clusters(df_clusters):
+    # Call API to update cluster_id; returns whether the update was committed
     API_URL = "http://127.0.0.1:5000/products/update/cluster"
+    if df_clusters.empty:
+        return True
     try:
         # Convert to list of dicts
-        data = df_cleaned[['id', 'temp_cluster_id', 'cluster_count']].to_dict(orient='records')
-        requests.put(API_URL, json=data)
+        data = df_clusters[['id', 'temp_cluster_id', 'cluster_count']].to_dict(orient='records')
+        result = requests.put(API_URL, json=data).json()
+        if "error" in result:
+            print(f"Error updating clusters: {result['error']}")
+            return False
+        print(f"Cluster write-back: {result.get('updated_count')} updated, {result.get('unchanged_count')} unchanged")
+        return True
     except Exception as e:
         print(f"Error updating clusters: {e}")
-        
+        return False
+
+
+def _clear_newly_added(newly_added_products):
     API_URL = "http://127.0.0.1:5000/products/update/newly_added_products"
     try:
         # Convert to list of dicts
@@ -147,9 +414,218 @@ def re_clustering(df: DataFrame):
     except Exception as e:
         print(f"Error updating clusters: {e}")
 
-    # Return results for newly added products
-    return df_cleaned[df_cleaned['id'].isin(newly_added_products['id'])]
-        
+
+class ClusteringResult:
+    """
+    Outcome of a clustering run, computed without changing anything: the staged artifact
+    version (None when the stored state was reused), the cluster rows to write back and the
+    newly added products with their temp_cluster_id and cluster_count.
+    """
+
+    def __init__(self, version, updates, newly_added):
+        self.version = version
+        self.updates = updates
+        self.newly_added = newly_added
+
+
+def _no_progress(fraction, message=None):
+    pass
+
+
+def compute_re_clustering(products, progress=_no_progress, total=None):
+    """
+    Re-clusters the whole catalogue without writing anything back (see apply_clustering_result).
+
+    Args:
+        products: A DataFrame of products, or an iterable of DataFrame chunks such as
+            iter_all_products(fields=CLUSTERING_FIELDS). Chunks are cleaned one at a time
+            and only the cleaned text is kept, so the raw text columns are never all in memory.
+        progress: Called as progress(fraction, message) between the steps (see jobs.JobRunner).
+        total: Expected number of products, used for the progress of the cleaning.
+    """
+    progress(0.0, "Loading products...")
+    df_cleaned = _clean_products(products, progress, total, with_block_keys=True)
+    _save_token_caches()
+    if df_cleaned.empty:
+        return ClusteringResult(None, DataFrame(), DataFrame())
+    
+    newly_added_products = df_cleaned[df_cleaned['newly_added'] == 1]
+    
+    # Unchanged input (same ids, cleaned texts and nutrition values as the stored full fit):
+    # reuse its labels instead of vectorizing and clustering again
+    state = get_clustering_state()
+    version = None
+    nutrition = _nutrition(df_cleaned)
+    input_hash = content_hash(df_cleaned['id'], input_hashes(df_cleaned['to_vectorize'], nutrition))
+    if (state is not None and state.full_fit and state.content_hash() == input_hash
+            and state.eps == DBSCAN_EPS and state.min_samples == DBSCAN_MIN_SAMPLES
+            and state.n_components == SVD_COMPONENTS and state.nutrition_weight == NUTRITION_WEIGHT):
+        print("Clustering input unchanged, reusing the stored clusters")
+    else:
+        # TF-IDF (+ nutrition) + DBSCAN over the whole catalogue; the fitted state is kept for incremental runs.
+        # Large catalogues are clustered per category / brand / name block (blocking.py)
+        blocks = block_rows(df_cleaned['block_keys']) if len(df_cleaned) >= BLOCKING_MIN_PRODUCTS else None
+        progress(0.6, f"Clustering {len(df_cleaned)} products" + (f" in {len(blocks)} blocks..." if blocks else "..."))
+        state = fit_clustering(df_cleaned['id'], df_cleaned['to_vectorize'], nutrition=nutrition, blocks=blocks)
+        # Last checkpoint: a staged version is never left behind by a cancelled job
+        progress(0.9, "Saving the clustering...")
+        version = _stage_clustering_state(state)
+    
+    df_cleaned = df_cleaned.drop(columns=['block_keys'])
+    clusters = DataFrame({'temp_cluster_id': state.labels, 'cluster_count': state.cluster_counts()}, index=state.product_ids)
+    df_cleaned['temp_cluster_id'] = df_cleaned['id'].map(clusters['temp_cluster_id']).to_numpy()
+    df_cleaned['cluster_count'] = df_cleaned['id'].map(clusters['cluster_count']).to_numpy()
+
+    updates = df_cleaned[['id', 'temp_cluster_id', 'cluster_count']]
+    return ClusteringResult(version, updates, df_cleaned[df_cleaned['id'].isin(newly_added_products['id'])])
+
+
+def compute_newly_added_clustering(full_refit=False, progress=_no_progress):
+    """
+    Places the newly added products in the existing clusters, without writing anything back.
+
+    Only the newly added products are fetched and vectorized (with the vocabulary/IDF of the
+    last full run) and each one joins an existing cluster or forms a new one, see
+    clustering.assign_new_products. The whole catalogue is re-clustered instead when
+    `full_refit` is set, when nothing was fitted yet, or when too many of the new tokens are
+    unknown to the fitted vocabulary (MAX_VOCABULARY_DRIFT).
+    """
+    state = get_clustering_state()
+    if full_refit or state is None:
+        total = get_product_stats().get('total_products')
+        return compute_re_clustering(iter_all_products(fields=CLUSTERING_FIELDS), progress, total)
+
+    progress(0.0, "Loading newly added products...")
+    newly_added_products = _clean_products(iter_all_products(fields=CLUSTERING_FIELDS, newly_added=1))
+    _save_token_caches()
+    if newly_added_products.empty:
+        return ClusteringResult(None, DataFrame(), DataFrame())
+
+    drift = vocabulary_drift(state.vectorizer, newly_added_products['to_vectorize'])
+    if drift > MAX_VOCABULARY_DRIFT:
+        print(f"Vocabulary drift {drift:.0%} above {MAX_VOCABULARY_DRIFT:.0%}, re-clustering all products")
+        total = get_product_stats().get('total_products')
+        return compute_re_clustering(iter_all_products(fields=CLUSTERING_FIELDS), progress, total)
+
+    # Products re-flagged as new (e.g. edited) are placed again
+    progress(0.5, f"Placing {len(newly_added_products)} newly added products...")
+    state = state.without(newly_added_products['id'])
+    state, changed_ids = assign_new_products(state, newly_added_products['id'], newly_added_products['to_vectorize'],
+                                             nutrition=_nutrition(newly_added_products))
+    progress(0.9, "Saving the clustering...")
+    version = _stage_clustering_state(state)
+
+    df_clusters = DataFrame({'id': state.product_ids, 'temp_cluster_id': state.labels, 'cluster_count': state.cluster_counts()})
+    return ClusteringResult(version, df_clusters[df_clusters['id'].isin(changed_ids)],
+                            newly_added_products.merge(df_clusters, on='id', how='left'))
+
+
+def nutrition_weight_benchmark(weights=(0.25, 0.5, 1.0)):
+    """
+    clustering.benchmark_nutrition_weight on the whole catalogue, with the products linked
+    to another one (link_to) as the pairs known to be the same product.
+    """
+    products = get_all_products(fields=['id', 'newly_added', 'link_to'] + CLUSTERING_TEXT_COLS + NUTRITION_COLS)
+    if isinstance(products, dict):
+        raise RuntimeError(products.get("error", "Failed to fetch the products"))
+    products = DataFrame(products)
+    df_cleaned = create_cleaned_text_feature(products, CLUSTERING_TEXT_COLS)
+    links = products.dropna(subset=['link_to'])
+    linked_pairs = zip(links['id'].astype(int), links['link_to'].astype(int))
+    return benchmark_nutrition_weight(df_cleaned['id'], df_cleaned['to_vectorize'],
+                                      products.reindex(columns=NUTRITION_COLS), linked_pairs, weights)
+
+
+def apply_clustering_result(result):
+    """
+    Writes a computed clustering back: the cluster ids in one transaction, then (only if that
+    succeeded) the staged artifact version is published and the newly added products are
+    cleared. On failure the staged version is discarded and nothing else is changed.
+
+    Returns:
+        The newly added products with their temp_cluster_id and cluster_count.
+    """
+    if not _write_back_clusters(result.updates):
+        if result.version is not None:
+            _artifact_store.discard(result.version)
+        raise RuntimeError("Writing the clusters back failed, the clustering was not applied")
+    if result.version is not None:
+        _publish_clustering_state(result.version)
+    if not result.newly_added.empty:
+        _clear_newly_added(result.newly_added)
+    return result.newly_added
+
+
+def re_clustering(products):
+    """
+    Re-clusters the whole catalogue and writes the new cluster ids back through the API.
+
+    Returns:
+        The cleaned rows of the newly added products with their temp_cluster_id and cluster_count.
+    """
+    return apply_clustering_result(compute_re_clustering(products))
+
+
+def cluster_newly_added_products(full_refit=False):
+    """
+    Places the newly added products in the existing clusters and writes the changes back
+    (see compute_newly_added_clustering), in this process.
+
+    Returns:
+        Same as re_clustering: the newly added products with temp_cluster_id and cluster_count.
+    """
+    return apply_clustering_result(compute_newly_added_clustering(full_refit))
+
+
+def acquire_job_lease(key, owner, ttl):
+    """
+    Takes (or renews) the database lease of a single-flight job key for `owner`, valid for `ttl`
+    seconds; False when another owner holds it. Raises when the API cannot be reached.
+    """
+    API_URL = "http://127.0.0.1:5000/jobs/leases/" + key
+    response = requests.post(API_URL, json={"owner": owner, "ttl": ttl}, timeout=10)
+    if response.status_code == 409:
+        return False
+    response.raise_for_status()
+    return True
+
+
+def release_job_lease(key, owner):
+    """Gives up the lease of `key` if `owner` still holds it."""
+    API_URL = "http://127.0.0.1:5000/jobs/leases/" + key
+    requests.delete(API_URL, json={"owner": owner}, timeout=10).raise_for_status()
+
+
+# Background clustering jobs, one at a time (single-flight key "clustering"): the lease makes it
+# one at a time over every dashboard process, not only within this one
+_job_runner = JobRunner(max_workers=1, acquire_lease=acquire_job_lease, release_lease=release_job_lease)
+CLUSTERING_JOB_KEY = "clustering"
+
+
+def submit_clustering_job(full_refit=False):
+    """
+    Runs compute_newly_added_clustering in the job worker process; the result is applied
+    (apply_clustering_result) in this process when the job finished successfully.
+
+    Returns:
+        The Job (see jobs.py); raises jobs.JobConflict while another clustering job is active,
+        in this or another dashboard process.
+    """
+    kind = "full_re_clustering" if full_refit else "newly_added_clustering"
+    return _job_runner.submit(kind, compute_newly_added_clustering, full_refit,
+                              key=CLUSTERING_JOB_KEY, on_done=apply_clustering_result)
+
+
+def get_clustering_job(job_id=None):
+    """A clustering job by id, or (without id) the active one; None if there is none."""
+    if job_id is None:
+        return _job_runner.active(CLUSTERING_JOB_KEY)
+    return _job_runner.get(job_id)
+
+
+def cancel_clustering_job(job_id):
+    return _job_runner.cancel(job_id)
+
 def get_all_newly_added_products():
     API_URL = "http://127.0.0.1:5000/products/new"
     
@@ -162,12 +638,12 @@ def get_all_newly_added_products():
 def get_product_stats():
     API_URL = "http://127.0.0.1:5000/products/stats"
     try:
-        response = requests.get(API_URL)
-        return response.json()
+        return _response_cache.get_json(API_URL)
     except Exception:
         return {
             'total_products': 0,
             'verified_products': 0,
             'incomplete_products': 0,
-            'newly_added_products': 0
+            'newly_added_products': 0,
+            'scan_sum': 0
         }
\ No newline at end of file
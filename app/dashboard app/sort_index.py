@@ -0,0 +1,152 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Sort orders kept per index ((version, column) pairs), the least recently used dropped first
+SORT_ORDERS_KEPT = 16
+
+
+def _column_hashes(values):
+    try:
+        return pd.util.hash_pandas_object(values, index=False).to_numpy()
+    except TypeError:
+        # Unhashable cells (lists, dicts): hash their text instead
+        return pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy()
+
+
+class SortIndex:
+    """
+    Sort orders of the columns of a versioned product DataFrame, computed when a column is
+    first sorted on and cached on (version, column).
+
+    An order is the permutation of the row positions sorting the column ascending (missing
+    values last, like sort_values); descending is the same permutation read backwards, so
+    flipping the direction never sorts again. The caller gives the version of the frame
+    (a frame never changes within a version), so sessions still showing an older version
+    of a listing keep their own orders instead of invalidating the others'. At most
+    `max_orders` orders are kept, the least recently used dropped first. An order of a new
+    version is taken over from the last version when its column's values (in row order) did
+    not change, so e.g. an edited name does not sort scan_count again.
+    """
+
+    def __init__(self, max_orders=SORT_ORDERS_KEPT):
+        self.max_orders = max_orders
+        self._orders = OrderedDict()   # (version, column) -> (ascending row positions, number of missing values, row hashes)
+        self._latest = {}              # column -> key of its most recently computed order
+
+    def __len__(self):
+        return len(self._orders)
+
+    def clear(self):
+        self._orders.clear()
+        self._latest.clear()
+
+    def _compute(self, df, column, hashes=None):
+        values = df[column].reset_index(drop=True)
+        positions = values.sort_values(kind='stable', na_position='last').index.to_numpy()
+        return positions, int(values.isna().sum()), hashes if hashes is not None else _column_hashes(df[column])
+
+    def _entry(self, df, column, version):
+        key = (version, column)
+        if key in self._orders:
+            self._orders.move_to_end(key)
+            return self._orders[key]
+
+        hashes = _column_hashes(df[column])
+        previous = self._orders.get(self._latest.get(column))
+        if previous is not None and np.array_equal(previous[2], hashes):
+            entry = previous
+        else:
+            entry = self._compute(df, column, hashes)
+        self._orders[key] = entry
+        self._latest[column] = key
+        while len(self._orders) > self.max_orders:
+            dropped, _ = self._orders.popitem(last=False)
+            if self._latest.get(dropped[1]) == dropped:
+                del self._latest[dropped[1]]
+        return entry
+
+    def order(self, df, column, ascending=True, version=None):
+        """
+        Row positions of df in the order of `column` (missing values last). Without a
+        version the order is computed and not cached.
+        """
+        positions, missing, _ = self._compute(df, column) if version is None else self._entry(df, column, version)
+        if ascending:
+            return positions
+        if not missing:
+            return positions[::-1]
+        # The ascending order read backwards, with the missing values kept last
+        present = len(positions) - missing
+        return np.concatenate([positions[present - 1::-1] if present else positions[:0], positions[present:]])
+
+    def positions(self, df, column, ascending=True, rows=None, version=None):
+        """
+        Row positions of df sorted on `column`, of only its rows in `rows` if given (a
+        selection of df's rows, e.g. the search results, with df's index labels). Taking just
+        the rows shown from these (df.iloc[positions[start:end]]) avoids copying the frame.
+        """
+        order = self.order(df, column, ascending, version)
+        if rows is not None and len(rows) < len(df):
+            keep = df.index.isin(rows.index)
+            order = order[keep[order]]
+        return order
+
+    def sort(self, df, column, ascending=True, rows=None, version=None):
+        """df (or its rows in `rows`) sorted on `column`."""
+        return df.iloc[self.positions(df, column, ascending, rows, version)]
+
+
+def benchmark_sort(n_rows=50000, columns=("name", "scan_count", "energy"), renders=20, seed=0):
+    """
+    Times a full sort_values per render against the cached orders (the first sort of a
+    column, then `renders` renders alternating the direction and taking a window of 100
+    rows) over a synthetic catalogue,
+    checking both give the same rows (for columns without ties, where the order is unique).
+    """
+    from preprocessing import synthetic_catalogue
+
+    df = synthetic_catalogue(n_rows, seed)
+    df.insert(0, 'id', np.arange(n_rows))
+    rng = np.random.default_rng(seed)
+    df['scan_count'] = rng.permutation(n_rows)
+    df['energy'] = rng.random(n_rows)
+    df.loc[df.index[::50], 'energy'] = np.nan
+
+    index = SortIndex()
+    results = {"rows": n_rows}
+    for column in columns:
+        start = time.perf_counter()
+        for render in range(renders):
+            expected = df.sort_values(by=column, ascending=render % 2 == 0)
+        sort_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index.positions(df, column, version=0)
+        first_seconds = time.perf_counter() - start
+
+        # A render takes the positions and the rows of one window
+        start = time.perf_counter()
+        for render in range(renders):
+            positions = index.positions(df, column, ascending=render % 2 == 0, version=0)
+            df.iloc[positions[:100]]
+        index_seconds = time.perf_counter() - start
+        found = df.iloc[positions]
+
+        results[f"{column}_sort_ms"] = sort_seconds / renders * 1000
+        results[f"{column}_first_ms"] = first_seconds * 1000
+        results[f"{column}_cached_ms"] = index_seconds / renders * 1000
+        if df[column].dropna().is_unique:
+            results[f"{column}_same"] = found['id'].tolist() == expected['id'].tolist()
+    return results
+
+
+if __name__ == "__main__":
+    # python sort_index.py [rows]
+    import sys
+
+    result = benchmark_sort(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
+    print(", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in result.items()))
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.metrics import adjusted_rand_score
+
+from blocking import block_rows, blocking_keys, cluster_blocks, synthetic_products
+from clustering import DBSCAN_EPS, DBSCAN_MIN_SAMPLES, fit_clustering
+from neighbors import BLOCK_ELEMENTS, build_index
+
+
+@pytest.fixture(scope="module")
+def catalogue():
+    df = synthetic_products(3000, seed=1)
+    return df, df['name'] + " " + df['brands_search'] + " " + df['categories']
+
+
+# A small bound scores the blocks of more than 1024 rows in slices of their rows
+@pytest.mark.parametrize("block_elements", [BLOCK_ELEMENTS, 50000])
+def test_block_radius_graph_is_the_block_diagonal_of_radius_graph(catalogue, block_elements):
+    _, texts = catalogue
+    vectors = fit_clustering(np.arange(len(texts)), texts, n_components=None).vectors
+    sizes = [700, 3, 1, 1200, 96, 1000]
+    block_of = np.repeat(np.arange(len(sizes)), sizes)
+
+    index = build_index(vectors)
+    full = index.radius_graph(DBSCAN_EPS).tocoo()
+    same_block = block_of[full.row] == block_of[full.col]
+    expected = sparse.csr_matrix((full.data[same_block], (full.row[same_block], full.col[same_block])), shape=full.shape)
+
+    found = index.block_radius_graph(sizes, DBSCAN_EPS, group_rows=1024, block_elements=block_elements)
+    assert (found != expected).nnz == 0
+    # Stored (zero-distance) entries are neighbours too: the same pairs must be stored
+    assert found.nnz == expected.nnz
+
+
+def test_blocked_clusters_match_global(catalogue):
+    df, texts = catalogue
+    state = fit_clustering(np.arange(len(texts)), texts, n_components=None)
+    blocked = cluster_blocks(state.vectors, block_rows(blocking_keys(df)), DBSCAN_EPS, DBSCAN_MIN_SAMPLES,
+                             parallel=False)
+    assert adjusted_rand_score(state.labels, blocked) == 1.0
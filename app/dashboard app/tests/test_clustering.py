@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from blocking import synthetic_products
+from clustering import DBSCAN_EPS, DBSCAN_MIN_SAMPLES, fit_clustering
+
+
+@pytest.fixture(scope="module")
+def catalogue():
+    df = synthetic_products(3000, seed=1)
+    return df['name'] + " " + df['brands_search'] + " " + df['categories']
+
+
+@pytest.mark.parametrize("min_samples", [DBSCAN_MIN_SAMPLES, 3])
+def test_same_labels_as_dbscan_cosine(catalogue, min_samples):
+    texts = catalogue
+    state = fit_clustering(np.arange(len(texts)), texts, DBSCAN_EPS, min_samples, n_components=None)
+    expected = DBSCAN(eps=DBSCAN_EPS, min_samples=min_samples, metric='cosine').fit_predict(state.vectors)
+    assert (state.labels >= 0).any()
+    np.testing.assert_array_equal(state.labels, expected)
+
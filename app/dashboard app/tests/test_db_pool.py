@@ -0,0 +1,75 @@
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+from db_pool import ConnectionPool
+
+
+class FakeConnection:
+    # Just what the pool uses of a psycopg2 connection
+    def __init__(self):
+        self.closed = 0
+        self.server_closed = False
+        self.queries = 0
+
+    def poll(self):
+        if self.server_closed:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        return extensions.POLL_OK
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def execute(self, query):
+                connection.poll()
+                connection.queries += 1
+
+            def close(self):
+                pass
+
+        return Cursor()
+
+    def rollback(self):
+        pass
+
+    def get_transaction_status(self):
+        return extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(ConnectionPool, "_connect", lambda self: FakeConnection())
+    return ConnectionPool(minconn=1, maxconn=2)
+
+
+def test_connection_closed_by_the_server_is_replaced(pool):
+    with pool.connection() as conn:
+        first = conn
+    first.server_closed = True
+
+    with pool.connection() as conn:
+        assert conn is not first
+    assert first.closed
+    assert pool.stats()["discarded"] == 1
+
+
+def test_recently_used_connection_is_not_pinged(pool):
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+    assert first.queries == 0
+
+
+def test_long_idle_connection_is_pinged(pool):
+    pool.health_check_after = 0.0
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+    # Pinged at both checkouts
+    assert first.queries == 2
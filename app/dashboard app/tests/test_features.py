@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from features import NUTRITION_COLS, nutrition_similarities
+
+
+def test_nutrition_similarities_match_the_pairwise_score():
+    rng = np.random.default_rng(0)
+    left = pd.DataFrame(rng.uniform(0, 50, size=(4, 5)), columns=NUTRITION_COLS[:5])
+    right = pd.DataFrame(rng.uniform(0, 50, size=(3, 5)), columns=NUTRITION_COLS[:5])
+    left.iloc[0, 2] = np.nan
+    right.iloc[2] = np.nan   # a verified product without nutrition values
+
+    sims = nutrition_similarities(left, right)
+    a, b = left.fillna(0).to_numpy(), right.fillna(0).to_numpy()
+    for i in range(len(a)):
+        for j in range(2):
+            expected = 100 - np.linalg.norm(a[i] - b[j]) / np.linalg.norm(b[j]) * 100
+            assert np.isclose(sims[i, j], expected)
+    assert np.isnan(sims[:, 2]).all()
+    assert nutrition_similarities(right.iloc[[2]], right.iloc[[2]])[0, 0] == 100.0
@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FINISHED_STATES, JobConflict, JobRunner
+
+
+class FakeLeases:
+    """In-memory stand-in for the API's job_leases table, shared by several runners."""
+
+    def __init__(self):
+        self.owners = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key, owner, ttl):
+        with self.lock:
+            return self.owners.setdefault(key, owner) == owner
+
+    def release(self, key, owner):
+        with self.lock:
+            if self.owners.get(key) == owner:
+                del self.owners[key]
+
+
+def _sleep(seconds, progress):
+    time.sleep(seconds)
+    return seconds
+
+
+def _wait_finished(runner, job):
+    deadline = time.time() + 30
+    while runner.get(job.id).status not in FINISHED_STATES:
+        assert time.time() < deadline
+        time.sleep(0.05)
+    return runner.get(job.id)
+
+
+@pytest.fixture
+def runners():
+    # Two runners sharing the leases, like two dashboard processes sharing the database
+    leases = FakeLeases()
+    created = [JobRunner(acquire_lease=leases.acquire, release_lease=leases.release) for _ in range(2)]
+    yield created, leases
+    for runner in created:
+        runner.shutdown()
+
+
+def test_lease_is_single_flight_across_runners(runners):
+    (first, second), leases = runners
+    job = first.submit("clustering", _sleep, 1.0)
+    with pytest.raises(JobConflict) as conflict:
+        second.submit("clustering", _sleep, 0.0)
+    assert conflict.value.job is None
+    with pytest.raises(JobConflict) as conflict:
+        first.submit("clustering", _sleep, 0.0)
+    assert conflict.value.job is job
+
+    # Released once the job finished, so the other runner may go next
+    assert _wait_finished(first, job).status == DONE
+    assert leases.owners == {}
+    assert _wait_finished(second, second.submit("clustering", _sleep, 0.0)).status == DONE
+
+
+def test_job_that_loses_its_lease_is_cancelled(runners):
+    (runner, _), leases = runners
+    runner.lease_ttl = 0.3
+    job = runner.submit("clustering", _sleep, 2.0)
+    leases.owners["clustering"] = "another process"
+    # Cancelled at the next renewal; it only stops at a progress checkpoint, which _sleep has none of
+    deadline = time.time() + 5
+    while not job._cancel_event.is_set():
+        assert time.time() < deadline
+        time.sleep(0.05)
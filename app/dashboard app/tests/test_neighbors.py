@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from blocking import synthetic_products
+from clustering import DBSCAN_EPS, fit_clustering, reduce_dimensions
+from neighbors import _pairs, build_index, recall_at_k
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    df = synthetic_products(3000, seed=2)
+    texts = df['name'] + " " + df['brands_search'] + " " + df['categories']
+    tfidf = fit_clustering(np.arange(len(texts)), texts, n_components=None).vectors
+    return tfidf, reduce_dimensions(tfidf, 64)[1]
+
+
+@pytest.fixture(scope="module")
+def indexes(vectors):
+    _, reduced = vectors
+    return build_index(reduced), build_index(reduced, "graph")
+
+
+def test_graph_recall_against_exact(indexes):
+    exact, graph = indexes
+    assert recall_at_k(graph, exact, k=10, sample=500) >= 0.95
+
+
+def test_graph_scores_are_exact(vectors, indexes):
+    _, reduced = vectors
+    exact, graph = indexes
+    queries = reduced[::100]
+    found, sims = graph.kneighbors(queries, k=5)
+    assert (found >= 0).all()
+    np.testing.assert_allclose(sims, np.einsum('ij,ikj->ik', exact.vectors[::100], exact.vectors[found]), atol=1e-5)
+    # Every query row is in the index: its best match is itself (or an identical row)
+    np.testing.assert_allclose(sims[:, 0], 1.0, atol=1e-5)
+
+
+def test_graph_radius_queries_only_miss(vectors, indexes):
+    _, reduced = vectors
+    exact, graph = indexes
+    expected = exact.radius_neighbors(reduced[:200], DBSCAN_EPS)
+    found = graph.radius_neighbors(reduced[:200], DBSCAN_EPS)
+    hits = total = 0
+    for (expected_rows, _), (found_rows, _) in zip(expected, found):
+        assert set(found_rows) <= set(expected_rows)
+        hits += len(found_rows)
+        total += len(expected_rows)
+    assert hits / total >= 0.95
+
+    expected_pairs = _pairs(exact.radius_graph(DBSCAN_EPS))
+    found_pairs = _pairs(graph.radius_graph(DBSCAN_EPS))
+    assert found_pairs <= expected_pairs
+    assert len(found_pairs) / len(expected_pairs) >= 0.95
+
+
+def test_graph_needs_dense_rows(vectors):
+    tfidf, _ = vectors
+    with pytest.raises(ValueError):
+        build_index(tfidf, "graph")
+    with pytest.raises(ValueError):
+        build_index(tfidf, "lsh")
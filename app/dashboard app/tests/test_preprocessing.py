@@ -0,0 +1,129 @@
+import json
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import pytest
+from nltk.stem import PorterStemmer
+from nltk.tokenize import word_tokenize
+
+import preprocessing as prep
+
+TEXT_COLS = ["name", "brands", "categories"]
+
+# Accents, punctuation, digits, possessives, stopwords and missing cells
+CORPUS = pd.DataFrame({
+    "name": ["Café Crème brûlée 2x", "Kellogg's Corn-Flakes (500g)", np.nan, "Zo'n   VOLLE melk 1,5L",
+             "Pindakaas/Nuts & Co. 100%", "Mama’s appel-sap; 25°", "ÉÉN koek\nmet chocolade", "a b c"],
+    "brands": ["L'Oréal", np.nan, "Bio+", "Campina", "Calvé=Calve", "", "de Ruijter", np.nan],
+    "categories": ["Desserts, Zuivel", "Ontbijt-granen", np.nan, "melk van de boer", "Broodbeleg",
+                   "Sappen en nectars", "Koekjes & Chocolade", "x"],
+})
+
+
+def _reference_clean(df):
+    # The per-step pipeline create_cleaned_text_feature replaced (one Series.apply per step)
+    stemmer = PorterStemmer()
+    stopwords = re.compile(r"\b(?:" + "|".join(re.escape(w) for w in sorted(prep._dutch_stopwords)) + r")\b",
+                           flags=re.IGNORECASE)
+
+    def remove_specific_chars(s):
+        s = re.sub(r"[()=&%+\;/.\u00B0-]+", " ", s)
+        s = s.replace("'s", " ").replace("’s", " ")
+        s = re.sub(r"(?:'n|’n)\b", " ", s)
+        s = re.sub(r"['’]\b", " ", s)
+        s = stopwords.sub(" ", s)
+        return re.sub(r"\s+", " ", s).strip()
+
+    def dedupe(text):
+        seen, out = set(), []
+        for t in text.split():
+            key = unicodedata.normalize("NFKD", t).encode("ascii", "ignore").decode("ascii").lower()
+            key = re.sub(r"[^a-z0-9]+", "", key) or t.lower()
+            if key not in seen:
+                seen.add(key)
+                out.append(t)
+        return " ".join(out)
+
+    text = df[TEXT_COLS].fillna("").astype(str).agg(" ".join, axis=1)
+    text = text.str.lower().str.replace(r"[,\d]+", "", regex=True).str.replace(r"\s+", " ", regex=True).str.strip()
+    text = text.apply(remove_specific_chars).apply(dedupe)
+    text = text.apply(lambda s: " ".join(stemmer.stem(w) for w in word_tokenize(s))).apply(dedupe)
+    text = text.apply(lambda s: " ".join(t for t in s.split() if len(t) > 1)).apply(dedupe)
+    return text.tolist()
+
+
+@pytest.fixture
+def preprocessing():
+    # Every test starts from empty caches and a pool forked from them
+    prep.clear_cleaned_text_cache()
+    for cache in prep._token_caches.values():
+        cache.clear()
+    yield prep
+    if prep._pool is not None:
+        prep._pool.shutdown()
+        prep._pool = None
+
+
+def test_pool_workers_fill_the_token_caches(preprocessing, monkeypatch, tmp_path):
+    monkeypatch.setattr(preprocessing, "PARALLEL_MIN_ROWS", 1)
+    monkeypatch.setattr(preprocessing, "PARALLEL_SHARD_SIZE", 50)
+    misses = preprocessing.token_cache_stats()["stem"]["misses"]
+
+    preprocessing.create_cleaned_text_feature(preprocessing.synthetic_catalogue(200, seed=1), TEXT_COLS)
+    stats = preprocessing.token_cache_stats()
+    assert stats["stem"]["entries"] > 0 and stats["dedupe_key"]["entries"] > 0
+    assert stats["stem"]["misses"] > misses
+
+    preprocessing.save_token_caches(str(tmp_path))
+    with open(tmp_path / preprocessing.TOKEN_CACHE_FILE, encoding="utf-8") as f:
+        stored = json.load(f)
+    assert stored["stem"]["melk"] == "melk"
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_fused_cleaning_matches_the_per_step_pipeline(preprocessing, vectorized):
+    expected = _reference_clean(CORPUS)
+    out = preprocessing.create_cleaned_text_feature(CORPUS, TEXT_COLS, vectorized=vectorized)
+    assert out["to_vectorize"].tolist() == expected
+
+    # The building blocks on their own: step 3a over the Series, then the fused steps 3b to 6
+    text = preprocessing._normalize_series(CORPUS[TEXT_COLS].fillna("").astype(str).agg(" ".join, axis=1))
+    assert preprocessing._remove_specific_chars_series(text).tolist() == \
+        text.apply(preprocessing._remove_specific_chars_keep_spaces).tolist()
+    assert [preprocessing._finish_text(t) for t in preprocessing._remove_specific_chars_series(text)] == expected
+
+
+def test_cached_vectorized_and_pool_results_are_equal(preprocessing, monkeypatch):
+    df = preprocessing.synthetic_catalogue(300, seed=2)
+    per_row = preprocessing.create_cleaned_text_feature(df, TEXT_COLS, vectorized=False)["to_vectorize"].tolist()
+    preprocessing.clear_cleaned_text_cache()
+    vectorized = preprocessing.create_cleaned_text_feature(df, TEXT_COLS)["to_vectorize"].tolist()
+    # Every row is cached now: the second call reads them all back
+    cached = preprocessing.create_cleaned_text_feature(df, TEXT_COLS)["to_vectorize"].tolist()
+
+    preprocessing.clear_cleaned_text_cache()
+    monkeypatch.setattr(preprocessing, "PARALLEL_MIN_ROWS", 1)
+    monkeypatch.setattr(preprocessing, "PARALLEL_SHARD_SIZE", 64)
+    pooled = preprocessing.create_cleaned_text_feature(df, TEXT_COLS)["to_vectorize"].tolist()
+
+    assert per_row == vectorized == cached == pooled
+    # One entry per distinct concatenated raw text (the cache key)
+    assert len(preprocessing._cleaned_cache) == df[TEXT_COLS].fillna("").astype(str).agg(" ".join, axis=1).nunique()
+
+
+def test_cache_key_follows_the_row_text(preprocessing, monkeypatch):
+    df = pd.DataFrame({"name": ["volle melk", "halfvolle melk"], "brands": ["Campina", "Campina"],
+                       "categories": ["Zuivel", "Zuivel"]})
+    assert preprocessing.create_cleaned_text_feature(df, TEXT_COLS)["to_vectorize"].tolist() == \
+        ["voll melk campina zuivel", "halfvol melk campina zuivel"]
+
+    # Only the changed row misses the cache, and it is cleaned again from its new text
+    cleaned = []
+    monkeypatch.setattr(preprocessing, "_finish_texts",
+                        lambda texts: cleaned.extend(texts) or [preprocessing._finish_text(t) for t in texts])
+    df.loc[1, "brands"] = "Melkunie"
+    assert preprocessing.create_cleaned_text_feature(df, TEXT_COLS)["to_vectorize"].tolist() == \
+        ["voll melk campina zuivel", "halfvol melk melkuni zuivel"]
+    assert cleaned == ["halfvolle melk melkunie zuivel"]
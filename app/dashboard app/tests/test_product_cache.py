@@ -0,0 +1,107 @@
+import importlib
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def product_cache(monkeypatch):
+    # The snapshot talks to the API through services; these tests never get that far
+    services = types.ModuleType("services")
+    for name in ("get_all_newly_added_products", "get_incompleted_products_page", "get_product_changes",
+                 "get_products_info"):
+        setattr(services, name, lambda *args, **kwargs: pytest.fail("no API calls expected"))
+    monkeypatch.setitem(sys.modules, "services", services)
+    monkeypatch.delitem(sys.modules, "product_cache", raising=False)
+    return importlib.import_module("product_cache")
+
+
+def _table_row(product_id, scan_count, **values):
+    row = dict.fromkeys(["name_search", "energy", "protein", "unit", "synonyms", "brands", "brands_search",
+                         "categories", "barcode", "link_to"])
+    row.update(id=product_id, name=f"product {product_id}", scan_count=scan_count, active=0, cluster_id=1,
+               cluster_count=2, missing_field_count=3)
+    row.update(values)
+    return row
+
+
+def _feed_row(product_id, scan_count, **values):
+    # A row of the change feed: CHANGE_FIELDS only
+    return dict(_table_row(product_id, scan_count, is_incomplete=True, newly_added=0), **values)
+
+
+def test_changed_row_replaced_in_order(product_cache):
+    snapshot = product_cache.ProductSnapshot()
+    snapshot._frames["with_alike"] = pd.DataFrame([_table_row(1, 30), _table_row(2, 20), _table_row(3, 10)])
+    snapshot._cursors["with_alike"] = None
+
+    changed = pd.DataFrame([_feed_row(3, 25, name="renamed")])
+    df = snapshot._apply_changes("with_alike", changed, [1])
+    assert df['id'].tolist() == [3, 2]
+    assert df.loc[df['id'] == 3, 'name'].item() == "renamed"
+    # The feed's extra columns do not leak into a paged listing
+    assert list(df.columns) == list(snapshot._frames["with_alike"].columns)
+
+
+def test_rows_past_the_cursor_wait_for_their_page(product_cache):
+    snapshot = product_cache.ProductSnapshot()
+    snapshot._frames["with_alike"] = pd.DataFrame([_table_row(1, 30), _table_row(2, 20)])
+    snapshot._cursors["with_alike"] = "20:2"
+
+    changed = pd.DataFrame([_feed_row(4, 25), _feed_row(5, 5)])
+    df = snapshot._apply_changes("with_alike", changed, [])
+    assert df['id'].tolist() == [1, 4, 2]
+
+
+def test_rows_leaving_a_listing(product_cache):
+    snapshot = product_cache.ProductSnapshot()
+    snapshot._frames["with_alike"] = pd.DataFrame([_table_row(1, 30), _table_row(2, 20)])
+    snapshot._cursors["with_alike"] = None
+
+    # Product 2 is now alone in its cluster: it moves to the other tab
+    changed = pd.DataFrame([_feed_row(2, 20, cluster_count=1)])
+    assert snapshot._apply_changes("with_alike", changed, [])['id'].tolist() == [1]
+    assert snapshot._apply_changes("without_alike", changed, [])['id'].tolist() == [2]
+
+
+def test_newly_added_keeps_the_columns_not_in_the_feed(product_cache):
+    snapshot = product_cache.ProductSnapshot()
+    listed = pd.DataFrame([dict(_feed_row(7, 1, newly_added=1, is_incomplete=False), remarks="keep me", fat=1.5)])
+    snapshot._frames["newly_added"] = listed
+
+    changed = pd.DataFrame([_feed_row(7, 2, newly_added=1, is_incomplete=False, name="renamed"),
+                            _feed_row(8, 9, newly_added=1, is_incomplete=False)])
+    full_rows = pd.DataFrame([dict(_feed_row(8, 9, newly_added=1, is_incomplete=False), remarks="fetched", fat=0.5)])
+    df = snapshot._apply_changes("newly_added", changed, [], full_rows)
+
+    assert list(df.columns) == list(listed.columns)
+    assert df['id'].tolist() == [8, 7]
+    rows = df.set_index('id')
+    assert rows.loc[7, 'name'] == "renamed"
+    assert rows.loc[7, 'remarks'] == "keep me"
+    assert rows.loc[7, 'fat'] == 1.5
+    assert rows.loc[8, 'remarks'] == "fetched"
+
+
+def test_newly_added_without_full_row_is_left_out(product_cache):
+    snapshot = product_cache.ProductSnapshot()
+    listed = pd.DataFrame([dict(_feed_row(7, 1, newly_added=1), remarks="x")])
+    snapshot._frames["newly_added"] = listed
+
+    changed = pd.DataFrame([_feed_row(8, 9, newly_added=1)])
+    df = snapshot._apply_changes("newly_added", changed, [])
+    assert df['id'].tolist() == [7]
+    assert list(df.columns) == list(listed.columns)
+
+
+def test_null_scan_counts_sort_as_zero(product_cache):
+    snapshot = product_cache.ProductSnapshot()
+    snapshot._frames["with_alike"] = pd.DataFrame([_table_row(1, 30), _table_row(2, 0), _table_row(5, 0)])
+    snapshot._cursors["with_alike"] = None
+
+    # Like the API's COALESCE(scan_count, 0) DESC, id: a NULL count sits among the zeros by id
+    changed = pd.DataFrame([_feed_row(3, None), _feed_row(6, None), _feed_row(4, 10)])
+    df = snapshot._apply_changes("with_alike", changed, [])
+    assert df['id'].tolist() == [1, 4, 2, 3, 5, 6]
@@ -0,0 +1,74 @@
+import pytest
+from psycopg2 import sql
+
+from product_query import QueryError, build_product_query, decode_cursor, decode_sorted_cursor, encode_cursor
+
+COLUMNS = ['id', 'name', 'scan_count', 'energy', 'active']
+
+
+def _text(composable):
+    # The query as text without a connection (Identifier quoting simplified)
+    if isinstance(composable, sql.Composed):
+        return "".join(_text(part) for part in composable.seq)
+    if isinstance(composable, sql.Identifier):
+        return ".".join(f'"{s}"' for s in composable.strings)
+    if isinstance(composable, sql.SQL):
+        return composable.string
+    raise TypeError(composable)
+
+
+def test_default_cursor_round_trip():
+    cursor = encode_cursor({'id': 42, 'scan_count': 7})
+    assert cursor == "7:42"
+    assert decode_cursor(cursor) == (7, 42)
+    # A missing scan_count sorts like 0, as in ORDER_BY
+    assert encode_cursor({'id': 3, 'scan_count': None}) == "0:3"
+
+
+def test_default_cursor_condition():
+    query, params, limit = build_product_query({'cursor': "7:42", 'limit': "10"}, COLUMNS)
+    text = _text(query)
+    assert "(COALESCE(scan_count, 0) < %s OR (COALESCE(scan_count, 0) = %s AND id > %s))" in text
+    assert text.endswith("ORDER BY COALESCE(scan_count, 0) DESC, id LIMIT %s")
+    assert params == [7, 7, 42, 11]
+    assert limit == 10
+
+
+@pytest.mark.parametrize("direction, after", [("asc", ">"), ("desc", "<")])
+def test_sorted_cursor_condition(direction, after):
+    args = {'sort': 'name', 'direction': direction}
+    cursor = encode_cursor({'id': 5, 'name': "kaas"}, args)
+    assert decode_sorted_cursor(cursor, ('name', direction)) == ("kaas", 5)
+
+    query, params, _ = build_product_query(dict(args, cursor=cursor), COLUMNS)
+    text = _text(query)
+    assert f'("name" IS NULL OR "name" {after} %s OR ("name" = %s AND id > %s))' in text
+    assert text.endswith(f'ORDER BY "name" IS NULL, "name" {direction.upper()}, id')
+    assert params == ["kaas", "kaas", 5]
+
+
+def test_sorted_cursor_past_the_values():
+    # After the last non-empty value only the empty ones are left, in id order
+    args = {'sort': 'energy', 'direction': 'desc'}
+    cursor = encode_cursor({'id': 9, 'energy': None}, args)
+    query, params, _ = build_product_query(dict(args, cursor=cursor), COLUMNS)
+    assert '("energy" IS NULL AND id > %s)' in _text(query)
+    assert params == [9]
+
+
+def test_sort_column_added_to_fields():
+    query, _, _ = build_product_query({'fields': "id,scan_count", 'sort': 'energy'}, COLUMNS)
+    assert _text(query).startswith('SELECT "id", "scan_count", "energy" FROM product')
+
+
+@pytest.mark.parametrize("args", [
+    {'cursor': "not-a-cursor"},
+    {'sort': 'unknown'},
+    {'sort': 'name', 'direction': 'sideways'},
+    # A cursor of another sort order cannot be continued
+    {'sort': 'name', 'cursor': encode_cursor({'id': 1, 'energy': 2.0}, {'sort': 'energy'})},
+    {'sort': 'name', 'cursor': "7:42"},
+])
+def test_invalid_arguments(args):
+    with pytest.raises(QueryError):
+        build_product_query(args, COLUMNS)
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from search_index import SearchIndex
+
+
+def _scan(df, query, columns):
+    # What the dashboard did before the index: a substring scan of every cell
+    text = df[columns].fillna('').astype(str).apply(lambda column: column.str.lower())
+    found = text.apply(lambda column: column.str.contains(query.lower(), regex=False)).any(axis=1)
+    return set(df.loc[found, 'id'])
+
+
+@pytest.fixture
+def products():
+    return pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'name': ["Volle melk", "Jonge kaas", "Bio kaas 48+", "Halfvolle melk"],
+        'brands': ["Melkunie", "Milner", None, "Campina"],
+        'scan_count': [10, 40, 20, 30],
+    })
+
+
+@pytest.mark.parametrize("query", ["melk", "KAAS", "bio", "ka", "48+", "k", "e k", "unie", "none", "xyz"])
+def test_search_matches_scan(products, query):
+    index = SearchIndex(columns=['name', 'brands'])
+    index.sync(products)
+    assert index.search(query) == _scan(products, query, ['id', 'name', 'brands'])
+
+
+def test_match_does_not_span_cells(products):
+    index = SearchIndex(columns=['name', 'brands'])
+    index.sync(products)
+    # "melk" + "Melkunie" would read "melkmelk" if the cells were joined
+    assert index.search("melkmelk") == set()
+
+
+def test_sync_reindexes_only_the_delta(products):
+    index = SearchIndex(columns=['name', 'brands'])
+    assert index.sync(products) == 4
+    assert index.sync(products) == 0
+
+    # Columns outside the index do not count as a change
+    products.loc[0, 'scan_count'] = 99
+    assert index.sync(products) == 0
+
+    changed = products.copy()
+    changed.loc[1, 'name'] = "Oude kaas"
+    changed = changed[changed['id'] != 3]
+    changed = pd.concat([changed, pd.DataFrame([{'id': 5, 'name': "Karnemelk", 'brands': "Zuivelhoeve"}])])
+    assert index.sync(changed) == 3
+    for query in ["kaas", "jonge", "bio", "melk", "oude"]:
+        assert index.search(query) == _scan(changed, query, ['id', 'name', 'brands'])
+
+
+def test_sync_with_no_rows_clears(products):
+    index = SearchIndex()
+    index.sync(products)
+    assert index.sync(products.iloc[:0]) == 4
+    assert len(index) == 0
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sort_index import SortIndex
+
+
+@pytest.fixture
+def scans():
+    return pd.DataFrame({'scan_count': [3, np.nan, 1, 2], 'name': ["b", "d", "a", "c"]}, index=[10, 11, 12, 13])
+
+
+def test_order_matches_sort_values(scans):
+    index = SortIndex()
+    for ascending in (True, False):
+        expected = scans.sort_values('scan_count', ascending=ascending)
+        assert scans.iloc[index.positions(scans, 'scan_count', ascending, version=0)].index.tolist() == \
+            expected.index.tolist()
+
+
+def test_positions_of_a_selection(scans):
+    index = SortIndex()
+    rows = scans.loc[[10, 12, 11]]
+    assert scans.iloc[index.positions(scans, 'name', rows=rows, version=0)].index.tolist() == [12, 10, 11]
+
+
+def test_versions_kept_side_by_side(scans, monkeypatch):
+    index = SortIndex()
+    computed = []
+    compute = index._compute
+    monkeypatch.setattr(index, '_compute', lambda *args: computed.append(args[1]) or compute(*args))
+
+    newer = scans.copy()
+    newer.loc[12, 'scan_count'] = 9
+    # Two sessions on two versions of the listing sort in turn: each order is computed once
+    for _ in range(3):
+        index.order(scans, 'scan_count', version=1)
+        index.order(newer, 'scan_count', version=2)
+    assert computed == ['scan_count', 'scan_count']
+    assert scans.iloc[index.order(scans, 'scan_count', version=1)].index[0] == 12
+    assert newer.iloc[index.order(newer, 'scan_count', version=2)].index[0] == 13
+
+
+def test_unchanged_column_reused_by_a_new_version(scans, monkeypatch):
+    index = SortIndex()
+    computed = []
+    compute = index._compute
+    monkeypatch.setattr(index, '_compute', lambda *args: computed.append(args[1]) or compute(*args))
+
+    index.order(scans, 'scan_count', version=1)
+    renamed = scans.copy()
+    renamed.loc[12, 'name'] = "z"
+    index.order(renamed, 'scan_count', version=2)
+    index.order(renamed, 'name', version=2)
+    assert computed == ['scan_count', 'name']
+
+
+def test_least_recently_used_dropped(scans):
+    index = SortIndex(max_orders=2)
+    index.order(scans, 'scan_count', version=1)
+    index.order(scans, 'name', version=1)
+    index.order(scans, 'scan_count', version=1)
+    index.order(scans, 'name', version=2)
+    assert list(index._orders) == [(1, 'scan_count'), (2, 'name')]
+
+
+def test_no_version_not_cached(scans):
+    index = SortIndex()
+    index.order(scans, 'scan_count', ascending=False)
+    assert len(index) == 0
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class TokenCache:
+    """
+    Bounded LRU memo of a per-token string function (stemming, normalization keys).
+
+    The catalogue vocabulary is small and heavily repeated, so most lookups are hits. The
+    entries can be saved to / loaded from a JSON file to keep them across runs; `hits` and
+    `misses` count the lookups of this process.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # token -> value
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._new = None                # token -> value computed since record_new(), when recording
+        self._taken = (0, 0)            # hits/misses already handed out by take_new()
+
+    def get(self, token, compute):
+        """The cached value of `token`, computed with compute(token) on a miss."""
+        with self._lock:
+            value = self._entries.get(token)
+            if value is not None:
+                self.hits += 1
+                self._entries.move_to_end(token)
+                return value
+            self.misses += 1
+
+        value = compute(token)
+        with self._lock:
+            self._entries[token] = value
+            if self._new is not None:
+                self._new[token] = value
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+    def to_dict(self):
+        with self._lock:
+            return dict(self._entries)
+
+    def record_new(self):
+        """Starts keeping the values computed from now on for take_new() (in a pool worker)."""
+        with self._lock:
+            self._new = {}
+            self._taken = (self.hits, self.misses)
+
+    def take_new(self):
+        """
+        The entries computed and the hits/misses counted since the last call (or record_new()),
+        for merge() in the process that keeps the cache.
+        """
+        with self._lock:
+            entries, self._new = self._new or {}, {}
+            hits, misses = self.hits - self._taken[0], self.misses - self._taken[1]
+            self._taken = (self.hits, self.misses)
+        return {"entries": entries, "hits": hits, "misses": misses}
+
+    def merge(self, taken):
+        """Adds what take_new() returned in another process: its new entries and its counters."""
+        self.update(taken["entries"])
+        with self._lock:
+            self.hits += taken["hits"]
+            self.misses += taken["misses"]
+
+    def update(self, entries):
+        """Adds entries (e.g. loaded from disk) without counting them as lookups."""
+        with self._lock:
+            self._entries.update(entries)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def save_caches(path, caches):
+    """Writes {name: TokenCache} to one JSON file (written under a temp name, then renamed)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({name: cache.to_dict() for name, cache in caches.items()}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_caches(path, caches):
+    """Fills {name: TokenCache} from a file written by save_caches; returns False when there is none."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return False
+    for name, cache in caches.items():
+        cache.update(stored.get(name) or {})
+    return True
@@ -2,6 +2,7 @@ import re
 from shiny import App, reactive, render, ui
 import pandas as pd
 from pandas import DataFrame
+from schema import COMPUTED_COLUMNS
 
 # Keep alphanumerics and underscore; replace others with underscore
 def _sanitize_id(name: str) -> str:
@@ -15,7 +16,7 @@ def render_field(df: DataFrame, col_name: str):
     display_val = "" if (val is None or (isinstance(val, float) and pd.isna(val)) or (isinstance(val, str) and val == "nan")) else str(val)
     # If product is active (==1) make field unchangeable (read-only)
     # Also make 'id' and 'link_to' read-only
-    is_readonly = ("active" in row.index and row.get("active") == 1) or (col_name in ["id", "link_to", "cluster_id", "cluster_count", "app_ver", "created", "updated", "token"])
+    is_readonly = ("active" in row.index and row.get("active") == 1) or (col_name in ["id", "link_to", "cluster_id", "cluster_count", "app_ver", "created", "updated", "token"] + COMPUTED_COLUMNS)
     if is_readonly:
         return ui.tags.div(
             ui.tags.label(col_name, **{"for": input_id}, style="font-weight:600; margin-bottom:.25rem;"),
@@ -39,29 +40,30 @@ def render_field(df: DataFrame, col_name: str):
             style="display:flex; flex-direction:column; width:100%; max-width:320px;"
         )
 
-# Render the table to show in product_to_modify
-def render_table(df: pd.DataFrame):
-    if df is None or df.empty:
-        return ui.tags.div(ui.tags.p("No products.", style="color:#666;"))
-
-    # Decide columns to show (use sensible defaults if present)
-    base_cols = [c for c in ['id', 'name', 'energy', 'protein', 'unit', 'synonyms', 'brands', 'categories', 'link_to', 'scan_count'] if c in df.columns]
+# Columns of the product tables (those present in the data)
+TABLE_COLUMNS = ['id', 'name', 'energy', 'protein', 'unit', 'synonyms', 'brands', 'categories', 'link_to', 'scan_count', 'missing_field_count']
+# Height (px) of the scrolled area of a virtual table, and rows rendered above/below the visible ones
+VIRTUAL_TABLE_HEIGHT = 600
+VIRTUAL_TABLE_OVERSCAN = 20
+# Most rows sent for one window request
+VIRTUAL_TABLE_MAX_ROWS = 500
 
+def _table_header(cols, table_id):
     header_cells = []
-    for col in base_cols:
-        # Create sort buttons
+    for col in cols:
+        # Create sort buttons (each table has its own sort state, the input `<table_id>_sort`)
         sort_asc_btn = ui.tags.span(
             "▲",
             style="cursor:pointer; font-size:1rem; color:#ddd;",
-            onclick=f"event.stopPropagation(); Shiny.setInputValue('sort_column', '{col}'); Shiny.setInputValue('sort_direction', 'asc');"
+            onclick=f"event.stopPropagation(); Shiny.setInputValue('{table_id}_sort', {{column: '{col}', direction: 'asc'}}, {{priority: 'event'}});"
         )
         sort_desc_btn = ui.tags.span(
             "▼",
             style="cursor:pointer; font-size:1rem; color:#ddd;",
-            onclick=f"event.stopPropagation(); Shiny.setInputValue('sort_column', '{col}'); Shiny.setInputValue('sort_direction', 'desc');"
+            onclick=f"event.stopPropagation(); Shiny.setInputValue('{table_id}_sort', {{column: '{col}', direction: 'desc'}}, {{priority: 'event'}});"
         )
         
-        display_col = "alike products" if col == "cluster_count" else col
+        display_col = {"cluster_count": "alike products", "missing_field_count": "missing fields"}.get(col, col)
         
         header_content = ui.tags.div(
             ui.tags.span(display_col),
@@ -75,19 +77,32 @@ def render_table(df: pd.DataFrame):
         
         header_cells.append(ui.tags.th(header_content, style="padding:.25rem .5rem; text-align:left; border:1px solid #ddd;"))
 
-    header = ui.tags.tr(*header_cells)
+    return ui.tags.tr(*header_cells)
+
+def _display_value(col, val):
+    if col == "cluster_count":
+        try:
+            val = int(val) - 1
+        except:
+            pass
+    return str(val)
+
+# Render the table to show in product_to_modify
+def render_table(df: pd.DataFrame, table_id: str = "product_table"):
+    if df is None or df.empty:
+        return ui.tags.div(ui.tags.p("No products.", style="color:#666;"))
+
+    # Decide columns to show (use sensible defaults if present)
+    base_cols = [c for c in TABLE_COLUMNS if c in df.columns]
+
+    header = _table_header(base_cols, table_id)
     body_rows = []
     for _, row in df.iterrows():
         pid = row.get("id")
         cells = []
         for col in base_cols:
             val = row.get(col, "")
-            if col == "cluster_count":
-                try:
-                    val = int(val) - 1
-                except:
-                    pass
-            cells.append(ui.tags.td(str(val), style="padding:.25rem .5rem; vertical-align:center; border: 1px solid #ddd;"))
+            cells.append(ui.tags.td(_display_value(col, val), style="padding:.25rem .5rem; vertical-align:center; border: 1px solid #ddd;"))
             
         onclick = f"Shiny.setInputValue('modify_product_row', {repr(pid)}, {{priority: 'event'}});"
         body_rows.append(
@@ -109,6 +124,45 @@ def render_table(df: pd.DataFrame):
         table,
         style="margin-bottom:1rem;"
     )
+
+# Render an empty virtualized product table (rows are filled in by virtual_table.js)
+def render_virtual_table(table_id: str, empty_text: str = "No products found."):
+    """
+    The shell of a virtualized table: the header and an empty body. The browser only keeps
+    the visible rows (plus VIRTUAL_TABLE_OVERSCAN) in the DOM and asks the server for the
+    rows of the window it shows through the input `<table_id>_window`; the server answers
+    with table_window. So the HTML sent does not grow with the number of products, and
+    sorting/searching/refreshing only sends a new row count (see virtual_table.js).
+    """
+    table = ui.tags.table(
+        ui.tags.thead(_table_header(TABLE_COLUMNS, table_id)),
+        ui.tags.tbody(),
+        style="font-size:.85rem; border:1px solid #ddd;"
+    )
+    return ui.tags.div(
+        ui.tags.div(table, class_="virtual_table_viewport", style=f"max-height:{VIRTUAL_TABLE_HEIGHT}px; overflow-y:auto;"),
+        ui.tags.p(empty_text, class_="virtual_table_empty", style="display:none;"),
+        id=table_id,
+        class_="virtual_table",
+        style="margin-bottom:1rem;",
+        **{"data-columns": str(len(TABLE_COLUMNS)), "data-overscan": str(VIRTUAL_TABLE_OVERSCAN)}
+    )
+
+def table_window(df: pd.DataFrame, start: int, end: int, positions=None) -> dict:
+    """
+    Rows [start, end) of df as shown by a virtual table: {"ids": [...], "rows": [[cell, ...], ...]}.
+    `positions` is the order of the table as row positions of df (see sort_index.SortIndex),
+    None for the order of df; only the rows of the window are taken from df.
+    """
+    window = df.iloc[start:end] if positions is None else df.iloc[positions[start:end]]
+    columns = []
+    for col in TABLE_COLUMNS:
+        if col in window.columns:
+            columns.append([_display_value(col, val) for val in window[col].tolist()])
+        else:
+            columns.append([""] * len(window))
+    ids = window['id'].tolist() if 'id' in window.columns else [None] * len(window)
+    return {"ids": ids, "rows": [list(cells) for cells in zip(*columns)]}
     
 def render_alike_products_table(df, title, clicked_products, current_product_active, is_verified):
     """Renders a table of alike products (verified or unverified)."""
@@ -0,0 +1,213 @@
+// Virtualized product tables (tool_functions.render_virtual_table).
+//
+// Only the rows in view plus an overscan are in the DOM; the rest of the table is two spacer
+// rows. The rows of the shown window are asked from the server through the input
+// `<table id>_window` ({start, end, version, more}) and arrive as a `virtual_table_rows`
+// message. When the server side list changes (sort, search, new products) it only sends a
+// `virtual_table_reset` message with the new row count, and the visible window is asked again.
+(function () {
+  var tables = {};      // table id -> state of the table in the DOM
+  var lastReset = {};   // table id -> last reset message (the table may be rendered later)
+  var KEEP_ROWS = 1000; // cached rows kept around the window
+
+  function init(el) {
+    if (el._virtualTable) return;
+    var s = {
+      el: el,
+      id: el.id,
+      viewport: el.querySelector(".virtual_table_viewport"),
+      tbody: el.querySelector("tbody"),
+      empty: el.querySelector(".virtual_table_empty"),
+      columns: parseInt(el.dataset.columns, 10) || 1,
+      overscan: parseInt(el.dataset.overscan, 10) || 20,
+      rowHeight: 0,
+      version: null,
+      total: 0,
+      hasMore: false,
+      rows: {},
+      ids: {},
+      stale: {},
+      staleIds: {},
+      requested: null,
+      scrolled: false,
+      frame: null,
+    };
+    el._virtualTable = s;
+    tables[s.id] = s;
+
+    s.viewport.addEventListener("scroll", function () {
+      s.scrolled = true;
+      schedule(s);
+    });
+    s.tbody.addEventListener("click", function (e) {
+      var tr = e.target.closest("tr[data-id]");
+      if (tr) {
+        Shiny.setInputValue("modify_product_row", JSON.parse(tr.dataset.id), { priority: "event" });
+      }
+    });
+    if (lastReset[s.id]) reset(s, lastReset[s.id]);
+  }
+
+  function schedule(s) {
+    if (s.frame === null) {
+      s.frame = window.requestAnimationFrame(function () {
+        s.frame = null;
+        render(s);
+      });
+    }
+  }
+
+  function visibleRange(s) {
+    var rowHeight = s.rowHeight || 30;
+    var first = Math.floor(s.viewport.scrollTop / rowHeight);
+    var count = Math.ceil(s.viewport.clientHeight / rowHeight) + 1;
+    return [Math.max(0, first - s.overscan), Math.min(s.total, first + count + s.overscan)];
+  }
+
+  function spacer(height) {
+    var tr = document.createElement("tr");
+    tr.style.height = height + "px";
+    return tr;
+  }
+
+  function row(s, i) {
+    var cells = s.rows[i] || s.stale[i];
+    var id = i in s.ids ? s.ids[i] : s.staleIds[i];
+    var tr = document.createElement("tr");
+    tr.className = "incompleted_table_rows";
+    for (var c = 0; c < s.columns; c++) {
+      var td = document.createElement("td");
+      td.textContent = cells ? cells[c] : "…";
+      tr.appendChild(td);
+    }
+    if (cells) {
+      tr.dataset.id = JSON.stringify(id);
+      tr.style.cursor = "pointer";
+    }
+    return tr;
+  }
+
+  function render(s) {
+    s.empty.style.display = s.total === 0 && !s.hasMore ? "" : "none";
+    s.viewport.style.display = s.total === 0 && !s.hasMore ? "none" : "";
+
+    var range = visibleRange(s);
+    var start = range[0], end = range[1];
+    var rowHeight = s.rowHeight || 30;
+    var body = document.createDocumentFragment();
+    body.appendChild(spacer(start * rowHeight));
+    for (var i = start; i < end; i++) body.appendChild(row(s, i));
+    body.appendChild(spacer((s.total - end) * rowHeight));
+    if (s.hasMore) {
+      var more = document.createElement("tr");
+      var td = document.createElement("td");
+      td.colSpan = s.columns;
+      td.textContent = "Loading more products…";
+      td.style.color = "#666";
+      more.appendChild(td);
+      body.appendChild(more);
+    }
+    s.tbody.replaceChildren(body);
+
+    // Row height of the first rendered row (the spacers are sized with it)
+    if (!s.rowHeight && end > start) {
+      var height = s.tbody.children[1].getBoundingClientRect().height;
+      if (height > 0) {
+        s.rowHeight = height;
+        schedule(s);
+      }
+    }
+
+    request(s, start, end);
+    forget(s, start, end);
+  }
+
+  function request(s, start, end) {
+    if (s.version === null) return;
+    var first = -1, last = -1;
+    for (var i = start; i < end; i++) {
+      if (!(i in s.rows)) {
+        if (first < 0) first = i;
+        last = i;
+      }
+    }
+    // The next page is only loaded for a window that reaches the end after the user scrolled
+    // (or when the loaded rows do not fill the view), not for every refresh
+    var fits = s.viewport.scrollHeight <= s.viewport.clientHeight;
+    var more = s.hasMore && end >= s.total && (s.scrolled || fits);
+    if (first < 0 && !more) return;
+
+    var span = first < 0 ? { start: s.total, end: s.total } : { start: first, end: last + 1 };
+    var key = s.version + ":" + span.start + ":" + span.end + ":" + more;
+    if (key === s.requested) return;
+    s.requested = key;
+    Shiny.setInputValue(s.id + "_window",
+      { start: span.start, end: span.end, version: s.version, more: more },
+      { priority: "event" });
+  }
+
+  function forget(s, start, end) {
+    // Keep memory flat: drop cached rows far away from the window
+    for (var key in s.rows) {
+      var i = +key;
+      if (i < start - KEEP_ROWS || i >= end + KEEP_ROWS) {
+        delete s.rows[key];
+        delete s.ids[key];
+      }
+    }
+  }
+
+  function reset(s, msg) {
+    // Rows of the previous version stay on screen until the new ones arrive (no flicker)
+    s.stale = s.rows;
+    s.staleIds = s.ids;
+    s.rows = {};
+    s.ids = {};
+    s.version = msg.version;
+    s.total = msg.total;
+    s.hasMore = msg.has_more;
+    s.requested = null;
+    s.scrolled = false;
+    schedule(s);
+  }
+
+  function current(id) {
+    var s = tables[id];
+    return s && document.body.contains(s.el) ? s : null;
+  }
+
+  $(function () {
+    Shiny.addCustomMessageHandler("virtual_table_reset", function (msg) {
+      lastReset[msg.id] = msg;
+      var s = current(msg.id);
+      if (s) reset(s, msg);
+    });
+
+    Shiny.addCustomMessageHandler("virtual_table_rows", function (msg) {
+      var s = current(msg.id);
+      if (!s || msg.version !== s.version) return;
+      for (var i = 0; i < msg.rows.length; i++) {
+        s.rows[msg.start + i] = msg.rows[i];
+        s.ids[msg.start + i] = msg.ids[i];
+      }
+      s.stale = {};
+      s.staleIds = {};
+      s.requested = null;
+      schedule(s);
+    });
+
+    // Tables in a hidden tab have no height yet: lay them out again once shown
+    $(document).on("shown.bs.tab", function () {
+      for (var id in tables) schedule(tables[id]);
+    });
+    window.addEventListener("resize", function () {
+      for (var id in tables) schedule(tables[id]);
+    });
+
+    // Tables are (re-)rendered by Shiny outputs: set up every new one
+    document.querySelectorAll(".virtual_table").forEach(init);
+    new MutationObserver(function () {
+      document.querySelectorAll(".virtual_table").forEach(init);
+    }).observe(document.body, { childList: true, subtree: true });
+  });
+})();